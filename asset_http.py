@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Отдача статики сервером: ETag по содержимому, 304 и Cache-Control.
+
+ETag считается по содержимому один раз на файл и кешируется, пока не
+изменятся inode, mtime или размер: файлы переписываются через rename, так
+что кеш каждого процесса сервера видит и чужие изменения. Варианты из
+w/rs с отпечатком в имени (name.<hash>.ext) отдаются как immutable на год,
+gallery.json и HTML — с короткой ревалидацией. Текстовые файлы отдаются из заранее сжатых копий
+(.br/.gz, см. precompress.py) по Accept-Encoding с Vary: Accept-Encoding.
+
+Видео отдаются через send_media с явной поддержкой Range: одиночные и
+множественные диапазоны (206, multipart/byteranges), If-Range и 416.
+Тело читается ограниченными кусками или через wsgi.file_wrapper, так что
+WSGI-сервер с sendfile (gunicorn) отдаёт диапазон без копирования.
+"""
+from __future__ import annotations
+
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Response, current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, is_resource_modified, parse_date, unquote_etag
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from werkzeug.wsgi import wrap_file
+
+from asset_manifest import file_hash
+from precompress import available_encodings, compressed_sibling, is_compressible
+
+# name.0123456789.webp — десять hex-символов отпечатка перед расширением
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+# Отпечатки ставит только update_gallery_assets (DEFAULT_OUTPUT_DIR); такое же
+# имя в другом месте (загрузка, файл сайта) может быть перезаписано
+FINGERPRINT_DIRS = ("w/rs/",)
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+GALLERY_MAX_AGE = 60
+DEFAULT_MAX_AGE = 60 * 60
+
+RANGE_CHUNK = 256 * 1024
+# Больше диапазонов в одном запросе не обслуживаем: отдаём файл целиком
+MAX_RANGES = 16
+
+# Больше ETag в кеше процесса не держим (каждый воркер хранит свой)
+ETAG_CACHE_SIZE = 4096
+
+_etags: Dict[str, Tuple[Tuple[int, int, int, int], str]] = {}
+_etags_lock = threading.Lock()
+
+
+def file_etag(path: str) -> str:
+    """Сильный ETag по содержимому; пересчитывается только при смене файла."""
+    st = os.stat(path)
+    signature = (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+    with _etags_lock:
+        cached = _etags.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    etag = file_hash(path)[:32]
+    with _etags_lock:
+        if len(_etags) >= ETAG_CACHE_SIZE:
+            # Вытесняем самую старую запись (словарь хранит порядок вставки)
+            _etags.pop(next(iter(_etags)))
+        _etags[path] = (signature, etag)
+    return etag
+
+
+def is_fingerprinted(filename: str) -> bool:
+    """Вариант с отпечатком в имени: путь от корня сайта внутри FINGERPRINT_DIRS."""
+    path = posixpath.normpath(filename.replace(os.sep, "/")).lstrip("/")
+    return path.startswith(FINGERPRINT_DIRS) and bool(FINGERPRINT_RE.search(path))
+
+
+def cache_policy(filename: str) -> Tuple[int, bool]:
+    """(max_age, immutable) для файла."""
+    name = filename.lower()
+    if is_fingerprinted(name):
+        return IMMUTABLE_MAX_AGE, True
+    if name.endswith(".json"):
+        return GALLERY_MAX_AGE, False
+    if name.endswith(".html"):
+        return 0, False
+    return DEFAULT_MAX_AGE, False
+
+
+def negotiate_encoding(path: str) -> Tuple[Optional[str], str]:
+    """
+    Выбирает лучшую актуальную сжатую копию, которую принимает клиент.
+    Возвращает (encoding, путь к отдаваемому файлу).
+    """
+    accepted = request.accept_encodings
+    for encoding in available_encodings():
+        if accepted[encoding] <= 0:
+            continue
+        sibling = compressed_sibling(path, encoding)
+        if sibling:
+            return encoding, sibling
+    return None, path
+
+
+def send_asset(
+    directory: str,
+    filename: str,
+    max_age: Optional[int] = None,
+    allow_ranges: bool = True,
+):
+    """
+    send_from_directory с ETag по содержимому и политикой кеширования.
+    Условные запросы (If-None-Match/If-Modified-Since) получают 304.
+    allow_ranges=False отдаёт файл целиком, игнорируя Range.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    policy_age, immutable = cache_policy(filename)
+    if max_age is None:
+        max_age = policy_age
+
+    compressible = is_compressible(path)
+    encoding, served_path = negotiate_encoding(path) if compressible else (None, path)
+
+    environ = request.environ
+    if not allow_ranges:
+        environ = {
+            key: value
+            for key, value in environ.items()
+            if key not in ("HTTP_RANGE", "HTTP_IF_RANGE")
+        }
+    response = send_file(
+        served_path,
+        environ,
+        mimetype=mimetypes.guess_type(path)[0],
+        etag=file_etag(served_path),
+        max_age=max_age,
+        conditional=True,
+        use_x_sendfile=current_app.config["USE_X_SENDFILE"],
+        response_class=current_app.response_class,
+    )
+    if encoding:
+        response.content_encoding = encoding
+    if compressible:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    elif max_age <= GALLERY_MAX_AGE:
+        response.cache_control.must_revalidate = True
+    return response
+
+
+class _RangeFile:
+    """
+    Файл, ограниченный диапазоном [start, start + length).
+    read() не выходит за границу; fileno() и текущая позиция позволяют
+    WSGI-серверу отдать диапазон через sendfile.
+    """
+
+    def __init__(self, path: str, start: int, length: int):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def parse_ranges(value: str) -> Optional[List[Tuple[Optional[int], Optional[int]]]]:
+    """
+    Разбирает Range: bytes=... в список (start, stop) с stop не включительно.
+    Суффиксный диапазон (bytes=-N) — (None, N), открытый (bytes=N-) — (N, None).
+    В отличие от werkzeug, допускает неупорядоченные и пересекающиеся диапазоны.
+    None — заголовок некорректен и должен игнорироваться.
+    """
+    units, _, spec = value.partition("=")
+    if units.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges: List[Tuple[Optional[int], Optional[int]]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if not sep:
+            return None
+        try:
+            if not first.strip():
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                ranges.append((None, suffix))
+                continue
+            start = int(first)
+            stop = int(last) + 1 if last.strip() else None
+        except ValueError:
+            return None
+        if start < 0 or (stop is not None and stop <= start):
+            return None
+        ranges.append((start, stop))
+    return ranges or None
+
+
+def _resolve_ranges(
+    ranges: List[Tuple[Optional[int], Optional[int]]], length: int
+) -> List[Tuple[int, int]]:
+    """
+    Переводит разобранные диапазоны в [start, stop) для файла длины length,
+    отбрасывает невыполнимые и сливает пересекающиеся и соседние.
+    """
+    resolved = []
+    for start, stop in ranges:
+        if start is None:
+            start, stop = max(0, length - stop), length
+        else:
+            stop = length if stop is None else min(stop, length)
+        if start < stop:
+            resolved.append((start, stop))
+    resolved.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, stop in resolved:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _iter_multipart(
+    path: str,
+    ranges: List[Tuple[int, int]],
+    parts: List[bytes],
+    closing: bytes,
+) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        for (start, stop), head in zip(ranges, parts):
+            yield head
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(RANGE_CHUNK, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            yield b"\r\n"
+    yield closing
+
+
+def if_range_matches(
+    value: str, etag: str, last_modified: datetime, now: Optional[datetime] = None
+) -> bool:
+    """
+    Проверка If-Range по RFC 9110 §13.1.5: диапазон отдаётся, только если
+    валидатор сильный и в точности совпадает с текущим. Слабый ETag не
+    подходит никогда; дата считается сильным валидатором, только если
+    Last-Modified хотя бы на секунду старше Date ответа (иначе файл мог
+    измениться в ту же секунду).
+    """
+    value = value.strip()
+    if value.startswith("W/"):
+        return False
+    if value.startswith('"'):
+        tag, weak = unquote_etag(value)
+        return not weak and tag == etag
+    date = parse_date(value)
+    if date is None:
+        return False
+    now = now or datetime.now(timezone.utc)
+    return date == last_modified and (now - last_modified).total_seconds() >= 1
+
+
+def send_media(directory: str, filename: str):
+    """
+    Отдача медиафайла с поддержкой Range.
+    Без Range (или если If-Range не совпал) — обычный send_asset.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    st = os.stat(path)
+    length = st.st_size
+    etag = file_etag(path)
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+
+    header = request.headers.get("Range")
+    if not header:
+        return send_asset(directory, filename)
+    # Условия проверяются до Range: при совпадении If-None-Match — 304
+    if not is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified, ignore_if_range=True
+    ):
+        return send_asset(directory, filename, allow_ranges=False)
+
+    if_range = request.headers.get("If-Range")
+    if if_range is not None and not if_range_matches(if_range, etag, last_modified):
+        return send_asset(directory, filename, allow_ranges=False)
+
+    parsed = parse_ranges(header)
+    if parsed is None or len(parsed) > MAX_RANGES:
+        return send_asset(directory, filename, allow_ranges=False)
+
+    ranges = _resolve_ranges(parsed, length)
+    if not ranges:
+        response = Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{length}"
+        return response
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    max_age, immutable = cache_policy(filename)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        body = wrap_file(request.environ, _RangeFile(path, start, stop - start), RANGE_CHUNK)
+        response = Response(body, status=206, mimetype=mimetype, direct_passthrough=True)
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+        response.content_length = stop - start
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n"
+            ).encode("ascii")
+            for start, stop in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode("ascii")
+        content_length = (
+            sum(len(head) + (stop - start) + 2 for head, (start, stop) in zip(parts, ranges))
+            + len(closing)
+        )
+        response = Response(
+            _iter_multipart(path, ranges, parts, closing),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+            direct_passthrough=True,
+        )
+        response.content_length = content_length
+
+    response.accept_ranges = "bytes"
+    response.set_etag(etag)
+    response.headers["Last-Modified"] = http_date(last_modified)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
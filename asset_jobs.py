@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Фоновая очередь задач синхронизации ассетов галереи.
+
+Задача — «синхронизировать эти исходники» (или всю галерею). Пока задача
+ждёт в очереди, новые запросы сливаются с ней, так что серия загрузок
+порождает один прогон. Статус и прогресс доступны по id задачи.
+
+С state_dir состояние задач пишется в <state_dir>/<id>.json, так что
+статус задачи виден любому процессу сервера, а не только тому, который
+её принял. id включает pid процесса и не пересекаются между воркерами.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Сколько завершённых задач хранить для /jobs/<id>
+MAX_FINISHED_JOBS = 200
+# Прогресс на диск пишется не чаще, чем раз в столько секунд
+PROGRESS_PERSIST_INTERVAL = 0.5
+# Файлы состояния старше суток (например, от завершившихся воркеров) удаляются
+JOB_STATE_TTL = 24 * 60 * 60
+
+
+class Job:
+    def __init__(
+        self,
+        job_id: str,
+        srcs: Optional[Iterable[str]],
+        on_progress: Optional[Callable[["Job"], None]] = None,
+    ):
+        self.id = job_id
+        # None — синхронизировать всю галерею
+        self.srcs = set(srcs) if srcs is not None else None
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._on_progress = on_progress
+
+    def merge(self, srcs: Optional[Iterable[str]]) -> None:
+        if self.srcs is None:
+            return
+        if srcs is None:
+            self.srcs = None
+        else:
+            self.srcs.update(srcs)
+
+    def set_progress(self, done: int, total: int) -> None:
+        self.done = done
+        self.total = total
+        if self._on_progress:
+            self._on_progress(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "srcs": sorted(self.srcs) if self.srcs is not None else None,
+            "progress": {"done": self.done, "total": self.total},
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Очередь с пулом потоков-воркеров. runner(job) выполняет задачу, сообщает
+    прогресс через job.set_progress и возвращает сводку (dict) либо бросает
+    исключение. state_dir — каталог общего с другими процессами состояния.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Job], Optional[dict]],
+        workers: int = 2,
+        state_dir: Optional[str] = None,
+    ):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.state_dir = state_dir
+        self._jobs: Dict[str, Job] = {}
+        self._finished: List[str] = []
+        self._pending: Optional[Job] = None
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._threads: List[threading.Thread] = []
+        self._persisted_at: Dict[str, float] = {}
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            self._prune_states()
+
+    def _ensure_started(self) -> None:
+        # Потоки стартуют лениво: в дочернем процессе reloader'а Flask
+        # и при импорте модуля ничего не запускается зря.
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"asset-job-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, srcs: Optional[Iterable[str]] = None) -> Job:
+        """
+        Ставит синхронизацию в очередь. Если ещё не начатая задача уже есть,
+        исходники добавляются в неё и возвращается она же.
+        """
+        with self._lock:
+            self._ensure_started()
+            pending = self._pending
+            if pending is not None and pending.status == QUEUED:
+                pending.merge(srcs)
+                self._persist(pending)
+                return pending
+            job = Job(f"{os.getpid()}-{next(self._ids)}", srcs, self._persist_progress)
+            self._jobs[job.id] = job
+            self._pending = job
+            self._persist(job)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Состояние задачи этого процесса или, с state_dir, любого другого."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        path = self._state_path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _state_path(self, job_id: str) -> Optional[str]:
+        # id приходит из URL: только имена вида <pid>-<n>
+        if not self.state_dir or not job_id.replace("-", "").isdigit():
+            return None
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _persist(self, job: Job) -> None:
+        path = self._state_path(job.id)
+        if path is None:
+            return
+        self._persisted_at[job.id] = time.monotonic()
+        fd, tmp_path = tempfile.mkstemp(prefix=".job-", dir=self.state_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(job.to_dict(), f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _persist_progress(self, job: Job) -> None:
+        if time.monotonic() - self._persisted_at.get(job.id, 0) >= PROGRESS_PERSIST_INTERVAL:
+            self._persist(job)
+
+    def _prune_states(self) -> None:
+        cutoff = time.time() - JOB_STATE_TTL
+        for entry in os.scandir(self.state_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.status = RUNNING
+                job.started_at = time.time()
+                if self._pending is job:
+                    self._pending = None
+                self._persist(job)
+            try:
+                job.result = self.runner(job)
+                job.status = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+                traceback.print_exc()
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._persist(job)
+                self._retire(job)
+                self._queue.task_done()
+
+    def _retire(self, job: Job) -> None:
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > MAX_FINISHED_JOBS:
+                job_id = self._finished.pop(0)
+                self._jobs.pop(job_id, None)
+                self._persisted_at.pop(job_id, None)
+                path = self._state_path(job_id)
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def join(self) -> None:
+        """Ждёт завершения всех поставленных задач."""
+        self._queue.join()
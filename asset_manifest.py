@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Манифест сгенерированных ассетов галереи.
+
+Для каждого исходника хранит хеш содержимого, mtime, размер файла, размеры
+изображения и список сгенерированных вариантов с параметрами кодирования
+и размером в байтах.
+По нему update_gallery пропускает нетронутые файлы без их открытия,
+пересобирает только изменённые и удаляет осиротевшие файлы в w/rs.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows: сборки не согласуются, как раньше
+    fcntl = None
+
+MANIFEST_NAME = ".manifest.json"
+BUILD_LOCK_NAME = ".build.lock"
+MANIFEST_VERSION = 2
+HASH_CHUNK = 1024 * 1024
+
+
+def default_manifest_path(output_dir: str) -> str:
+    return os.path.join(output_dir, MANIFEST_NAME)
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 содержимого файла, читается потоково."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_signature(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"mtime_ns": st.st_mtime_ns, "bytes": st.st_size}
+
+
+class AssetManifest:
+    """
+    Словарь src → запись. Запись:
+    {hash, mtime_ns, bytes, width, height, options, srcset, preview, sources,
+     placeholder, color, dhash, variants: [{path, target, width, height, format, params, bytes}]}
+    У видео вместо srcset/preview/sources/dhash — poster, poster_srcset,
+    poster_sources и streams: [{src, type, width, height, bytes}].
+    options — параметры сборки (размеры, кодирование, именование); при их
+    смене запись считается устаревшей.
+    """
+
+    def __init__(self, path: str, entries: Optional[Dict[str, dict]] = None, loaded: bool = False):
+        self.path = path
+        self.entries: Dict[str, dict] = entries or {}
+        # False — манифест создан заново (файла не было, он битый или
+        # другой версии) и ничего не знает об уже лежащих в w/rs файлах
+        self.loaded = loaded
+
+    @classmethod
+    def load(cls, path: str) -> "AssetManifest":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return cls(path)
+        if data.get("version") != MANIFEST_VERSION:
+            return cls(path)
+        return cls(path, data.get("items", {}), loaded=True)
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": MANIFEST_VERSION, "items": self.entries},
+                    f,
+                    ensure_ascii=False,
+                    indent=1,
+                    sort_keys=True,
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, src: str) -> Optional[dict]:
+        return self.entries.get(src)
+
+    def set(self, src: str, entry: dict) -> None:
+        self.entries[src] = entry
+
+    def prune(self, keep: Iterable[str]) -> List[str]:
+        """Удаляет записи для исходников, которых больше нет в галерее."""
+        keep = set(keep)
+        dropped = [src for src in self.entries if src not in keep]
+        for src in dropped:
+            del self.entries[src]
+        return dropped
+
+    def is_fresh(self, src: str, options: dict) -> bool:
+        """
+        Запись актуальна, если mtime и размер исходника не менялись,
+        параметры сборки те же, и все варианты на месте.
+        Исходник при этом не открывается.
+        """
+        entry = self.entries.get(src)
+        if not entry:
+            return False
+        try:
+            signature = stat_signature(src)
+        except OSError:
+            return False
+        if (
+            entry.get("mtime_ns") != signature["mtime_ns"]
+            or entry.get("bytes") != signature["bytes"]
+            or entry.get("options") != options
+        ):
+            return False
+        return variants_exist(entry)
+
+    def referenced_files(self) -> Set[str]:
+        return {
+            os.path.normpath(variant["path"])
+            for entry in self.entries.values()
+            for variant in entry.get("variants", [])
+        }
+
+
+class BuildLock:
+    """
+    Разделяемая блокировка каталога вариантов (flock) на время сборки.
+    Сборок может идти несколько сразу (потоки очереди задач, процессы
+    сервера), а их новые варианты попадают в манифест только в конце.
+    Поэтому удалять осиротевшие файлы можно, лишь когда других сборок нет:
+    exclusive() пробует взять исключительную блокировку без ожидания.
+    """
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, BUILD_LOCK_NAME)
+        self._file = None
+
+    def __enter__(self) -> "BuildLock":
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_SH)
+        return self
+
+    def exclusive(self) -> bool:
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Смена режима flock не атомарна: разделяемую блокировку возвращаем
+            fcntl.flock(self._file, fcntl.LOCK_SH)
+            return False
+        return True
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+        self._file = None
+
+
+def variants_exist(entry: dict) -> bool:
+    return all(os.path.exists(variant["path"]) for variant in entry.get("variants", []))
+
+
+def collect_garbage(
+    manifest: AssetManifest, output_dir: str, keep: Iterable[str] = ()
+) -> List[str]:
+    """
+    Удаляет из output_dir файлы, на которые не ссылается ни одна запись
+    манифеста и которых нет в keep. Манифест, созданный заново, не полон —
+    с ним ничего не удаляется.
+    """
+    if not manifest.loaded or not os.path.isdir(output_dir):
+        return []
+    referenced = manifest.referenced_files() | {os.path.normpath(path) for path in keep}
+    manifest_path = os.path.normpath(manifest.path)
+    removed = []
+    for name in os.listdir(output_dir):
+        path = os.path.normpath(os.path.join(output_dir, name))
+        if path == manifest_path or name.startswith(".") or not os.path.isfile(path):
+            continue
+        if path not in referenced:
+            os.remove(path)
+            removed.append(path)
+    return removed
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Наблюдение за файлами для update_gallery_assets.py --watch.
+
+На Linux используется inotify (через ctypes, без зависимостей): процесс
+спит в poll() и просыпается только на события. Каталоги наблюдаются
+рекурсивно (новые подкаталоги подхватываются на лету), отдельные файлы —
+через их каталог с фильтром по имени, так что замена файла через rename
+тоже видна. Там, где inotify нет, раз в POLL_INTERVAL секунд сравниваются
+mtime/размер/inode.
+
+Скрытые файлы (временные .upload-*, .video-* и т. п.) игнорируются.
+batches() копит события, пока не наступит тишина в debounce секунд (но не
+дольше max_delay), и отдаёт их одной пачкой путей; None вместо пачки —
+очередь событий переполнилась, и менялось что угодно.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+DEBOUNCE = 1.0
+MAX_DELAY = 10.0
+POLL_INTERVAL = 2.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Файл считается изменённым, когда его дописали, переименовали или удалили;
+# IN_CREATE нужен только для новых каталогов
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ATTRIB | IN_ONLYDIR
+)
+CHANGE_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_ATTRIB
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+def _visible(name: str) -> bool:
+    return not name.startswith(".")
+
+
+class _Targets:
+    """Что наблюдать: каталоги рекурсивно, файлы по именам в их каталогах."""
+
+    def __init__(self, dirs: Iterable[str], files: Iterable[str], exclude: Iterable[str]):
+        self.dirs = [os.path.normpath(d) for d in dirs]
+        self.exclude = {os.path.normpath(d) for d in exclude}
+        self.files: Dict[str, Set[str]] = {}
+        for path in files:
+            parent, name = os.path.split(os.path.normpath(path))
+            self.files.setdefault(parent or ".", set()).add(name)
+
+    def excluded(self, path: str) -> bool:
+        return os.path.normpath(path) in self.exclude
+
+    def walk(self, root: str) -> Iterator[Tuple[str, list]]:
+        """Каталоги поддерева root (без исключённых и скрытых) и их файлы."""
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [
+                d for d in dirnames
+                if _visible(d) and not self.excluded(os.path.join(dirpath, d))
+            ]
+            yield dirpath, [f for f in filenames if _visible(f)]
+
+
+class InotifyWatcher:
+    """Наблюдение через inotify; OSError, если он недоступен."""
+
+    def __init__(self, dirs: Iterable[str], files: Iterable[str] = (), exclude: Iterable[str] = ()):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._libc = libc
+        self._targets = _Targets(dirs, files, exclude)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._poller = select.poll()
+        self._poller.register(fd, select.POLLIN)
+        # wd → (каталог, рекурсивно ли)
+        self._watches: Dict[int, Tuple[str, bool]] = {}
+        try:
+            for root in self._targets.dirs:
+                self._watch_tree(root)
+            for parent in self._targets.files:
+                self._add_watch(parent, recursive=False)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_watch(self, path: str, recursive: bool) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+        known = self._watches.get(wd)
+        self._watches[wd] = (path, recursive or bool(known and known[1]))
+
+    def _watch_tree(self, root: str) -> Set[str]:
+        """Наблюдает поддерево root; возвращает уже лежащие в нём файлы."""
+        found: Set[str] = set()
+        for dirpath, filenames in self._targets.walk(root):
+            self._add_watch(dirpath, recursive=True)
+            found.update(os.path.join(dirpath, name) for name in filenames)
+        return found
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        """
+        Ждёт события не дольше timeout секунд (None — без ограничения).
+        Возвращает изменённые пути (пусто по таймауту) или None при переполнении.
+        """
+        ready = self._poller.poll(None if timeout is None else max(0, int(timeout * 1000)))
+        if not ready:
+            return set()
+        changed: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW or not self._handle(wd, mask, name, changed):
+                    return None
+
+    def _handle(self, wd: int, mask: int, name: str, changed: Set[str]) -> bool:
+        """Добавляет путь события в changed; False — нужно перечитать всё."""
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return True
+        watch = self._watches.get(wd)
+        if watch is None:
+            return True
+        directory, recursive = watch
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # Корень наблюдения удалён или перенесён — пусть перечитают всё
+            return directory not in self._targets.dirs
+        if not name or not _visible(name):
+            return True
+        path = os.path.normpath(os.path.join(directory, name))
+        if mask & IN_ISDIR:
+            if recursive and mask & (IN_CREATE | IN_MOVED_TO) and not self._targets.excluded(path):
+                # Файлы могли появиться раньше, чем каталог взят под наблюдение
+                changed.update(self._watch_tree(path))
+            elif recursive and mask & (IN_DELETE | IN_MOVED_FROM):
+                changed.add(path)
+            return True
+        if not mask & CHANGE_MASK:
+            return True
+        names = self._targets.files.get(directory)
+        if recursive or (names is not None and name in names):
+            changed.add(path)
+        return True
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> "InotifyWatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PollingWatcher:
+    """Запасной вариант: сравнение mtime/размера/inode раз в interval секунд."""
+
+    def __init__(
+        self,
+        dirs: Iterable[str],
+        files: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+        interval: float = POLL_INTERVAL,
+    ):
+        self._targets = _Targets(dirs, files, exclude)
+        self.interval = interval
+        self._state = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int, int]]:
+        state: Dict[str, Tuple[int, int, int]] = {}
+        paths = [
+            os.path.normpath(os.path.join(parent, name))
+            for parent, names in self._targets.files.items()
+            for name in names
+        ]
+        for root in self._targets.dirs:
+            for dirpath, filenames in self._targets.walk(root):
+                paths.extend(os.path.join(dirpath, name) for name in filenames)
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            state[path] = (st.st_ino, st.st_mtime_ns, st.st_size)
+        return state
+
+    def read(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+            state = self._scan()
+            changed = {
+                path for path in state.keys() | self._state.keys()
+                if state.get(path) != self._state.get(path)
+            }
+            self._state = state
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "PollingWatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_watcher(
+    dirs: Iterable[str],
+    files: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    polling: bool = False,
+):
+    """InotifyWatcher, а если inotify нет (или polling=True) — PollingWatcher."""
+    dirs, files, exclude = list(dirs), list(files), list(exclude)
+    if not polling:
+        try:
+            return InotifyWatcher(dirs, files, exclude)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(dirs, files, exclude)
+
+
+def batches(
+    watcher, debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY
+) -> Iterator[Optional[Set[str]]]:
+    """Пачки изменённых путей после затишья в debounce секунд."""
+    while True:
+        changes = watcher.read()
+        if changes is not None and not changes:
+            continue
+        pending: Optional[Set[str]] = changes
+        deadline = time.monotonic() + max_delay
+        while True:
+            remaining = min(debounce, deadline - time.monotonic())
+            if remaining <= 0:
+                break
+            more = watcher.read(remaining)
+            if more is None:
+                pending = None
+            elif not more:
+                break
+            elif pending is not None:
+                pending |= more
+        yield pending
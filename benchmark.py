@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки конвейера ассетов и горячих путей сервера.
+
+Во временном каталоге синтезируется галерея заданного размера (разные
+пропорции и форматы, часть — анимированные GIF/WebP), после чего
+замеряются:
+- build_srcset на выборке изображений, update_gallery,
+  resize_images.process_all_images и generate_static_html — холодный
+  и повторный (тёплый) прогон, пиковый RSS;
+- задержка и пропускная способность /gallery.json, раздачи статики
+  (serve_static) и /upload через тестовый клиент Flask.
+
+Каждый этап выполняется в отдельном процессе (spawn), поэтому ни пиковый
+RSS, ни кеши модулей не перетекают из этапа в этап. Синтезированные
+изображения детерминированы (--seed) и переиспользуются из --workdir.
+
+Результаты — JSON для сравнения между коммитами:
+    python3 benchmark.py --items 100,1000 --output bench-new.json
+    python3 benchmark.py --items 100,1000 --compare bench-old.json
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["build_srcset", "update_gallery", "generate_static", "resize_images", "http"]
+# Пропорции синтезированных изображений (ширина, высота)
+ASPECT_RATIOS = [(1, 1), (4, 3), (3, 4), (3, 2), (2, 3), (16, 9), (9, 16)]
+# Форматы статичных изображений; в галерее в основном WebP
+STILL_FORMATS = [("webp", "WEBP"), ("webp", "WEBP"), ("webp", "WEBP"), ("jpg", "JPEG"), ("png", "PNG")]
+ANIMATED_FORMATS = [("gif", "GIF"), ("webp", "WEBP")]
+ANIMATED_FRAMES = 4
+# Сторона шума, из которого растягивается картинка: плавные пятна
+# сжимаются похоже на настоящие фото, а не на белый шум
+NOISE_CELLS = 12
+STAMP_NAME = ".benchmark.json"
+PRISTINE_GALLERY = "gallery.pristine.json"
+
+
+# Синтез галереи
+
+
+def _synth_image(rng: random.Random, size: Tuple[int, int]) -> Image.Image:
+    cells = (NOISE_CELLS, max(1, round(NOISE_CELLS * size[1] / size[0])))
+    noise = Image.frombytes("RGB", cells, rng.randbytes(cells[0] * cells[1] * 3))
+    return noise.resize(size, Image.Resampling.BICUBIC)
+
+
+def _synth_file(args: Tuple[str, int, int, int, bool]) -> dict:
+    """Пишет одно изображение галереи, возвращает её элемент."""
+    directory, index, seed, max_side, animated = args
+    rng = random.Random(f"{seed}-{index}")
+    ratio_w, ratio_h = rng.choice(ASPECT_RATIOS)
+    # Примерно треть изображений меньше наибольшего размера вариантов
+    side = rng.choice([max_side, max_side, max_side * 3 // 4, max_side // 2])
+    scale = side / max(ratio_w, ratio_h)
+    size = (max(1, round(ratio_w * scale)), max(1, round(ratio_h * scale)))
+
+    if animated:
+        ext, pil_format = rng.choice(ANIMATED_FORMATS)
+        # Анимации в галерее обычно небольшие
+        size = (max(1, size[0] // 2), max(1, size[1] // 2))
+        frames = [_synth_image(rng, size) for _ in range(ANIMATED_FRAMES)]
+        name = f"bench-{index:05d}.{ext}"
+        frames[0].save(
+            os.path.join(directory, name), pil_format,
+            save_all=True, append_images=frames[1:], duration=100, loop=0,
+        )
+    else:
+        ext, pil_format = rng.choice(STILL_FORMATS)
+        name = f"bench-{index:05d}.{ext}"
+        params = {"quality": 90, "method": 0} if pil_format == "WEBP" else {}
+        _synth_image(rng, size).save(os.path.join(directory, name), pil_format, **params)
+
+    item = {"src": f"w/{name}", "caption": ""}
+    if rng.random() < 0.2:
+        item["caption"] = f"Item {index}"
+    return item
+
+
+def synthesize(
+    directory: str,
+    count: int,
+    seed: int = 1,
+    max_side: int = 1600,
+    animated_ratio: float = 0.05,
+    jobs: int = 0,
+) -> float:
+    """
+    Создаёт в directory w/ и gallery.json на count изображений.
+    Если там уже лежит галерея с теми же параметрами, она переиспользуется.
+    Возвращает время синтеза в секундах (0 при переиспользовании).
+    """
+    params = {"count": count, "seed": seed, "max_side": max_side, "animated_ratio": animated_ratio}
+    stamp_path = os.path.join(directory, STAMP_NAME)
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            if json.load(f) == params:
+                return 0.0
+    except (FileNotFoundError, ValueError):
+        pass
+
+    started = time.perf_counter()
+    w_dir = os.path.join(directory, "w")
+    shutil.rmtree(w_dir, ignore_errors=True)
+    os.makedirs(w_dir)
+    rng = random.Random(seed)
+    tasks = [
+        (w_dir, index, seed, max_side, rng.random() < animated_ratio)
+        for index in range(count)
+    ]
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        items = list(pool.map(_synth_file, tasks, chunksize=16))
+
+    with open(os.path.join(directory, PRISTINE_GALLERY), "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False, indent=2)
+    for name in ("index.html", "style.css"):
+        shutil.copy2(os.path.join(REPO_DIR, name), os.path.join(directory, name))
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return time.perf_counter() - started
+
+
+def reset_gallery(directory: str) -> None:
+    """Исходное состояние: gallery.json без вариантов, пустой w/rs."""
+    shutil.copy2(os.path.join(directory, PRISTINE_GALLERY), os.path.join(directory, "gallery.json"))
+    shutil.rmtree(os.path.join(directory, "w", "rs"), ignore_errors=True)
+
+
+# Замеры
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed(func: Callable[[], object]) -> float:
+    started = time.perf_counter()
+    func()
+    return round(time.perf_counter() - started, 4)
+
+
+def latency_stats(latencies: Sequence[float], elapsed: float) -> dict:
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {
+        "requests": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else None,
+    }
+
+
+def stage_build_srcset(options: dict) -> dict:
+    from update_gallery_assets import DEFAULT_SIZES, build_srcset
+
+    with open(PRISTINE_GALLERY, "r", encoding="utf-8") as f:
+        srcs = [item["src"] for item in json.load(f)][: options["sample"]]
+    output_dir = os.path.join("w", "rs-bench")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    def run() -> None:
+        for src in srcs:
+            build_srcset(src, DEFAULT_SIZES, output_dir)
+
+    cold = _timed(run)
+    warm = _timed(run)
+    shutil.rmtree(output_dir)
+    return {
+        "sample": len(srcs),
+        "cold_s": cold,
+        "warm_s": warm,
+        "cold_per_item_ms": round(cold / max(1, len(srcs)) * 1000, 2),
+        "warm_per_item_ms": round(warm / max(1, len(srcs)) * 1000, 2),
+    }
+
+
+def stage_update_gallery(options: dict) -> dict:
+    from update_gallery_assets import DEFAULT_OUTPUT_DIR, DEFAULT_SIZES, update_gallery
+
+    reset_gallery(".")
+    summaries = []
+
+    def run() -> None:
+        summaries.append(update_gallery(
+            "gallery.json", DEFAULT_SIZES, DEFAULT_OUTPUT_DIR, jobs=options["jobs"]
+        ))
+
+    cold = _timed(run)
+    warm = _timed(run)
+    return {
+        "jobs": options["jobs"],
+        "cold_s": cold,
+        "warm_s": warm,
+        "created": summaries[0]["created"],
+        "skipped_warm": summaries[1]["skipped"],
+        "failed": summaries[0]["missing"],
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def stage_generate_static(options: dict) -> dict:
+    from generate_static import generate_static_html
+
+    with open("gallery.json", "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    def run() -> None:
+        generate_static_html(items, "index.html", "index_static.html")
+
+    cold = _timed(run)
+    warm = _timed(run)
+    return {
+        "cold_s": cold,
+        "warm_s": warm,
+        "html_bytes": os.path.getsize("index_static.html"),
+    }
+
+
+def stage_resize_images(options: dict) -> dict:
+    # process_all_images переписывает оригиналы, поэтому работает на копии
+    shutil.rmtree("resize", ignore_errors=True)
+    shutil.copytree("w", os.path.join("resize", "w"), ignore=shutil.ignore_patterns("rs*"))
+    os.chdir("resize")
+    try:
+        import resize_images
+
+        before = sum(entry.stat().st_size for entry in os.scandir("w") if entry.is_file())
+        cold = _timed(resize_images.process_all_images)
+        warm = _timed(resize_images.process_all_images)
+        after = sum(entry.stat().st_size for entry in os.scandir("w") if entry.is_file())
+    finally:
+        os.chdir("..")
+        shutil.rmtree("resize")
+    return {"cold_s": cold, "warm_s": warm, "bytes_before": before, "bytes_after": after}
+
+
+def _measure_requests(count: int, request: Callable[[], object]) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        t0 = time.perf_counter()
+        response = request()
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        response.close()
+    return latency_stats(latencies, time.perf_counter() - started)
+
+
+def stage_http(options: dict) -> dict:
+    os.environ["GALLERY_STORE"] = "gallery.json"
+    from asset_jobs import DONE, FAILED
+    from server import create_app
+
+    app = create_app()
+    asset_jobs = app.extensions["gallery"].jobs
+    with open("gallery.json", "r", encoding="utf-8") as f:
+        items = json.load(f)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+    count = options["requests"]
+
+    results = {"gallery_json": _measure_requests(count, lambda: client.get("/gallery.json"))}
+    etag = client.get("/gallery.json").headers.get("ETag")
+    results["gallery_json_304"] = _measure_requests(
+        count, lambda: client.get("/gallery.json", headers={"If-None-Match": etag})
+    )
+    image_srcs = [item.get("preview") or item["src"] for item in items]
+    cursor = iter(range(10 ** 9))
+    results["serve_static"] = _measure_requests(
+        count, lambda: client.get("/" + image_srcs[next(cursor) % len(image_srcs)])
+    )
+    results["serve_static_gzip"] = _measure_requests(
+        count, lambda: client.get("/style.css", headers={"Accept-Encoding": "gzip, br"})
+    )
+
+    rng = random.Random(options["seed"])
+    uploads = []
+    for index in range(options["uploads"]):
+        buffer = io.BytesIO()
+        _synth_image(rng, (1200, 900)).save(buffer, "JPEG", quality=90)
+        uploads.append((f"upload-{index}.jpg", buffer.getvalue()))
+    upload_cursor = iter(uploads)
+    job_ids = []
+
+    def upload():
+        name, data = next(upload_cursor)
+        response = client.post(
+            "/upload",
+            data={"file": (io.BytesIO(data), name), "caption": ""},
+            content_type="multipart/form-data",
+        )
+        job_ids.append(response.get_json()["job"])
+        return response
+
+    results["upload"] = _measure_requests(len(uploads), upload)
+    # Фоновая синхронизация ассетов после загрузок — тоже часть цены /upload
+    started = time.perf_counter()
+    while any(asset_jobs.get(job_id).status not in (DONE, FAILED) for job_id in job_ids):
+        time.sleep(0.01)
+    results["upload_jobs_drain_s"] = round(time.perf_counter() - started, 4)
+    return results
+
+
+STAGE_FUNCTIONS: Dict[str, Callable[[dict], dict]] = {
+    "build_srcset": stage_build_srcset,
+    "update_gallery": stage_update_gallery,
+    "generate_static": stage_generate_static,
+    "resize_images": stage_resize_images,
+    "http": stage_http,
+}
+
+
+def _stage_entry(name: str, directory: str, options: dict) -> dict:
+    """Выполняется в отдельном процессе: этап в каталоге галереи."""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(directory)
+    baseline = peak_rss_mb()
+    # Скрипты (и фоновые задачи сервера) печатают подробный отчёт, он не нужен
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = STAGE_FUNCTIONS[name](options)
+    result["baseline_rss_mb"] = baseline
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_stage(name: str, directory: str, options: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        try:
+            return pool.submit(_stage_entry, name, directory, options).result()
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+
+# Отчёт и сравнение
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def flatten(data: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Сравниваемые метрики; у rps больше — лучше, у остальных — меньше
+COMPARED_SUFFIXES = ("cold_s", "warm_s", "drain_s", "p50_ms", "p95_ms", "rps", "peak_rss_mb")
+HIGHER_IS_BETTER = ("rps",)
+# Разница меньше этой доли считается шумом
+NOISE = 0.10
+
+
+def compare(old: dict, new: dict) -> List[str]:
+    """Строки сравнения двух результатов по одинаковым размерам галереи."""
+    old_runs = {run["items"]: flatten(run["stages"]) for run in old.get("runs", [])}
+    lines = [f"Baseline: {old.get('environment', {}).get('commit')}  "
+             f"Current: {new.get('environment', {}).get('commit')}"]
+    for run in new.get("runs", []):
+        before = old_runs.get(run["items"])
+        if before is None:
+            continue
+        lines.append(f"{run['items']} items:")
+        for name, value in flatten(run["stages"]).items():
+            if not name.endswith(COMPARED_SUFFIXES) or name not in before or not before[name]:
+                continue
+            ratio = value / before[name]
+            better = ratio > 1 if name.endswith(HIGHER_IS_BETTER) else ratio < 1
+            mark = "" if abs(ratio - 1) < NOISE else (" better" if better else " WORSE")
+            lines.append(f"  {name}: {before[name]} → {value} ({ratio:.2f}x){mark}")
+    return lines
+
+
+def summary_lines(run: dict) -> List[str]:
+    lines = [f"{run['items']} items (synthesized in {run['synth_s']:.1f}s):"]
+    for stage, result in run["stages"].items():
+        if "error" in result:
+            lines.append(f"  {stage}: ✗ {result['error']}")
+        elif stage == "http":
+            for route, stats in result.items():
+                if isinstance(stats, dict):
+                    lines.append(
+                        f"  {route}: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, "
+                        f"{stats['rps']} req/s"
+                    )
+        else:
+            lines.append(
+                f"  {stage}: cold {result['cold_s']}s, warm {result['warm_s']}s, "
+                f"peak RSS {result['peak_rss_mb']} MB"
+            )
+    return lines
+
+
+def run_benchmarks(
+    sizes: Iterable[int],
+    stages: Sequence[str],
+    workdir: str,
+    options: dict,
+) -> dict:
+    runs = []
+    for count in sizes:
+        directory = os.path.join(workdir, f"gallery-{count}")
+        os.makedirs(directory, exist_ok=True)
+        synth_s = synthesize(
+            directory, count, options["seed"], options["max_side"], options["animated_ratio"]
+        )
+        reset_gallery(directory)
+        # generate_static и http работают с уже обработанной галереей
+        ordered = [stage for stage in STAGES if stage in stages]
+        results = {stage: run_stage(stage, directory, options) for stage in ordered}
+        run = {"items": count, "synth_s": round(synth_s, 2), "stages": results}
+        for line in summary_lines(run):
+            print(line, file=sys.stderr)
+        runs.append(run)
+    return {"environment": environment(), "options": options, "runs": runs}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the asset pipeline and server routes.")
+    parser.add_argument("--items", default="100", help="Comma-separated gallery sizes (default: 100)")
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help=f"Comma-separated stages (default: {','.join(STAGES)})",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="update_gallery worker processes (default: 1)")
+    parser.add_argument("--sample", type=int, default=50, help="Images timed with build_srcset (default: 50)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route (default: 200)")
+    parser.add_argument("--uploads", type=int, default=10, help="Files posted to /upload (default: 10)")
+    parser.add_argument("--max-side", type=int, default=1600, help="Largest synthesized side, px (default: 1600)")
+    parser.add_argument(
+        "--animated", type=float, default=0.05, help="Share of animated images (default: 0.05)"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Seed for synthesized images (default: 1)")
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Directory for synthesized galleries, kept between runs (default: temporary)",
+    )
+    parser.add_argument("--output", default=None, help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare against")
+    args = parser.parse_args()
+    unknown = [s for s in args.stages.split(",") if s.strip() not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (known: {', '.join(STAGES)})")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    sizes = [int(s.strip()) for s in args.items.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    options = {
+        "jobs": args.jobs,
+        "sample": args.sample,
+        "requests": args.requests,
+        "uploads": args.uploads,
+        "max_side": args.max_side,
+        "animated_ratio": args.animated,
+        "seed": args.seed,
+    }
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gallery-bench-")
+    try:
+        results = run_benchmarks(sizes, stages, os.path.abspath(workdir), options)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    payload = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+        print(f"✓ Results: {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            for line in compare(json.load(f), results):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+SQLite-хранилище галереи — альтернатива перезаписи gallery.json.
+
+Каждый элемент — строка таблицы items (src и позиция отдельными
+колонками с индексами, остальное — JSON элемента). Правка подписи или
+удаление меняют одну строку, поиск по src идёт по индексу. Интерфейс тот
+же, что у GalleryStore, так что get_store("gallery.db") подходит и
+server.py, и update_gallery_assets.py.
+
+gallery.json для GitHub Pages собирается из базы только при публикации:
+    python3 gallery_db.py export [--db gallery.db] [--json gallery.json]
+Перенос существующей галереи (делается и сам при создании пустой базы):
+    python3 gallery_db.py import [--json gallery.json] [--db gallery.db]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from gallery_store import GalleryStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    src TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_src ON items (src);
+CREATE INDEX IF NOT EXISTS items_position ON items (position);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+BUSY_TIMEOUT = 30
+
+
+def _dump(item: dict) -> str:
+    # Порядок ключей сохраняется: из базы элемент читается и пишется тем же
+    return json.dumps(item, ensure_ascii=False)
+
+
+class SqliteGalleryStore:
+    """
+    Галерея в SQLite (WAL). Соединение своё у каждого потока, записи идут
+    транзакциями BEGIN IMMEDIATE, так что несколько процессов сервера
+    пишут по очереди. Каждая запись увеличивает счётчик version.
+    seed — gallery.json, из которого заполняется новая пустая база.
+    """
+
+    def __init__(self, path: str, seed: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        conn = self._conn()
+        with self._lock:
+            conn.executescript(SCHEMA)
+            empty = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0] == 0
+        if empty and seed and os.path.exists(seed):
+            with open(seed, "r", encoding="utf-8") as f:
+                self.replace(json.load(f))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакции открываются явно
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            conn.execute("COMMIT")
+
+    # Чтение
+
+    def items(self) -> List[dict]:
+        rows = self._conn().execute("SELECT data FROM items ORDER BY position, id")
+        return [json.loads(data) for (data,) in rows]
+
+    def get(self, src: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT data FROM items WHERE src = ? ORDER BY position, id LIMIT 1", (src,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def version(self) -> str:
+        value = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        return f"db-{value:x}"
+
+    def page(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[int, List[dict]]:
+        conn = self._conn()
+        total = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        rows = conn.execute(
+            "SELECT data FROM items ORDER BY position, id LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        )
+        items = [json.loads(data) for (data,) in rows]
+        if fields is not None:
+            fields = list(fields)
+            items = [{key: item[key] for key in fields if key in item} for item in items]
+        return total, items
+
+    # Изменения
+
+    @contextmanager
+    def mutate(self) -> Iterator[List[dict]]:
+        """
+        Как GalleryStore.mutate, но на диск уходят только изменённые,
+        добавленные и удалённые строки. Транзакция держится весь блок.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, position, data FROM items ORDER BY position, id").fetchall()
+            items = [json.loads(data) for _, _, data in rows]
+            # Строки сопоставляются с элементами рабочей копии по объектам
+            originals: Dict[int, Tuple[int, int, str]] = {
+                id(item): row for item, row in zip(items, rows)
+            }
+            yield items
+
+            kept: List[Optional[Tuple[int, int, str]]] = []
+            seen = set()
+            for item in items:
+                row = originals.get(id(item))
+                if row is not None and row[0] not in seen:
+                    seen.add(row[0])
+                    kept.append(row)
+                else:
+                    kept.append(None)
+            positions = self._positions(kept)
+
+            conn.executemany(
+                "DELETE FROM items WHERE id = ?",
+                [(row[0],) for row in rows if row[0] not in seen],
+            )
+            for item, row, position in zip(items, kept, positions):
+                data = _dump(item)
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO items (position, src, data) VALUES (?, ?, ?)",
+                        (position, item.get("src", ""), data),
+                    )
+                elif row[1] != position or row[2] != data:
+                    conn.execute(
+                        "UPDATE items SET position = ?, src = ?, data = ? WHERE id = ?",
+                        (position, item.get("src", ""), data, row[0]),
+                    )
+
+    @staticmethod
+    def _positions(kept: List[Optional[Tuple[int, int, str]]]) -> List[int]:
+        """
+        Позиции для нового порядка. Если уцелевшие строки идут в прежнем
+        порядке и новым хватает места между ними (в конце его хватает
+        всегда), позиции старых не меняются; иначе список нумеруется заново.
+        """
+        positions = []
+        last = -1
+        for row in kept:
+            if row is None:
+                last += 1
+            elif row[1] > last:
+                last = row[1]
+            else:
+                return list(range(len(kept)))
+            positions.append(last)
+        return positions
+
+    def replace(self, items: List[dict]) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM items")
+            conn.executemany(
+                "INSERT INTO items (position, src, data) VALUES (?, ?, ?)",
+                [(position, item.get("src", ""), _dump(item)) for position, item in enumerate(items)],
+            )
+
+    def append(self, new_items: Iterable[dict]) -> None:
+        with self._transaction() as conn:
+            start = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM items").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO items (position, src, data) VALUES (?, ?, ?)",
+                [
+                    (start + offset, item.get("src", ""), _dump(item))
+                    for offset, item in enumerate(new_items)
+                ],
+            )
+
+    def remove(self, src: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM items WHERE src = ?", (src,)).rowcount > 0
+
+    def update(self, src: str, **fields) -> bool:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM items WHERE src = ? ORDER BY position, id LIMIT 1", (src,)
+            ).fetchone()
+            if row is None:
+                return False
+            item = json.loads(row[1])
+            item.update(fields)
+            conn.execute(
+                "UPDATE items SET src = ?, data = ? WHERE id = ?",
+                (item.get("src", ""), _dump(item), row[0]),
+            )
+            return True
+
+    def _renumber(self, conn: sqlite3.Connection, ids: List[int]) -> None:
+        conn.executemany(
+            "UPDATE items SET position = ? WHERE id = ?",
+            [(position, row_id) for position, row_id in enumerate(ids)],
+        )
+
+    def reorder(self, order: List[str]) -> None:
+        """Порядок по списку src; элементы, которых нет в order, идут в конце."""
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, src FROM items ORDER BY position, id").fetchall()
+            by_src: Dict[str, int] = {}
+            for row_id, src in rows:
+                by_src.setdefault(src, row_id)
+            ids = [by_src[src] for src in order if src in by_src]
+            ids = list(dict.fromkeys(ids))
+            listed = set(ids)
+            ids.extend(row_id for row_id, _ in rows if row_id not in listed)
+            self._renumber(conn, ids)
+
+    def shuffle(self) -> None:
+        with self._transaction() as conn:
+            ids = [row_id for (row_id,) in conn.execute("SELECT id FROM items")]
+            random.shuffle(ids)
+            self._renumber(conn, ids)
+
+
+def export_json(store, json_path: str = "gallery.json") -> int:
+    """Записывает gallery.json (атомарно, со сжатыми копиями). Возвращает число элементов."""
+    items = store.items()
+    GalleryStore(json_path).replace(items)
+    return len(items)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move the gallery between gallery.json and SQLite.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--db", default="gallery.db", help="SQLite database (default: gallery.db)")
+    parser.add_argument("--json", default="gallery.json", help="gallery.json path (default: gallery.json)")
+    args = parser.parse_args()
+
+    store = SqliteGalleryStore(args.db)
+    if args.command == "import":
+        with open(args.json, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        store.replace(items)
+        print(f"✓ {args.json} → {args.db}: {len(items)} items")
+    else:
+        count = export_json(store, args.json)
+        print(f"✓ {args.db} → {args.json}: {count} items")
+
+
+if __name__ == "__main__":
+    main()
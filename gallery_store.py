@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Хранилище gallery.json с кешем в памяти.
+
+Разобранная галерея держится в памяти вместе с индексом src → элемент и
+перечитывается, только если файл изменился на диске (новый inode после
+rename, mtime или размер) — так кеш согласован и между процессами сервера.
+Изменения проходят под блокировкой потоков и файловой блокировкой (flock
+на .<имя>.lock рядом), запись атомарная: временный файл + fsync + rename.
+Один экземпляр на файл разделяют server.py и update_gallery_assets.py.
+После каждой записи обновляются сжатые копии (.gz/.br) для отдачи сервером
+и, если рядом уже собраны шарды (gallery-index.json), сами шарды — иначе
+index.html грузил бы галерею до правок через админку.
+Для путей .db/.sqlite get_store отдаёт SQLite-хранилище (gallery_db.py)
+с тем же интерфейсом.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: между процессами не согласуется
+    fcntl = None
+
+from generate_static import GALLERY_INDEX_FILE, write_gallery_shards
+from precompress import precompress
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+_stores: Dict[str, "GalleryStore"] = {}
+_stores_lock = threading.Lock()
+
+
+def is_sqlite_path(path: str) -> bool:
+    return path.lower().endswith(SQLITE_EXTENSIONS)
+
+
+def get_store(path: str = "gallery.json") -> "GalleryStore":
+    """
+    Общий экземпляр хранилища для файла. Новая SQLite-база заполняется
+    из gallery.json, лежащего рядом.
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if is_sqlite_path(path):
+                from gallery_db import SqliteGalleryStore
+
+                seed = os.path.join(os.path.dirname(path), "gallery.json")
+                store = SqliteGalleryStore(path, seed=seed)
+            else:
+                store = GalleryStore(path)
+            _stores[key] = store
+        return store
+
+
+class GalleryStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._items: List[dict] = []
+        self._index: Dict[str, dict] = {}
+        self._signature: Optional[Tuple[int, int, int]] = None
+        directory, name = os.path.split(os.path.abspath(path))
+        self._lock_path = os.path.join(directory, f".{name}.lock")
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # Запись идёт через rename, так что новый inode виден, даже если
+        # mtime и размер совпали (грубое время ФС)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """Блокировка записи для потоков и для других процессов."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _refresh(self) -> None:
+        signature = self._stat()
+        if signature == self._signature and (signature or not self._items):
+            return
+        if signature is None:
+            items: List[dict] = []
+        else:
+            with open(self.path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+        self._set(items, signature)
+
+    def _set(self, items: List[dict], signature: Optional[Tuple[int, int, int]]) -> None:
+        self._items = items
+        self._index = {item["src"]: item for item in items if item.get("src")}
+        self._signature = signature
+
+    def _write(self, items: List[dict]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".gallery-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp создаёт 0600, а gallery.json раздаётся как статика
+            try:
+                mode = os.stat(self.path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Фиксируем сам rename, чтобы после сбоя не остаться со старым файлом
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            dir_fd = None
+        if dir_fd is not None:
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+        self._set(items, self._stat())
+        precompress(self.path)
+        if os.path.exists(os.path.join(directory, GALLERY_INDEX_FILE)):
+            write_gallery_shards(items, directory=directory)
+
+    # Чтение
+
+    def items(self) -> List[dict]:
+        """Копия списка элементов (сами элементы тоже копируются)."""
+        with self._lock:
+            self._refresh()
+            return [dict(item) for item in self._items]
+
+    def get(self, src: str) -> Optional[dict]:
+        with self._lock:
+            self._refresh()
+            item = self._index.get(src)
+            return dict(item) if item is not None else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._items)
+
+    def version(self) -> str:
+        """Метка текущего состояния файла (для ETag ответов API)."""
+        with self._lock:
+            self._refresh()
+            _, mtime_ns, size = self._signature or (0, 0, 0)
+            return f"{mtime_ns:x}-{size:x}"
+
+    def page(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[int, List[dict]]:
+        """
+        Срез галереи без копирования всего списка.
+        fields ограничивает набор ключей элемента. Возвращает (total, items).
+        """
+        with self._lock:
+            self._refresh()
+            total = len(self._items)
+            stop = total if limit is None else offset + limit
+            window = self._items[offset:stop]
+            if fields is None:
+                return total, [dict(item) for item in window]
+            fields = list(fields)
+            return total, [
+                {key: item[key] for key in fields if key in item} for item in window
+            ]
+
+    # Изменения
+
+    @contextmanager
+    def mutate(self) -> Iterator[List[dict]]:
+        """
+        Отдает рабочую копию списка; если блок завершился без исключения
+        и что-то изменил, она атомарно записывается на диск. Блокировка
+        держится весь блок, так что правки из разных процессов не затирают
+        друг друга.
+        """
+        with self._write_lock():
+            self._refresh()
+            items = [dict(item) for item in self._items]
+            yield items
+            if items != self._items:
+                self._write(items)
+
+    def replace(self, items: List[dict]) -> None:
+        with self._write_lock():
+            self._write([dict(item) for item in items])
+
+    def append(self, new_items: Iterable[dict]) -> None:
+        with self.mutate() as items:
+            items.extend(dict(item) for item in new_items)
+
+    def remove(self, src: str) -> bool:
+        # Наличие проверяется уже под файловой блокировкой, по свежей копии
+        with self.mutate() as items:
+            kept = [item for item in items if item.get("src") != src]
+            removed = len(kept) != len(items)
+            items[:] = kept
+        return removed
+
+    def update(self, src: str, **fields) -> bool:
+        with self.mutate() as items:
+            for item in items:
+                if item.get("src") == src:
+                    item.update(fields)
+                    return True
+        return False
+
+    def reorder(self, order: List[str]) -> None:
+        """Порядок по списку src; элементы, которых нет в order, идут в конце."""
+        with self.mutate() as items:
+            by_src = {item.get("src"): item for item in items}
+            reordered = [by_src[src] for src in order if src in by_src]
+            listed = set(order)
+            reordered.extend(item for item in items if item.get("src") not in listed)
+            items[:] = reordered
+
+    def shuffle(self) -> None:
+        with self.mutate() as items:
+            random.shuffle(items)
@@ -1,10 +1,83 @@
 #!/usr/bin/env python3
 """
 Генерирует статичную версию сайта с встроенной галереей
+
+index.html разбирается в шаблон (части до и после секции галереи, с
+упрощённым loadGallery) один раз, пока файл не изменится. HTML каждого
+элемента кешируется по его содержимому, а файлы, содержимое которых не
+изменилось, не перезаписываются. Сервер вызывает generate_static_html
+в своём процессе, без запуска интерпретатора.
+
+Раскладка галереи считается здесь же: по width/height из gallery.json
+каждый элемент получает колонку для каждой раскладки из GALLERY_LAYOUTS.
+Разметка сразу разбита на колонки первой раскладки, а номера колонок
+всех раскладок лежат в странице и в gallery-index.json — браузеру не
+нужно ничего измерять и ждать загрузки картинок.
 """
+import functools
 import json
 import html
+import os
 import re
+import tempfile
+import threading
+
+from precompress import precompress_all
+from video_assets import MOBILE_MEDIA
+
+# Размер шарда gallery-N.json для постепенной загрузки галереи
+GALLERY_SHARD_SIZE = 40
+GALLERY_INDEX_FILE = 'gallery-index.json'
+GALLERY_SHARD_PATTERN = re.compile(r'^gallery-(\d+)\.json$')
+# Ширина картинки в колонках галереи (как img.sizes в index.html)
+GALLERY_IMAGE_SIZES = '(max-width: 768px) 50vw, 20vw'
+# Сколько отрендеренных элементов держать в кеше
+FRAGMENT_CACHE_SIZE = 4096
+# Раскладки галереи: (медиазапрос, число колонок). Первая — по умолчанию,
+# в ней галерея попадает в разметку; отступ колонок задан в style.css
+GALLERY_LAYOUTS = (('', 5), (MOBILE_MEDIA, 2))
+# Сколько верхних элементов каждой колонки грузить сразу (eager) и preload'ить
+ABOVE_FOLD_ROWS = 2
+PRELOAD_ROWS = 1
+# Подпись под картинкой и отступ между элементами, в долях ширины колонки
+CAPTION_HEIGHT = 0.1
+ITEM_GAP = 0.02
+
+GALLERY_SECTION_PATTERN = re.compile(r'(<section class="gallery" id="gallery">)\s*</section>')
+GALLERY_SECTION = '<section class="gallery masonry" id="gallery">'
+LOAD_GALLERY_PATTERN = re.compile(r'async function loadGallery\(\) \{.*?\n    \}', re.DOTALL)
+
+# Упрощенная версия loadGallery для статичного сайта
+STATIC_LOAD_GALLERY = '''    async function loadGallery() {
+        const gallery = document.getElementById('gallery');
+        
+        // Разметка уже разложена по колонкам первой раскладки; на других
+        // брейкпоинтах элементы переносятся по готовым номерам колонок
+        const layoutData = document.getElementById('gallery-layouts');
+        if (layoutData) {
+            watchGalleryLayout(gallery, JSON.parse(layoutData.textContent));
+        }
+        
+        // Видео ниже первого экрана (preload="none") запускаются, только когда видны
+        const lazyVideos = gallery.querySelectorAll('video[data-autoplay]');
+        if ('IntersectionObserver' in window) {
+            const observer = new IntersectionObserver(entries => {
+                entries.forEach(entry => {
+                    if (entry.isIntersecting) {
+                        entry.target.play().catch(() => {});
+                    } else {
+                        entry.target.pause();
+                    }
+                });
+            }, { rootMargin: '200px' });
+            lazyVideos.forEach(video => observer.observe(video));
+        } else {
+            lazyVideos.forEach(video => video.play().catch(() => {}));
+        }
+    }'''
+
+_template_cache = {}
+_generate_lock = threading.Lock()
 
 def load_gallery():
     """Загружает данные галереи из gallery.json"""
@@ -14,83 +87,330 @@ def load_gallery():
     except FileNotFoundError:
         return []
 
-def generate_gallery_html(gallery_items):
-    """Генерирует HTML для галереи"""
-    html_parts = []
+def placeholder_style(item):
+    """
+    Inline-стиль с пропорциями и плейсхолдером из gallery.json:
+    место под картинку и размытое превью видны сразу, до загрузки файла.
+    """
+    rules = []
+    if item.get('width') and item.get('height'):
+        rules.append(f"aspect-ratio:{item['width']}/{item['height']}")
+    if item.get('color'):
+        rules.append(f"background-color:{item['color']}")
+    if item.get('placeholder'):
+        rules.append(f"background-image:url({item['placeholder']});background-size:cover")
+    if not rules:
+        return ''
+    return f' style="{html.escape(";".join(rules))}"'
+
+def dimension_attrs(item):
+    """width/height из gallery.json: браузер резервирует место до загрузки"""
+    if item.get('width') and item.get('height'):
+        return f' width="{int(item["width"])}" height="{int(item["height"])}"'
+    return ''
+
+def image_html(item, alt, indent, priority=False):
+    """
+    <img> с srcset из gallery.json. Если есть sources (AVIF и т.п.),
+    картинка оборачивается в <picture> с <source> по форматам — браузер
+    берёт первый поддерживаемый, иначе остаётся WebP-srcset самого <img>.
+    Элементы первого экрана (priority) грузятся сразу с высоким
+    приоритетом, остальные — лениво.
+    """
+    src = html.escape(item.get('src', ''))
+    attrs = f'src="{html.escape(item.get("preview") or item.get("src", ""))}"'
+    if item.get('srcset'):
+        attrs += f' srcset="{html.escape(item["srcset"])}" sizes="{GALLERY_IMAGE_SIZES}"'
+    attrs += dimension_attrs(item)
+    if priority:
+        attrs += ' loading="eager" fetchpriority="high"'
+    else:
+        attrs += ' loading="lazy"'
+    attrs += ' decoding="async"'
+    img = f'<img {attrs} data-full-src="{src}" alt="{alt}"{placeholder_style(item)}>'
+    sources = item.get('sources') or []
+    if not sources:
+        return f'{indent}{img}'
+    lines = [f'{indent}<picture>']
+    for source in sources:
+        lines.append(
+            f'{indent}    <source type="{html.escape(source["type"])}" '
+            f'srcset="{html.escape(source["srcset"])}" sizes="{GALLERY_IMAGE_SIZES}">'
+        )
+    lines.append(f'{indent}    {img}')
+    lines.append(f'{indent}</picture>')
+    return '\n'.join(lines)
+
+def video_html(item, priority=False):
+    """
+    <video> галереи. Первый экран проигрывается сразу; остальные не
+    загружаются (preload="none"), показывают постер и запускаются
+    при прокрутке (см. STATIC_LOAD_GALLERY). Если у видео есть потоки
+    (streams), на узких экранах берётся наименьший, на остальных —
+    наибольший; оригинал остаётся последним <source> и открывается в модалке.
+    """
+    src = html.escape(item.get('src', ''))
+    streams = item.get('streams') or []
+    attrs = '' if streams else f'src="{src}"'
+    attrs += f'{dimension_attrs(item)} data-full-src="{src}"'
+    if item.get('poster'):
+        attrs += f' poster="{html.escape(item["poster"])}"'
+    if priority:
+        attrs += ' autoplay loop muted playsinline'
+    else:
+        attrs += ' loop muted playsinline preload="none" data-autoplay'
+    video = f'<video {attrs.strip()} style="width:100%;height:auto;">'
+    if not streams:
+        return f'{video}</video>'
+    sources = []
+    if len(streams) > 1:
+        sources.append((streams[0], f' media="{MOBILE_MEDIA}"'))
+    sources.append((streams[-1], ''))
+    tags = [
+        f'<source src="{html.escape(stream["src"])}" type="{html.escape(stream["type"])}"{media}>'
+        for stream, media in sources
+    ]
+    tags.append(f'<source src="{src}">')
+    return video + ''.join(tags) + '</video>'
+
+def render_item(item, priority=False):
+    """HTML одного элемента галереи (с отступом внутри колонки)"""
+    src = html.escape(item.get('src', ''))
+    caption = item.get('caption', '').strip()
+    is_video = item.get('type') == 'video' or any(src.lower().endswith(f'.{ext}') for ext in ['mp4', 'webm'])
     
+    if caption:
+        caption_escaped = html.escape(caption)
+        if is_video:
+            return f'''            <div class="block">
+                {video_html(item, priority)}
+                <p>{caption_escaped}</p>
+            </div>'''
+        return f'''            <div class="block">
+{image_html(item, caption_escaped, '                ', priority)}
+                <p>{caption_escaped}</p>
+            </div>'''
+    if is_video:
+        return f'            {video_html(item, priority)}'
+    return image_html(item, '', '            ', priority)
+
+@functools.lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _render_cached(key, priority):
+    return render_item(json.loads(key), priority)
+
+def item_height(item):
+    """Высота элемента в ширинах колонки; без размеров считаем квадратом"""
+    ratio = 1.0
+    if item.get('width') and item.get('height'):
+        ratio = item['height'] / item['width']
+    if item.get('caption', '').strip():
+        ratio += CAPTION_HEIGHT
+    return ratio
+
+def masonry_columns(gallery_items, columns):
+    """
+    Номер колонки для каждого элемента: очередной элемент встаёт в самую
+    низкую колонку (при равенстве — в левую), как в masonry-раскладке.
+    """
+    heights = [0.0] * columns
+    assignment = []
     for item in gallery_items:
-        src = html.escape(item.get('src', ''))
-        caption = item.get('caption', '').strip()
-        is_video = item.get('type') == 'video' or any(src.lower().endswith(f'.{ext}') for ext in ['mp4', 'webm'])
-        
-        if caption:
-            caption_escaped = html.escape(caption)
-            if is_video:
-                html_parts.append(f'''        <div class="block">
-            <video src="{src}" autoplay loop muted playsinline style="width:100%;height:auto;"></video>
-            <p>{caption_escaped}</p>
-        </div>''')
-            else:
-                html_parts.append(f'''        <div class="block">
-            <img src="{src}" alt="{caption_escaped}">
-            <p>{caption_escaped}</p>
-        </div>''')
+        column = heights.index(min(heights))
+        assignment.append(column)
+        heights[column] += item_height(item) + ITEM_GAP
+    return assignment
+
+def gallery_layouts(gallery_items, layouts=GALLERY_LAYOUTS):
+    """
+    Раскладки для страницы и gallery-index.json:
+    [{'media': ..., 'count': N, 'columns': [колонка i-го элемента, ...]}].
+    """
+    return [
+        {'media': media, 'count': count, 'columns': masonry_columns(gallery_items, count)}
+        for media, count in layouts
+    ]
+
+def above_fold(layouts, rows=ABOVE_FOLD_ROWS):
+    """
+    Индексы элементов первого экрана: верхние rows элементов каждой колонки
+    в каждой раскладке (см. gallery_layouts).
+    """
+    indexes = set()
+    for layout in layouts:
+        placed = [0] * layout['count']
+        for index, column in enumerate(layout['columns']):
+            if placed[column] < rows:
+                indexes.add(index)
+                placed[column] += 1
+    return indexes
+
+def preload_links(gallery_items, indexes):
+    """<link rel=preload> для картинок первого экрана (лучший формат из sources)"""
+    links = []
+    for index in sorted(indexes):
+        item = gallery_items[index]
+        src = item.get('src', '')
+        if item.get('type') == 'video' or src.lower().endswith(('.mp4', '.webm')):
+            continue
+        sources = item.get('sources') or []
+        if sources:
+            srcset, type_attr = sources[0]['srcset'], f' type="{html.escape(sources[0]["type"])}"'
         else:
-            if is_video:
-                html_parts.append(f'        <video src="{src}" autoplay loop muted playsinline style="width:100%;height:auto;"></video>')
-            else:
-                html_parts.append(f'        <img src="{src}" alt="">')
-    
-    return '\n'.join(html_parts)
+            srcset, type_attr = item.get('srcset'), ''
+        href = html.escape(item.get('preview') or src)
+        attrs = f'rel="preload" as="image" href="{href}"'
+        if srcset:
+            attrs += f' imagesrcset="{html.escape(srcset)}" imagesizes="{GALLERY_IMAGE_SIZES}"'
+        links.append(f'    <link {attrs}{type_attr} fetchpriority="high">')
+    return ''.join(link + '\n' for link in links)
 
-def generate_static_html():
-    """Генерирует статичный HTML файл"""
-    # Загружаем исходный index.html
-    with open('index.html', 'r', encoding='utf-8') as f:
-        html_content = f.read()
-    
-    # Загружаем галерею
-    gallery_items = load_gallery()
-    gallery_html = generate_gallery_html(gallery_items)
-    
-    # Заменяем пустую секцию галереи на статичный HTML
-    gallery_section_pattern = r'(<section class="gallery" id="gallery">)\s*</section>'
-    html_content = re.sub(gallery_section_pattern, r'\1\n' + gallery_html + '\n    </section>', html_content)
+def generate_gallery_html(gallery_items, priority=(), layouts=None):
+    """
+    Генерирует HTML для галереи; элементы с тем же содержимым берутся из кеша.
+    priority — индексы элементов первого экрана. Элементы раскладываются по
+    колонкам первой из layouts, сами раскладки кладутся рядом в JSON.
+    """
+    if layouts is None:
+        layouts = gallery_layouts(gallery_items)
+    columns = [[] for _ in range(layouts[0]['count'])]
+    for index, item in enumerate(gallery_items):
+        fragment = _render_cached(json.dumps(item, ensure_ascii=False, sort_keys=True), index in priority)
+        columns[layouts[0]['columns'][index]].append(fragment)
+    parts = [
+        '        <div class="gallery-column">\n' + '\n'.join(column) + '\n        </div>'
+        for column in columns
+    ]
+    # "</" внутри <script> закрыл бы его раньше времени
+    data = json.dumps(layouts, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+    parts.append(f'        <script type="application/json" id="gallery-layouts">{data}</script>')
+    return '\n'.join(parts)
+
+def load_template(path='index.html'):
+    """
+    (до </head>, от </head> до галереи, после галереи) — части страницы
+    вокруг мест для preload-ссылок и содержимого секции галереи, с уже
+    заменённым loadGallery. Пересобирается, только если файл изменился.
+    Если секции нет, последняя часть — None, и галерея не вставляется.
+    """
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    cached = _template_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
     
+    with open(path, 'r', encoding='utf-8') as f:
+        html_content = f.read()
     # Удаляем динамическую загрузку галереи и заменяем на простую логику прелоадера
-    # Находим функцию loadGallery и заменяем её на упрощенную версию
-    load_gallery_pattern = r'async function loadGallery\(\) \{.*?hidePreloader\(\);.*?\n    \}'
-    
-    # Упрощенная версия loadGallery для статичного сайта
-    static_load_gallery = '''    async function loadGallery() {
-        const gallery = document.getElementById('gallery');
-        const preloaderPercent = document.getElementById('preloader-percent');
-        
-        // В статичной версии все уже загружено, просто ждем немного для стабилизации колонок
-        await new Promise(resolve => {
-            requestAnimationFrame(() => {
-                requestAnimationFrame(() => {
-                    setTimeout(resolve, 200);
-                });
-            });
-        });
-        
-        hidePreloader();
-    }'''
+    html_content = LOAD_GALLERY_PATTERN.sub(lambda m: STATIC_LOAD_GALLERY, html_content)
     
-    html_content = re.sub(load_gallery_pattern, static_load_gallery, html_content, flags=re.DOTALL)
+    match = GALLERY_SECTION_PATTERN.search(html_content)
+    if match:
+        body = html_content[:match.start(1)] + GALLERY_SECTION + '\n'
+        tail = '\n    </section>' + html_content[match.end():]
+    else:
+        body, tail = html_content, None
+    # Без </head> preload-ссылки вставлять некуда
+    head_end = max(body.find('</head>'), 0)
+    template = (body[:head_end], body[head_end:], tail)
+    _template_cache[path] = (signature, template)
+    return template
+
+def write_if_changed(path, content):
+    """Пишет файл, только если содержимое отличается. True, если записан."""
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    # Временный файл + rename: сервер в это время отдаёт либо старую, либо
+    # новую версию целиком
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.static-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+def write_gallery_shards(gallery_items, shard_size=GALLERY_SHARD_SIZE, directory='.', layouts=None):
+    """
+    Пишет gallery-N.json по shard_size элементов и gallery-index.json со списком
+    шардов, раскладками (gallery_layouts) и индексами первого экрана
+    (above_fold), удаляет лишние шарды от прошлой сборки. Возвращает список шардов.
+    """
+    if layouts is None:
+        layouts = gallery_layouts(gallery_items)
+    shards = []
+    for number, offset in enumerate(range(0, len(gallery_items), shard_size)):
+        name = f'gallery-{number}.json'
+        shard = json.dumps(gallery_items[offset:offset + shard_size], ensure_ascii=False, separators=(',', ':'))
+        write_if_changed(os.path.join(directory, name), shard)
+        shards.append(name)
+
+    index = {
+        'total': len(gallery_items),
+        'shard_size': shard_size,
+        'shards': shards,
+        'layouts': layouts,
+        'above_fold': sorted(above_fold(layouts)),
+    }
+    write_if_changed(os.path.join(directory, GALLERY_INDEX_FILE), json.dumps(index, ensure_ascii=False, indent=2))
+
+    for name in os.listdir(directory):
+        if GALLERY_SHARD_PATTERN.match(name) and name not in shards:
+            # Шарды пишет и GalleryStore после каждой записи — мог успеть удалить
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return shards
+
+def generate_static_html(gallery_items=None, template_path='index.html', output_file='index_static.html'):
+    """
+    Генерирует статичный HTML файл.
+    gallery_items — элементы галереи (по умолчанию читается gallery.json).
+    Возвращает (output_file, число элементов, был ли файл перезаписан).
+    """
+    if gallery_items is None:
+        gallery_items = load_gallery()
     
-    # Сохраняем результат
-    output_file = 'index_static.html'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    with _generate_lock:
+        head, body, tail = load_template(template_path)
+        layouts = gallery_layouts(gallery_items)
+        if tail is None:
+            html_content = head + body
+        else:
+            priority = above_fold(layouts)
+            preloads = preload_links(gallery_items, above_fold(layouts, rows=PRELOAD_ROWS)) if head else ''
+            html_content = head + preloads + body + generate_gallery_html(gallery_items, priority, layouts) + tail
+        
+        # Ничего не изменилось — файл и его сжатые копии не трогаем
+        changed = write_if_changed(output_file, html_content)
+        # Сжатые копии для отдачи сервером без сжатия на лету (если устарели)
+        precompress_all([output_file])
+        # Шарды для постепенной загрузки index.html на GitHub Pages
+        write_gallery_shards(gallery_items, layouts=layouts)
     
-    return output_file, len(gallery_items)
+    return output_file, len(gallery_items), changed
 
 if __name__ == '__main__':
     try:
-        output_file, item_count = generate_static_html()
-        print(f'✓ Статичный сайт сгенерирован: {output_file}')
+        output_file, item_count, changed = generate_static_html()
+        if changed:
+            print(f'✓ Статичный сайт сгенерирован: {output_file}')
+        else:
+            print(f'✓ Без изменений: {output_file}')
         print(f'  Включено элементов галереи: {item_count}')
     except Exception as e:
         print(f'✗ Ошибка генерации: {e}')
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Поиск почти одинаковых изображений по перцептивному хешу.
+
+Для каждого изображения считается dHash (64 бита: яркость соседних
+пикселей уменьшенной 9x8 копии). update_gallery_assets сохраняет его в
+манифесте ассетов, так что манифест служит индексом. Поиск соседей идёт
+по BK-дереву с расстоянием Хэмминга: запрос с порогом d просматривает
+только ветви с расстоянием в [k - d, k + d], а не всю галерею.
+
+CLI печатает группы дубликатов и сколько места занимают их варианты:
+    python3 image_dedupe.py [--distance 6]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from asset_manifest import AssetManifest, default_manifest_path
+
+DHASH_SIZE = 8
+# Порог расстояния Хэмминга (из 64 бит), до которого изображения считаются дублями
+DUPLICATE_DISTANCE = 6
+
+T = TypeVar("T")
+
+
+def dhash(img: Image.Image, size: int = DHASH_SIZE) -> str:
+    """dHash изображения: size*size бит в hex."""
+    gray = img.convert("L").resize((size + 1, size), Image.Resampling.BOX)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{size * size // 4}x}"
+
+
+def dhash_file(path: str) -> str:
+    """dHash файла; JPEG декодируется в уменьшенном масштабе."""
+    with Image.open(path) as img:
+        img.draft("L", (DHASH_SIZE * 8, DHASH_SIZE * 8))
+        return dhash(img)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _Node(Generic[T]):
+    __slots__ = ("value", "items", "children")
+
+    def __init__(self, value: int, item: T):
+        self.value = value
+        self.items = [item]
+        self.children: Dict[int, "_Node[T]"] = {}
+
+
+class BKTree(Generic[T]):
+    """BK-дерево по расстоянию Хэмминга между целыми хешами."""
+
+    def __init__(self):
+        self._root: Optional[_Node[T]] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, item: T) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = _Node(value, item)
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node.value)
+            if distance == 0:
+                node.items.append(item)
+                return
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _Node(value, item)
+                return
+            node = child
+
+    def query(self, value: int, max_distance: int) -> List[Tuple[int, T]]:
+        """[(distance, item)] с расстоянием не больше max_distance, ближние первыми."""
+        found: List[Tuple[int, T]] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node.value)
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node.items)
+            for edge, child in node.children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class DuplicateIndex:
+    """
+    BK-дерево по dhash записей манифеста. Перестраивается, когда манифест
+    меняется на диске; add() добавляет хеш до следующей пересборки
+    (например, для файлов той же пачки загрузки).
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self._tree: BKTree[str] = BKTree()
+        self._signature: Optional[Tuple[int, int]] = None
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.manifest_path)
+            signature: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature and len(self._tree):
+            return
+        tree: BKTree[str] = BKTree()
+        for src, entry in AssetManifest.load(self.manifest_path).entries.items():
+            if entry.get("dhash"):
+                tree.add(int(entry["dhash"], 16), src)
+        self._tree = tree
+        self._signature = signature
+
+    def query(self, hash_hex: str, max_distance: int = DUPLICATE_DISTANCE) -> List[dict]:
+        """[{src, distance}] для изображений не дальше max_distance."""
+        with self._lock:
+            self._refresh()
+            matches = self._tree.query(int(hash_hex, 16), max_distance)
+        return [{"src": src, "distance": distance} for distance, src in matches]
+
+    def add(self, hash_hex: str, src: str) -> None:
+        with self._lock:
+            self._refresh()
+            self._tree.add(int(hash_hex, 16), src)
+
+
+def find_duplicates(
+    hashes: Dict[str, str], max_distance: int = DUPLICATE_DISTANCE
+) -> List[List[str]]:
+    """
+    Группы src с попарно связанными (через соседей) хешами.
+    Каждый элемент запрашивается у дерева один раз — без сравнения всех пар.
+    """
+    tree: BKTree[str] = BKTree()
+    for src, hash_hex in hashes.items():
+        tree.add(int(hash_hex, 16), src)
+
+    parent = {src: src for src in hashes}
+
+    def find(src: str) -> str:
+        while parent[src] != src:
+            parent[src] = parent[parent[src]]
+            src = parent[src]
+        return src
+
+    for src, hash_hex in hashes.items():
+        for _, other in tree.query(int(hash_hex, 16), max_distance):
+            parent[find(other)] = find(src)
+
+    groups: Dict[str, List[str]] = {}
+    for src in hashes:
+        groups.setdefault(find(src), []).append(src)
+    return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def gallery_hashes(srcs: Iterable[str], manifest: AssetManifest) -> Dict[str, str]:
+    """dhash для каждого src: из манифеста, а если его там нет — по файлу."""
+    hashes = {}
+    for src in srcs:
+        entry = manifest.get(src) or {}
+        if entry.get("dhash"):
+            hashes[src] = entry["dhash"]
+            continue
+        try:
+            hashes[src] = dhash_file(src)
+        except Exception as e:
+            print(f"✗ {src}: {e}")
+    return hashes
+
+
+def main() -> None:
+    from update_gallery_assets import DEFAULT_OUTPUT_DIR, is_image, is_video, load_gallery
+
+    parser = argparse.ArgumentParser(description="Report near-duplicate images in the gallery.")
+    parser.add_argument("--gallery", default="gallery.json", help="Path to gallery.json")
+    parser.add_argument(
+        "--manifest",
+        default=default_manifest_path(DEFAULT_OUTPUT_DIR),
+        help="Asset manifest with stored hashes (default: w/rs/.manifest.json)",
+    )
+    parser.add_argument(
+        "--distance",
+        type=int,
+        default=DUPLICATE_DISTANCE,
+        help=f"Max Hamming distance between dHashes (default: {DUPLICATE_DISTANCE})",
+    )
+    args = parser.parse_args()
+
+    manifest = AssetManifest.load(args.manifest)
+    srcs = [
+        item["src"]
+        for item in load_gallery(args.gallery)
+        if item.get("src") and not is_video(item["src"], item) and is_image(item["src"])
+        and os.path.exists(item["src"])
+    ]
+    groups = find_duplicates(gallery_hashes(srcs, manifest), args.distance)
+
+    wasted = 0
+    for number, group in enumerate(groups, start=1):
+        print(f"Group {number}:")
+        for index, src in enumerate(group):
+            entry = manifest.get(src) or {}
+            size = entry.get("bytes") or os.path.getsize(src)
+            size += sum(variant.get("bytes", 0) for variant in entry.get("variants", []))
+            if index:
+                wasted += size
+            print(f"  {src} ({size / 1024:.0f} KB with variants)")
+    print(f"Images checked: {len(srcs)}")
+    print(f"Duplicate groups: {len(groups)}")
+    print(f"Reclaimable: {wasted / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
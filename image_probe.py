@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Быстрое определение размеров изображений по заголовку файла.
+
+Разбирает заголовки WebP (VP8/VP8L/VP8X), PNG, GIF и JPEG по первым
+килобайтам файла, без декодирования пикселей. Если формат не распознан,
+используется Pillow.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+HEAD_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = (".webp", ".jpg", ".jpeg", ".png", ".gif")
+
+# SOF-маркеры JPEG (кроме DHT, JPG и DAC, у которых тот же диапазон)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 30 or head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        # Ключевой кадр: 3 байта тега, стартовый код 9d 01 2a, затем 14-битные размеры
+        if head[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if head[20] != 0x2F:
+            return None
+        bits = int.from_bytes(head[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _png_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 24 or head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _gif_size(head: bytes) -> Optional[Tuple[int, int]]:
+    if len(head) < 10 or head[:6] not in (b"GIF87a", b"GIF89a"):
+        return None
+    return struct.unpack("<HH", head[6:10])
+
+
+def _jpeg_size(f: BinaryIO, head: bytes) -> Optional[Tuple[int, int]]:
+    if head[:2] != b"\xff\xd8":
+        return None
+    data = head
+    pos = 2
+    while True:
+        # Большие EXIF/ICC-блоки могут не поместиться в первый кусок
+        if pos + 9 > len(data):
+            more = f.read(HEAD_SIZE)
+            if not more:
+                return None
+            data = data[pos:] + more
+            pos = 0
+            continue
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height
+        if marker == 0xDA:
+            return None
+        skip = pos + 2 + length
+        if skip > len(data):
+            f.seek(skip - len(data), os.SEEK_CUR)
+            data = b""
+            pos = 0
+        else:
+            pos = skip
+
+
+def read_dimensions(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    """Размеры по заголовку из открытого бинарного файла или None."""
+    head = f.read(HEAD_SIZE)
+    for parser in (_webp_size, _png_size, _gif_size):
+        size = parser(head)
+        if size:
+            return size
+    return _jpeg_size(f, head)
+
+
+def probe_dimensions(path: str) -> Tuple[int, int]:
+    """
+    Возвращает (width, height). Сначала по заголовку, затем через Pillow.
+    """
+    with open(path, "rb") as f:
+        size = read_dimensions(f)
+    if size and size[0] > 0 and size[1] > 0:
+        return size
+
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.size
+
+
+def probe_directory(
+    directory: str,
+    extensions: Iterable[str] = IMAGE_EXTENSIONS,
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Размеры всех изображений каталога (без подкаталогов).
+    Ключи — пути вида directory/name; нечитаемые файлы пропускаются.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    result: Dict[str, Tuple[int, int]] = {}
+    with os.scandir(directory) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.lower().endswith(extensions):
+                continue
+            path = os.path.join(directory, entry.name)
+            try:
+                result[path] = probe_dimensions(path)
+            except Exception:
+                continue
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Print image dimensions from file headers.")
+    parser.add_argument("directory", nargs="?", default="w", help="Directory to probe (default: w)")
+    args = parser.parse_args()
+    for path, (width, height) in probe_directory(args.directory).items():
+        print(f"{path}\t{width}x{height}")
+
+
+if __name__ == "__main__":
+    main()
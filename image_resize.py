@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Уменьшение изображений с ограничением памяти.
+
+- Перед декодированием размеры проверяются по заголовку: слишком большие
+  (decompression bomb) и не влезающие в бюджет памяти файлы отклоняются
+  с ImageTooLarge, не дойдя до Pillow.
+- JPEG декодируется сразу в уменьшенном масштабе (Image.draft, 1/2–1/8),
+  остальные форматы уменьшаются через reduce() внутри resize(reducing_gap).
+- Несколько размеров считаются каскадом: 1200 из исходника, 800 — из 1200.
+
+Лимиты общие для процесса; воркеры пула получают их через configure().
+"""
+from __future__ import annotations
+
+import os
+from typing import Iterable, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from image_probe import probe_dimensions
+
+# Больше пикселей не декодируем (≈ 10000x8000)
+MAX_IMAGE_PIXELS = int(os.environ.get("GALLERY_MAX_PIXELS", 80_000_000))
+# Бюджет памяти одного воркера на декодированные кадры, байт
+MEMORY_LIMIT = int(os.environ.get("GALLERY_WORKER_MEMORY_MB", 512)) * 1024 * 1024
+# reduce() до размера не меньше target * REDUCING_GAP, дальше LANCZOS;
+# при 3.0 разница с чистым LANCZOS на глаз не видна
+REDUCING_GAP = 3.0
+
+_limits = {"max_pixels": MAX_IMAGE_PIXELS, "memory_limit": MEMORY_LIMIT}
+
+
+class ImageTooLarge(ValueError):
+    """Изображение больше допустимого или не помещается в бюджет памяти."""
+
+
+def configure(max_pixels: Optional[int] = None, memory_limit: Optional[int] = None) -> None:
+    """
+    Задаёт лимиты для текущего процесса (годится как initializer пула).
+    Лимит Pillow (DecompressionBombError) выставляется тем же значением.
+    """
+    if max_pixels is not None:
+        _limits["max_pixels"] = max_pixels
+    if memory_limit is not None:
+        _limits["memory_limit"] = memory_limit
+    Image.MAX_IMAGE_PIXELS = _limits["max_pixels"]
+
+
+def limits() -> Tuple[int, int]:
+    """(max_pixels, memory_limit) текущего процесса."""
+    return _limits["max_pixels"], _limits["memory_limit"]
+
+
+def frame_bytes(size: Tuple[int, int], bands: int = 4) -> int:
+    return size[0] * size[1] * bands
+
+
+def check_dimensions(width: int, height: int) -> None:
+    """ImageTooLarge, если изображение больше max_pixels."""
+    max_pixels = _limits["max_pixels"]
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(
+            f"Image is too large: {width}x{height} ({width * height} px, limit {max_pixels})"
+        )
+
+
+def open_image(
+    path: str,
+    min_size: Optional[Tuple[int, int]] = None,
+    largest_output: Optional[Tuple[int, int]] = None,
+) -> Image.Image:
+    """
+    Открывает изображение для уменьшения. min_size — наименьший нужный
+    размер: JPEG будет декодирован в масштабе, не меньшем его.
+    Оценка пиковой памяти (декодированный кадр, его RGB-копия и наибольший
+    результат largest_output) сверяется с бюджетом до декодирования.
+    """
+    check_dimensions(*probe_dimensions(path))
+    img = Image.open(path)
+    try:
+        if min_size and img.format == "JPEG":
+            img.draft(img.mode, min_size)
+        memory_limit = _limits["memory_limit"]
+        decoded = frame_bytes(img.size)
+        peak = 2 * decoded + (frame_bytes(largest_output) if largest_output else 0)
+        if memory_limit and peak > memory_limit:
+            raise ImageTooLarge(
+                f"Image needs ~{peak // (1024 * 1024)} MB to resize "
+                f"({img.size[0]}x{img.size[1]}), limit {memory_limit // (1024 * 1024)} MB"
+            )
+    except BaseException:
+        img.close()
+        raise
+    return img
+
+
+def resize_cascade(
+    img: Image.Image,
+    sizes: Iterable[Tuple[int, int]],
+) -> Iterator[Tuple[Tuple[int, int], Image.Image]]:
+    """
+    Отдает (size, resized) от большего размера к меньшему; каждый следующий
+    размер считается из предыдущего результата, а не из исходника.
+    Предыдущий результат освобождается, как только он больше не нужен.
+    """
+    current = img
+    for size in sorted(set(sizes), reverse=True):
+        if size == current.size:
+            resized = current.copy()
+        else:
+            resized = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        if current is not img:
+            current.close()
+        current = resized
+        yield size, resized
+
+
+configure()
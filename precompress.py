@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Предварительное сжатие текстовых файлов сайта.
+
+Рядом с файлом пишутся .gz и, если установлен модуль brotli, .br. Сервер
+отдаёт их по Accept-Encoding вместо сжатия на каждый запрос. Сжатая копия
+считается актуальной, пока она не старше исходника.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import tempfile
+from typing import Iterable, List, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, хватает gzip
+    brotli = None
+
+TEXT_ASSETS = ["index.html", "index_static.html", "admin.html", "style.css", "gallery.json"]
+COMPRESSIBLE_EXTENSIONS = (".html", ".css", ".js", ".json", ".svg", ".xml", ".webmanifest")
+
+# Порядок предпочтения при выборе варианта
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def is_compressible(path: str) -> bool:
+    return path.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+def available_encodings() -> List[str]:
+    return [name for name, _ in ENCODINGS if name != "br" or brotli is not None]
+
+
+def is_fresh(path: str, sibling: str) -> bool:
+    try:
+        return os.stat(sibling).st_mtime_ns >= os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def compressed_sibling(path: str, encoding: str) -> Optional[str]:
+    """Путь к актуальной сжатой копии или None."""
+    for name, suffix in ENCODINGS:
+        if name == encoding:
+            sibling = path + suffix
+            return sibling if is_fresh(path, sibling) else None
+    return None
+
+
+def _write_atomic(path: str, data: bytes, mode: int) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".precompress-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp создаёт 0600; копия должна читаться так же, как исходник
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def precompress(path: str) -> List[str]:
+    """Пишет сжатые копии файла, возвращает список записанных путей."""
+    with open(path, "rb") as f:
+        data = f.read()
+        mode = os.fstat(f.fileno()).st_mode & 0o777
+
+    written = []
+    # mtime=0 — одинаковый вход дает побайтно одинаковый .gz
+    _write_atomic(path + ".gz", gzip.compress(data, compresslevel=9, mtime=0), mode)
+    written.append(path + ".gz")
+    if brotli is not None:
+        _write_atomic(path + ".br", brotli.compress(data, quality=11), mode)
+        written.append(path + ".br")
+    return written
+
+
+def precompress_all(paths: Iterable[str] = TEXT_ASSETS, force: bool = False) -> List[str]:
+    """Сжимает файлы, у которых нет актуальных копий (или все при force)."""
+    written = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        stale = force or any(
+            not is_fresh(path, path + suffix)
+            for name, suffix in ENCODINGS
+            if name in available_encodings()
+        )
+        if stale:
+            written.extend(precompress(path))
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write .gz/.br siblings for text assets.")
+    parser.add_argument("paths", nargs="*", default=TEXT_ASSETS, help="Files to compress")
+    parser.add_argument("--force", action="store_true", help="Recompress even if up to date")
+    args = parser.parse_args()
+    for path in precompress_all(args.paths, force=args.force):
+        print(f"✓ {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,44 @@
 #!/usr/bin/env python3
 """
 Скрипт для уменьшения изображений в галерее до максимального размера 1200px
+
+Оригиналы переписываются так, чтобы прерванный запуск ничего не ломал:
+- новое изображение пишется во временный файл рядом с оригиналом и
+  подменяет его через rename — на диске всегда либо старый файл, либо новый;
+- файлы кодируются пулом процессов (--jobs);
+- каждый подменённый файл записывается в журнал w/.resize-journal.jsonl,
+  и повторный запуск после прерывания продолжает с того же места (журнал
+  удаляется после прохода без ошибок);
+- --dry-run только показывает, что будет уменьшено, и оценку экономии.
+В конце в gallery.json записываются новые width/height, а варианты этих
+файлов в w/rs пересобираются с параметрами из манифеста (если манифеста
+нет, их пересоберёт update_gallery_assets.py). Анимированные изображения
+пропускаются: при уменьшении пропали бы кадры.
 """
+import argparse
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
 
+from asset_manifest import AssetManifest, default_manifest_path
+from gallery_store import get_store
+from image_probe import probe_dimensions
+from image_resize import REDUCING_GAP, configure, limits, open_image
+from update_gallery_assets import DEFAULT_OUTPUT_DIR, update_gallery
+
 MAX_SIZE = 1200
+W_DIR = 'w'
+JOURNAL_NAME = '.resize-journal.jsonl'
+TEMP_PREFIX = '.resize-'
+# Формат сохранения по расширению: файл остаётся в своём формате
+SAVE_FORMATS = {
+    '.webp': ('WEBP', {'lossless': True}),
+    '.jpg': ('JPEG', {'quality': 95}),
+    '.jpeg': ('JPEG', {'quality': 95}),
+    '.png': ('PNG', {'optimize': True}),
+    '.gif': ('GIF', {}),
+}
 
 def load_gallery():
     """Загружает данные галереи из gallery.json"""
@@ -28,98 +60,438 @@ def is_image_file(filename):
     # Проверяем, что это webp (или другой формат изображения)
     return filename_lower.endswith(('.webp', '.jpg', '.jpeg', '.png', '.gif'))
 
+def target_size(width, height, max_size=MAX_SIZE):
+    """Размер после уменьшения с сохранением пропорций или None, если не нужно"""
+    if width <= max_size and height <= max_size:
+        return None
+    if width > height:
+        # Ширина больше - уменьшаем по ширине
+        return max_size, int(height * (max_size / width))
+    # Высота больше или равны - уменьшаем по высоте
+    return int(width * (max_size / height)), max_size
+
+def file_signature(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def resize_to_temp(image_path, new_size):
+    """
+    Пишет уменьшенную копию во временный файл рядом с оригиналом.
+    Возвращает путь к нему или None, если изображение анимировано.
+    """
+    pil_format, params = SAVE_FORMATS[os.path.splitext(image_path)[1].lower()]
+    # JPEG декодируется сразу в уменьшенном масштабе, слишком большие
+    # файлы отклоняются до декодирования (ImageTooLarge)
+    with open_image(image_path, new_size, new_size) as img:
+        if getattr(img, 'is_animated', False):
+            return None
+        resized_img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        if pil_format == 'JPEG' and resized_img.mode not in ('RGB', 'L'):
+            resized_img = resized_img.convert('RGB')
+        directory, name = os.path.split(image_path)
+        tmp_path = os.path.join(directory, f'{TEMP_PREFIX}{os.getpid()}-{name}')
+        try:
+            resized_img.save(tmp_path, pil_format, **params)
+            # Права как у оригинала: файл раздаётся как статика
+            os.chmod(tmp_path, os.stat(image_path).st_mode & 0o777)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return tmp_path
+
+def resize_task(image_path, size, new_size):
+    """Задача воркера: кодирует уменьшенную копию, подмену делает основной процесс"""
+    result = {'path': image_path, 'from': list(size), 'to': list(new_size)}
+    try:
+        tmp_path = resize_to_temp(image_path, tuple(new_size))
+    except Exception as e:
+        return dict(result, status='failed', error=str(e))
+    if tmp_path is None:
+        return dict(result, status='animated')
+    return dict(result, status='resized', tmp=tmp_path, bytes_after=os.path.getsize(tmp_path))
+
 def resize_image(image_path, max_size=MAX_SIZE):
     """
     Уменьшает изображение, если оно больше max_size по любой стороне.
-    Сохраняет пропорции.
+    Сохраняет пропорции; файл подменяется атомарно.
     Возвращает True, если изображение было изменено, False если нет.
     """
     if not os.path.exists(image_path):
         print(f"  ⚠ Файл не найден: {image_path}")
         return False
-    
+
     try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            
-            # Если обе стороны меньше или равны max_size, ничего не делаем
-            if width <= max_size and height <= max_size:
-                return False
-            
-            # Вычисляем новые размеры с сохранением пропорций
-            if width > height:
-                # Ширина больше - уменьшаем по ширине
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                # Высота больше или равны - уменьшаем по высоте
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            
-            # Уменьшаем изображение
-            resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Сохраняем обратно в тот же файл с максимальным качеством (lossless)
-            resized_img.save(image_path, 'WEBP', lossless=True)
-            
-            print(f"  ✓ {image_path}: {width}x{height} → {new_width}x{new_height}")
-            return True
-            
+        # Размеры читаем из заголовка, чтобы не открывать файлы, которые не нужно уменьшать
+        width, height = probe_dimensions(image_path)
+        new_size = target_size(width, height, max_size)
+        if new_size is None:
+            return False
+        tmp_path = resize_to_temp(image_path, new_size)
+        if tmp_path is None:
+            print(f"  ⚠ Анимация, пропускаю: {image_path}")
+            return False
+        os.replace(tmp_path, image_path)
+        print(f"  ✓ {image_path}: {width}x{height} → {new_size[0]}x{new_size[1]}")
+        return True
+
     except Exception as e:
         print(f"  ✗ Ошибка при обработке {image_path}: {e}")
         return False
 
-def process_all_images():
-    """Обрабатывает все изображения в папке w/"""
-    w_dir = 'w'
-    
+class ResizeJournal:
+    """
+    Журнал пакетного прохода (JSON Lines): первая строка — параметры,
+    дальше по строке на обработанный файл. Строка дописывается и
+    сбрасывается на диск сразу после подмены файла.
+    """
+
+    def __init__(self, path, max_size, entries=None):
+        self.path = path
+        self.max_size = max_size
+        self.entries = entries or {}
+        self._file = None
+
+    @classmethod
+    def load(cls, path, max_size):
+        """Журнал прерванного прохода с тем же max_size (иначе пустой)"""
+        entries = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return cls(path, max_size)
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header.get('max_size') != max_size:
+            return cls(path, max_size)
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Недописанная последняя строка: запись не успела завершиться
+                continue
+            entries[entry['path']] = entry
+        return cls(path, max_size, entries)
+
+    def is_done(self, path):
+        """Файл уже обработан и с тех пор не менялся"""
+        entry = self.entries.get(path)
+        if not entry:
+            return False
+        try:
+            return list(file_signature(path)) == entry['signature']
+        except OSError:
+            return False
+
+    def resized(self):
+        """{путь: (width, height)} всех уменьшенных файлов прохода"""
+        return {
+            path: tuple(entry['to'])
+            for path, entry in self.entries.items()
+            if entry['status'] == 'resized'
+        }
+
+    def record(self, entry):
+        if self._file is None:
+            new = not self.entries
+            self._file = open(self.path, 'w' if new else 'a', encoding='utf-8')
+            if new:
+                self._file.write(json.dumps({'max_size': self.max_size}) + '\n')
+        self.entries[entry['path']] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def remove_stale_temp_files(w_dir):
+    """Удаляет временные файлы, оставшиеся от прерванного прохода"""
+    removed = 0
+    for entry in os.scandir(w_dir):
+        if entry.is_file() and entry.name.startswith(TEMP_PREFIX) and entry.name != JOURNAL_NAME:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+def update_gallery_dimensions(resized, gallery_path='gallery.json'):
+    """
+    Записывает новые размеры уменьшенных файлов в галерею.
+    resized — {путь: (width, height)}. Возвращает (элементов обновлено,
+    src уменьшенных элементов, у которых есть варианты).
+    """
+    sizes = {os.path.normpath(path): size for path, size in resized.items()}
+    if not sizes or not os.path.exists(gallery_path):
+        return 0, []
+
+    updated = 0
+    with_variants = []
+    with get_store(gallery_path).mutate() as items:
+        for item in items:
+            size = sizes.get(os.path.normpath(item.get('src', '')))
+            if not size:
+                continue
+            if (item.get('width'), item.get('height')) != size:
+                item['width'], item['height'] = size
+                updated += 1
+            if item.get('srcset') or item.get('preview'):
+                with_variants.append(item['src'])
+    return updated, with_variants
+
+def rebuild_variants(srcs, gallery_path='gallery.json', output_dir=DEFAULT_OUTPUT_DIR, manifest_path=None, jobs=0):
+    """
+    Пересобирает варианты уменьшенных файлов с теми же параметрами, с
+    которыми они собирались (берутся из манифеста). Записи манифеста не
+    удаляются: по изменившимся mtime и размеру исходника update_gallery
+    сам видит, что варианты устарели, и перезаписывает их.
+    Возвращает число пересобранных исходников; файлы без записи в манифесте
+    остаются для update_gallery_assets.py.
+    """
+    manifest = AssetManifest.load(manifest_path or default_manifest_path(output_dir))
+    groups = {}
+    for src in srcs:
+        entry = manifest.get(src)
+        if not entry or 'options' not in entry:
+            continue
+        key = json.dumps(entry['options'], sort_keys=True)
+        groups.setdefault(key, (entry['options'], []))[1].append(src)
+
+    for options, group in groups.values():
+        update_gallery(
+            gallery_path,
+            options['sizes'],
+            output_dir,
+            jobs=jobs,
+            manifest_path=manifest_path,
+            srcs=group,
+            fingerprint=options['fingerprint'],
+            fingerprint_originals=options['fingerprint_originals'],
+            formats=options['formats'],
+            profiles=options['profiles'],
+        )
+    return sum(len(group) for _, group in groups.values())
+
+def _format_bytes(size):
+    sign = '-' if size < 0 else ''
+    return f"{sign}{abs(size) / (1024 * 1024):.1f} MB"
+
+def process_all_images(
+    w_dir=W_DIR,
+    max_size=MAX_SIZE,
+    jobs=0,
+    dry_run=False,
+    gallery_path='gallery.json',
+    output_dir=DEFAULT_OUTPUT_DIR,
+    manifest_path=None,
+):
+    """
+    Обрабатывает все изображения в папке w/ (см. описание модуля).
+    jobs=0 — по числу ядер. Возвращает сводку.
+    """
     if not os.path.exists(w_dir):
         print(f"✗ Папка {w_dir} не найдена")
-        return
-    
+        return None
+
     # Получаем все файлы в папке w/
-    all_files = os.listdir(w_dir)
-    image_files = [f for f in all_files if is_image_file(f)]
-    
+    image_files = [
+        f for f in os.listdir(w_dir)
+        if is_image_file(f) and not f.startswith(TEMP_PREFIX)
+    ]
+
     if not image_files:
         print(f"✗ Изображения в папке {w_dir} не найдены")
-        return
-    
+        return None
+
+    journal = ResizeJournal.load(os.path.join(w_dir, JOURNAL_NAME), max_size)
+    if not dry_run:
+        stale = remove_stale_temp_files(w_dir)
+        if stale:
+            print(f"Удалено временных файлов прерванного прохода: {stale}")
+
     print(f"Найдено изображений в папке {w_dir}: {len(image_files)}")
-    print(f"Обрабатываю изображения (максимальный размер: {MAX_SIZE}px)...\n")
-    
-    processed = 0
-    resized = 0
+    print(f"Обрабатываю изображения (максимальный размер: {max_size}px)...\n")
+
+    resumed = 0
     skipped = 0
     errors = 0
-    
+    tasks = []
+
     for filename in sorted(image_files):
         image_path = os.path.join(w_dir, filename)
-        
-        processed += 1
-        
-        # Обрабатываем изображение
+        if journal.is_done(image_path):
+            resumed += 1
+            continue
+        # Размеры из заголовка: открываем только те файлы, что больше max_size
         try:
-            if resize_image(image_path, MAX_SIZE):
-                resized += 1
-            else:
-                skipped += 1
+            width, height = probe_dimensions(image_path)
+            signature = file_signature(image_path)
         except Exception as e:
             print(f"  ✗ Ошибка при обработке {image_path}: {e}")
             errors += 1
-    
-    print(f"\n✓ Обработка завершена:")
-    print(f"  Обработано изображений: {processed}")
+            continue
+        new_size = target_size(width, height, max_size)
+        if new_size is None:
+            skipped += 1
+            continue
+        tasks.append((image_path, (width, height), new_size, signature))
+
+    if resumed:
+        print(f"Продолжаю прерванный проход: уже обработано {resumed}")
+
+    if dry_run:
+        projected = 0
+        for image_path, (width, height), new_size, signature in tasks:
+            # Оценка по числу пикселей: точный размер известен только после кодирования
+            saving = int(signature[1] * (1 - new_size[0] * new_size[1] / (width * height)))
+            projected += saving
+            print(f"  {image_path}: {width}x{height} → {new_size[0]}x{new_size[1]}, ≈ {_format_bytes(-saving)}")
+        print("\n✓ Пробный запуск, файлы не изменены:")
+        print(f"  Будет уменьшено: {len(tasks)}")
+        print(f"  Оставлено без изменений: {skipped}")
+        print(f"  Ожидаемая экономия: ≈ {_format_bytes(projected)}")
+        return {'resize': len(tasks), 'skipped': skipped, 'projected_bytes': projected, 'errors': errors}
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    signatures = {task[0]: task[3] for task in tasks}
+    resized = 0
+    animated = 0
+    saved = 0
+
+    def commit(result):
+        # Подмена и запись в журнал — только здесь, в основном процессе
+        nonlocal resized, animated, saved, errors
+        image_path = result['path']
+        tmp_path = result.pop('tmp', None)
+        if result['status'] == 'resized':
+            try:
+                if file_signature(image_path) != signatures[image_path]:
+                    raise RuntimeError('file changed during resize')
+                bytes_before = signatures[image_path][1]
+                os.replace(tmp_path, image_path)
+            except Exception as e:
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                result = dict(result, status='failed', error=str(e))
+            else:
+                tmp_path = None
+                resized += 1
+                saved += bytes_before - result['bytes_after']
+                result['bytes_before'] = bytes_before
+                w, h = result['from']
+                nw, nh = result['to']
+                print(f"  ✓ {image_path}: {w}x{h} → {nw}x{nh}")
+        if result['status'] == 'failed':
+            print(f"  ✗ Ошибка при обработке {image_path}: {result['error']}")
+            errors += 1
+            return
+        if result['status'] == 'animated':
+            print(f"  ⚠ Анимация, пропускаю: {image_path}")
+            animated += 1
+        result['signature'] = list(file_signature(image_path))
+        journal.record(result)
+
+    try:
+        if jobs <= 1 or len(tasks) <= 1:
+            for image_path, size, new_size, _ in tasks:
+                commit(resize_task(image_path, size, new_size))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(tasks)), initializer=configure, initargs=limits()
+            ) as pool:
+                futures = [
+                    pool.submit(resize_task, image_path, size, new_size)
+                    for image_path, size, new_size, _ in tasks
+                ]
+                try:
+                    for future in as_completed(futures):
+                        commit(future.result())
+                except BaseException:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+    finally:
+        journal.close()
+
+    # Размеры в галерее и варианты — по всем уменьшенным файлам прохода,
+    # включая уменьшенные до прерывания
+    updated, with_variants = update_gallery_dimensions(journal.resized(), gallery_path)
+    rebuilt = rebuild_variants(with_variants, gallery_path, output_dir, manifest_path, jobs)
+    stale = len(with_variants) - rebuilt
+    if not errors:
+        journal.remove()
+
+    print("\n✓ Обработка завершена:")
+    print(f"  Обработано изображений: {len(image_files)}")
     print(f"  Уменьшено: {resized}")
     print(f"  Оставлено без изменений: {skipped}")
+    if resumed:
+        print(f"  Обработано в прерванном проходе: {resumed}")
+    if animated:
+        print(f"  Анимации пропущены: {animated}")
+    print(f"  Экономия: {_format_bytes(saved)}")
+    if updated:
+        print(f"  Обновлены размеры в {gallery_path}: {updated}")
+    if rebuilt:
+        print(f"  Пересобраны варианты в {output_dir}: {rebuilt}")
+    if stale:
+        print(f"  Варианты устарели для {stale} файлов: запустите update_gallery_assets.py")
     if errors > 0:
-        print(f"  Ошибок: {errors}")
+        print(f"  Ошибок: {errors} (повторный запуск обработает только их)")
+    return {
+        'resized': resized,
+        'skipped': skipped,
+        'resumed': resumed,
+        'animated': animated,
+        'errors': errors,
+        'saved_bytes': saved,
+        'gallery_updated': updated,
+        'rebuilt': rebuilt,
+        'stale': stale,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Downscale gallery originals in place.")
+    parser.add_argument("--dir", default=W_DIR, help=f"Directory with originals (default: {W_DIR})")
+    parser.add_argument(
+        "--max-size", type=int, default=MAX_SIZE, help=f"Largest allowed side, px (default: {MAX_SIZE})"
+    )
+    parser.add_argument("--jobs", type=int, default=0, help="Worker processes, 0 = CPU count (default: 0)")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only list files to resize and the projected savings"
+    )
+    parser.add_argument("--gallery", default="gallery.json", help="Path to gallery.json (default: gallery.json)")
+    parser.add_argument(
+        "--output-dir", default=DEFAULT_OUTPUT_DIR, help="Directory with resized variants (default: w/rs)"
+    )
+    parser.add_argument(
+        "--manifest", default=None, help="Path to asset manifest (default: <output-dir>/.manifest.json)"
+    )
+    return parser.parse_args()
 
 if __name__ == '__main__':
+    args = parse_args()
     try:
-        process_all_images()
+        process_all_images(
+            args.dir,
+            args.max_size,
+            jobs=args.jobs,
+            dry_run=args.dry_run,
+            gallery_path=args.gallery,
+            output_dir=args.output_dir,
+            manifest_path=args.manifest,
+        )
     except KeyboardInterrupt:
-        print("\n\n✗ Прервано пользователем")
+        print("\n\n✗ Прервано пользователем (повторный запуск продолжит с того же места)")
         exit(1)
     except Exception as e:
         print(f"\n✗ Критическая ошибка: {e}")
@@ -1,49 +1,138 @@
 #!/usr/bin/env python3
 """
-Flask сервер для локальной разработки и управления галереей
+Flask сервер для управления галереей
+
+create_app() собирает приложение с настройками из окружения (load_config).
+У каждого приложения — а значит, у каждого процесса-воркера — свои очередь
+фоновых задач, пул приёма загрузок, индекс дублей и метрики; общее
+состояние (галерея, манифест, статус задач, снимки метрик) живёт на диске.
+Для разработки: python3 server.py. Для продакшена — wsgi.py.
 """
-from flask import Flask, send_from_directory, request, jsonify, session, redirect, url_for
-from werkzeug.utils import secure_filename
-from PIL import Image
-import io
+from flask import Blueprint, Flask, current_app, request, jsonify, session, redirect, url_for
+import hmac
 import os
-import json
-import subprocess
 from functools import wraps
 
-from update_gallery_assets import update_gallery, DEFAULT_OUTPUT_DIR, DEFAULT_SIZES
+from werkzeug.local import LocalProxy
+
+from asset_http import send_asset, send_media
+from asset_jobs import JobQueue
+from asset_manifest import default_manifest_path
+from gallery_db import export_json
+from gallery_store import get_store, is_sqlite_path
+from image_dedupe import DuplicateIndex
+from server_metrics import Metrics
+from upload_ingest import Ingestor
+from generate_static import GALLERY_SHARD_SIZE, above_fold, gallery_layouts, generate_static_html
+from update_gallery_assets import update_gallery, supported_formats, DEFAULT_OUTPUT_DIR, DEFAULT_SIZES
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-this'
-app.config['UPLOAD_FOLDER'] = 'w'
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
+DEFAULT_SECRET_KEY = 'your-secret-key-change-this'
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'webm'}
 
+site = Blueprint('site', __name__)
+
+def env_flag(name):
+    return os.environ.get(name, '') == '1'
+
+def load_config():
+    """Настройки приложения из окружения"""
+    return {
+        'SECRET_KEY': os.environ.get('GALLERY_SECRET_KEY', DEFAULT_SECRET_KEY),
+        'UPLOAD_FOLDER': 'w',
+        'MAX_CONTENT_LENGTH': 100 * 1024 * 1024,  # 100MB max file size
+        # gallery.json или SQLite-база (gallery.db): правки тогда пишут одну строку,
+        # а gallery.json собирается только при генерации статики
+        'GALLERY_STORE': os.environ.get('GALLERY_STORE', 'gallery.json'),
+        'ASSET_JOB_WORKERS': int(os.environ.get('ASSET_JOB_WORKERS', 2)),
+        # Сколько загруженных файлов конвертируется одновременно (на все запросы)
+        'UPLOAD_WORKERS': int(os.environ.get('UPLOAD_WORKERS', 2)),
+        # Почти одинаковые изображения при загрузке помечаются; с UPLOAD_DEDUPE=1 не добавляются
+        'UPLOAD_DEDUPE': env_flag('UPLOAD_DEDUPE'),
+        # Имена вариантов с отпечатком содержимого (отдаются как immutable)
+        'ASSET_FINGERPRINT': env_flag('ASSET_FINGERPRINT'),
+        # Форматы вариантов через запятую (как --formats update_gallery_assets.py)
+        'ASSET_FORMATS': os.environ.get('ASSET_FORMATS', 'webp'),
+        # Статус фоновых задач на диске: /jobs/<id> отвечает любой воркер
+        'JOB_STATE_DIR': os.environ.get('JOB_STATE_DIR', os.path.join(DEFAULT_OUTPUT_DIR, '.jobs')),
+        # Снимки метрик воркеров; без каталога /metrics показывает один процесс
+        'METRICS_DIR': os.environ.get('METRICS_DIR') or None,
+        # Токен для /metrics (Authorization: Bearer <токен>); без него, кроме
+        # вошедших в админку, /metrics доступен только локальным запросам
+        'METRICS_TOKEN': os.environ.get('METRICS_TOKEN') or None,
+        # Файлы отдаёт фронтенд-сервер (nginx, Apache) по X-Sendfile
+        'USE_X_SENDFILE': env_flag('USE_X_SENDFILE'),
+    }
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in (ALLOWED_EXTENSIONS | ALLOWED_VIDEO_EXTENSIONS)
 
 def is_video_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_VIDEO_EXTENSIONS
 
-def load_gallery():
-    try:
-        with open('gallery.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
 
-def save_gallery(gallery):
-    with open('gallery.json', 'w', encoding='utf-8') as f:
-        json.dump(gallery, f, ensure_ascii=False, indent=2)
+def asset_formats(value):
+    """Форматы вариантов из ASSET_FORMATS; auto — все, что умеет Pillow"""
+    if value.strip().lower() == 'auto':
+        return supported_formats()
+    return [f.strip().lower() for f in value.split(',') if f.strip()]
 
 
-def sync_gallery_assets():
-    try:
-        update_gallery('gallery.json', DEFAULT_SIZES, DEFAULT_OUTPUT_DIR)
-    except Exception as e:
-        print(f"Failed to update gallery assets: {e}")
+class GalleryServices:
+    """Хранилище, очередь задач, пул загрузок, индекс дублей и метрики приложения"""
+
+    def __init__(self, config):
+        # Общее с update_gallery_assets хранилище: кеш в памяти, блокировка, атомарная запись
+        self.store = get_store(config['GALLERY_STORE'])
+        self.metrics = Metrics(config['METRICS_DIR'])
+
+        def run_asset_job(job):
+            with self.metrics.time_task('asset_sync'):
+                return update_gallery(config['GALLERY_STORE'], DEFAULT_SIZES, DEFAULT_OUTPUT_DIR,
+                                      srcs=job.srcs, progress=job.set_progress,
+                                      fingerprint=config['ASSET_FINGERPRINT'],
+                                      formats=asset_formats(config['ASSET_FORMATS']))
+
+        self.jobs = JobQueue(run_asset_job, workers=config['ASSET_JOB_WORKERS'],
+                             state_dir=config['JOB_STATE_DIR'])
+        self.ingestor = Ingestor(workers=config['UPLOAD_WORKERS'])
+        # dHash из манифеста ассетов, BK-дерево для поиска дублей
+        self.duplicates = DuplicateIndex(default_manifest_path(DEFAULT_OUTPUT_DIR))
+
+
+def create_app(config=None):
+    """
+    Приложение галереи: настройки из окружения, поверх них — config.
+    Вызывается в каждом процессе-воркере (в том числе после fork).
+    """
+    app = Flask(__name__)
+    app.config.update(load_config())
+    if config:
+        app.config.update(config)
+    gallery = GalleryServices(app.config)
+    app.extensions['gallery'] = gallery
+    gallery.metrics.init_app(app)
+    app.register_blueprint(site)
+    return app
+
+def services():
+    return current_app.extensions['gallery']
+
+# Объекты текущего приложения (внутри запроса)
+gallery_store = LocalProxy(lambda: services().store)
+asset_jobs = LocalProxy(lambda: services().jobs)
+ingestor = LocalProxy(lambda: services().ingestor)
+duplicate_index = LocalProxy(lambda: services().duplicates)
+metrics = LocalProxy(lambda: services().metrics)
+
+def load_gallery():
+    return gallery_store.items()
+
+
+def sync_gallery_assets(srcs=None):
+    """Ставит синхронизацию ассетов в фоновую очередь, возвращает задачу"""
+    return asset_jobs.submit(srcs)
 
 def login_required(f):
     @wraps(f)
@@ -53,169 +142,240 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/')
+@site.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    return send_asset('.', 'index.html')
 
-@app.route('/admin')
+@site.route('/admin')
 def admin():
-    return send_from_directory('.', 'admin.html')
+    return send_asset('.', 'admin.html')
 
-@app.route('/login', methods=['POST'])
+@site.route('/login', methods=['POST'])
 def login():
     password = request.form.get('password', '')
     # Простая проверка пароля (в продакшене используйте хеширование)
     if password == 'admin':  # Измените пароль!
         session['logged_in'] = True
-        return redirect(url_for('admin'))
+        return redirect(url_for('.admin'))
     return redirect('/admin?error=1')
 
-@app.route('/logout')
+@site.route('/logout')
 def logout():
     session.pop('logged_in', None)
     return redirect('/admin')
 
+@site.route('/upload', methods=['POST'])
 @login_required
-@app.route('/upload', methods=['POST'])
 def upload():
     files = request.files.getlist('file')
     captions = request.form.getlist('caption')
     if not files:
         return jsonify({'error': 'No file'}), 400
-    gallery = load_gallery()
-    responses = []
+    responses = [None] * len(files)
+    accepted = []
     for idx, file in enumerate(files):
         if file and allowed_file(file.filename):
-            try:
-                if is_video_file(file.filename):
-                    # Для видео файлов сохраняем как есть, без конвертации
-                    base = secure_filename(file.filename.rsplit('.', 1)[0])
-                    ext = file.filename.rsplit('.', 1)[1].lower()
-                    filename = f"{base}.{ext}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    caption = captions[idx] if idx < len(captions) else ''
-                    gallery.append({'src': f'w/{filename}', 'caption': caption, 'type': 'video'})
-                    responses.append({'file': filename, 'success': True})
-                else:
-                    # Для изображений конвертируем в WebP
-                    img = Image.open(file.stream)
-                    webp_io = io.BytesIO()
-                    if getattr(img, "is_animated", False):
-                        img.save(webp_io, format='WEBP', save_all=True)
-                    else:
-                        img.save(webp_io, format='WEBP')
-                    webp_io.seek(0)
-                    base = secure_filename(file.filename.rsplit('.', 1)[0])
-                    filename = f"{base}.webp"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    with open(filepath, 'wb') as f_out:
-                        f_out.write(webp_io.read())
-                    caption = captions[idx] if idx < len(captions) else ''
-                    gallery.append({'src': f'w/{filename}', 'caption': caption})
-                    responses.append({'file': filename, 'success': True})
-            except Exception as e:
-                responses.append({'file': file.filename, 'success': False, 'error': str(e)})
+            accepted.append(idx)
         else:
-            responses.append({'file': file.filename, 'success': False, 'error': 'Invalid file'})
-    save_gallery(gallery)
-    sync_gallery_assets()
-    return jsonify({'results': responses})
+            responses[idx] = {'file': file.filename, 'success': False, 'error': 'Invalid file'}
+
+    def log_progress(done, total, result):
+        metrics.observe_task('ingest', 'done' if result['success'] else 'failed',
+                             result.get('elapsed', 0))
+        status = 'ok' if result['success'] else f"failed: {result['error']}"
+        current_app.logger.info('upload [%d/%d] %s %s', done, total, result['file'], status)
 
+    # Файлы копируются на диск кусками и конвертируются общим пулом потоков
+    results = ingestor.ingest(
+        [(files[idx].stream, files[idx].filename) for idx in accepted],
+        current_app.config['UPLOAD_FOLDER'],
+        progress=log_progress,
+    )
+    new_items = []
+    for idx, result in zip(accepted, results):
+        responses[idx] = result
+        if not result['success']:
+            continue
+        src = f"w/{result['file']}"
+        if result.get('dhash'):
+            duplicates = [m for m in duplicate_index.query(result['dhash']) if m['src'] != src]
+            if duplicates:
+                result['duplicates'] = duplicates
+                if current_app.config['UPLOAD_DEDUPE']:
+                    if gallery_store.get(src) is None:
+                        os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], result['file']))
+                    responses[idx] = {
+                        'file': result['file'],
+                        'success': False,
+                        'error': f"Duplicate of {duplicates[0]['src']}",
+                        'duplicates': duplicates,
+                    }
+                    continue
+            # Следующие файлы пачки сверяются и с этим
+            duplicate_index.add(result['dhash'], src)
+        caption = captions[idx] if idx < len(captions) else ''
+        item = {'src': src, 'caption': caption}
+        if result['type'] == 'video':
+            item['type'] = 'video'
+        new_items.append(item)
+    gallery_store.append(new_items)
+    # Варианты генерируются в фоне, ответ уходит сразу после сохранения оригиналов
+    job = sync_gallery_assets([item['src'] for item in new_items])
+    return jsonify({'results': responses, 'job': job.id})
+
+@site.route('/gallery-list', methods=['GET'])
 @login_required
-@app.route('/gallery-list', methods=['GET'])
 def gallery_list():
     return jsonify({'gallery': load_gallery()})
 
+@site.route('/delete-item', methods=['POST'])
 @login_required
-@app.route('/delete-item', methods=['POST'])
 def delete_item():
     data = request.json
     src = data.get('src')
     if not src:
         return jsonify({'error': 'No src provided'}), 400
-    gallery = load_gallery()
-    gallery = [item for item in gallery if item.get('src') != src]
-    save_gallery(gallery)
-    sync_gallery_assets()
-    return jsonify({'success': True})
+    gallery_store.remove(src)
+    # Пустой набор: только уборка осиротевших вариантов
+    job = sync_gallery_assets([])
+    return jsonify({'success': True, 'job': job.id})
 
+@site.route('/update-caption', methods=['POST'])
 @login_required
-@app.route('/update-caption', methods=['POST'])
 def update_caption():
     data = request.json
     src = data.get('src')
     caption = data.get('caption', '')
     if not src:
         return jsonify({'error': 'No src provided'}), 400
-    gallery = load_gallery()
-    for item in gallery:
-        if item.get('src') == src:
-            item['caption'] = caption
-            break
-    save_gallery(gallery)
+    gallery_store.update(src, caption=caption)
     return jsonify({'success': True})
 
+@site.route('/reorder-gallery', methods=['POST'])
 @login_required
-@app.route('/reorder-gallery', methods=['POST'])
 def reorder_gallery():
     data = request.json
     order = data.get('order', [])
     if not order:
         return jsonify({'error': 'No order provided'}), 400
-    gallery = load_gallery()
-    # Создаем словарь для быстрого поиска
-    gallery_dict = {item['src']: item for item in gallery}
-    # Переупорядочиваем согласно order
-    reordered = [gallery_dict[src] for src in order if src in gallery_dict]
-    # Добавляем элементы, которых нет в order (на случай, если что-то пропущено)
-    existing_srcs = set(order)
-    for item in gallery:
-        if item['src'] not in existing_srcs:
-            reordered.append(item)
-    save_gallery(reordered)
+    # Элементы, которых нет в order, хранилище добавит в конец
+    gallery_store.reorder(order)
     return jsonify({'success': True})
 
+@site.route('/shuffle-gallery', methods=['POST'])
 @login_required
-@app.route('/shuffle-gallery', methods=['POST'])
 def shuffle_gallery():
-    import random
-    gallery = load_gallery()
-    random.shuffle(gallery)
-    save_gallery(gallery)
+    gallery_store.shuffle()
     return jsonify({'success': True})
 
+@site.route('/generate-static', methods=['POST'])
 @login_required
-@app.route('/generate-static', methods=['POST'])
 def generate_static():
     try:
-        result = subprocess.run(['python3', 'generate_static.py'], 
-                              capture_output=True, 
-                              text=True, 
-                              cwd=os.path.dirname(os.path.abspath(__file__)))
-        if result.returncode == 0:
-            return jsonify({'success': True, 'message': result.stdout.strip()})
-        else:
-            return jsonify({'success': False, 'error': result.stderr.strip() or 'Ошибка генерации'})
+        if is_sqlite_path(current_app.config['GALLERY_STORE']):
+            # Публикация: gallery.json для GitHub Pages собирается из базы
+            export_json(gallery_store, 'gallery.json')
+        # В процессе сервера: шаблон и HTML элементов берутся из кеша
+        with metrics.time_task('generate_static'):
+            output_file, item_count, changed = generate_static_html(gallery_store.items())
+        status = 'сгенерирован' if changed else 'без изменений'
+        message = f'✓ Статичный сайт {status}: {output_file}\n  Включено элементов галереи: {item_count}'
+        return jsonify({'success': True, 'message': message, 'changed': changed})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/gallery.json')
+@site.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    # Задачу мог принять другой воркер: статус берётся и с диска
+    status = asset_jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@site.route('/gallery.json')
 def gallery_json():
-    return send_from_directory('.', 'gallery.json')
+    if not is_sqlite_path(current_app.config['GALLERY_STORE']):
+        return send_asset('.', 'gallery.json')
+    # С SQLite файл обновляется только при публикации, поэтому отдаём из базы
+    response = jsonify(gallery_store.items())
+    response.set_etag(gallery_store.version())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@site.route('/api/gallery')
+def api_gallery():
+    """Страница галереи из памяти: ?offset=&limit=&fields=src,caption"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', GALLERY_SHARD_SIZE, type=int)
+    limit = min(max(limit, 1), 500)
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    total, items = gallery_store.page(offset, limit, fields)
+    response = jsonify({
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'items': items,
+        'next': offset + limit if offset + limit < total else None,
+    })
+    response.set_etag(f"{gallery_store.version()}-{offset}-{limit}-{','.join(fields or [])}")
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@site.route('/gallery-index.json')
+def gallery_index():
+    """
+    Тот же формат, что пишет generate_static.write_gallery_shards, но шарды
+    указывают на /api/gallery, так что локально данные всегда актуальны.
+    """
+    items = gallery_store.items()
+    total = len(items)
+    shards = [f'api/gallery?offset={offset}&limit={GALLERY_SHARD_SIZE}'
+              for offset in range(0, total, GALLERY_SHARD_SIZE)]
+    layouts = gallery_layouts(items)
+    response = jsonify({
+        'total': total,
+        'shard_size': GALLERY_SHARD_SIZE,
+        'shards': shards,
+        'layouts': layouts,
+        'above_fold': sorted(above_fold(layouts)),
+    })
+    response.cache_control.no_cache = True
+    return response
+
+def metrics_allowed():
+    if 'logged_in' in session:
+        return True
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    # Запрос через локальный прокси пришёл бы тоже с 127.0.0.1
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+@site.route('/metrics')
+def metrics_endpoint():
+    """Счётчики и гистограммы всех воркеров в формате Prometheus"""
+    if not metrics_allowed():
+        return jsonify({'error': 'Forbidden'}), 403
+    return metrics.response()
 
-@app.route('/<path:filename>')
+@site.route('/<path:filename>')
 def serve_static(filename):
     # Исключаем файлы, которые обрабатываются другими маршрутами
     if filename in ['index.html', 'admin.html']:
-        return send_from_directory('.', filename)
+        return send_asset('.', filename)
     # Разрешаем доступ только к статическим файлам
     allowed_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico', '.pdf', '.ttf', '.mp4', '.webm', '.json', '.xml', '.css', '.js'}
     if any(filename.lower().endswith(ext) for ext in allowed_extensions):
-        return send_from_directory('.', filename)
+        # Видео — с явной поддержкой Range для перемотки и мобильных плееров
+        if is_video_file(filename):
+            return send_media('.', filename)
+        return send_asset('.', filename)
     return jsonify({'error': 'File not found'}), 404
 
 if __name__ == '__main__':
+    app = create_app()
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     app.run(debug=True, port=5000)
 
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Метрики сервера в текстовом формате Prometheus (/metrics).
+
+Считаются запросы по маршрутам (число по методу и статусу, гистограмма
+времени ответа, отданные байты) и длительность задач конвейера ассетов
+(синхронизация вариантов, приём загрузок, генерация статики).
+
+Каждый процесс копит счётчики в памяти. Если задан каталог (METRICS_DIR),
+фоновый поток процесса раз в FLUSH_INTERVAL секунд сбрасывает снимок
+(если были новые наблюдения) в <каталог>/<pid>.json, а /metrics складывает
+снимки живых воркеров — ответ не зависит от того, какой процесс его
+обслужил. Снимки завершившихся процессов удаляются. Время ответа меряется до
+отдачи тела, так что для потоковых ответов (видео) это время до первого
+байта.
+"""
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Flask, Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+FLUSH_INTERVAL = 1.0
+UNMATCHED_ROUTE = "<unmatched>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Счётчики по корзинам (не накопительные), сумма и число наблюдений."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+    def merge(self, data: dict) -> None:
+        for index, value in enumerate(data["counts"][: len(self.counts)]):
+            self.counts[index] += value
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+
+def _key(*labels: object) -> str:
+    # Ключи снимка — строки, чтобы он сохранялся в JSON
+    return "\t".join(str(label) for label in labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], key: str, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, key.split("\t"))]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
+        self._latency: Dict[str, Histogram] = {}
+        self._bytes: Dict[str, int] = {}
+        self._tasks: Dict[str, Histogram] = {}
+        self._flush_lock = threading.Lock()
+        self._dirty = False
+        self._flusher: Optional[threading.Thread] = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _ensure_flusher(self) -> None:
+        # Поток стартует лениво, уже в процессе воркера (после fork)
+        if self._flusher is not None or not self.directory:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="metrics-flush", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            if self._dirty:
+                self.flush()
+
+    # Запись
+
+    def observe_request(
+        self, route: str, method: str, status: int, seconds: float, size: int
+    ) -> None:
+        with self._lock:
+            key = _key(route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._latency.setdefault(route, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._bytes[route] = self._bytes.get(route, 0) + size
+            self._dirty = True
+        self._ensure_flusher()
+
+    def observe_task(self, task: str, status: str, seconds: float) -> None:
+        with self._lock:
+            self._tasks.setdefault(_key(task, status), Histogram(TASK_BUCKETS)).observe(seconds)
+            self._dirty = True
+        self._ensure_flusher()
+
+    @contextmanager
+    def time_task(self, task: str) -> Iterator[None]:
+        """Замер блока как задачи task: статус done или failed (исключение)."""
+        started = time.perf_counter()
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            self.observe_task(task, status, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": dict(self._requests),
+                "latency": {key: h.to_dict() for key, h in self._latency.items()},
+                "bytes": dict(self._bytes),
+                "tasks": {key: h.to_dict() for key, h in self._tasks.items()},
+            }
+
+    def flush(self) -> None:
+        """Сбрасывает снимок процесса в каталог метрик."""
+        if not self.directory:
+            return
+        # Иначе более старый снимок мог бы перезаписать более новый
+        with self._flush_lock:
+            self._dirty = False
+            fd, tmp_path = tempfile.mkstemp(prefix=".metrics-", dir=self.directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(tmp_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    # Чтение
+
+    def collect(self) -> Tuple[dict, int]:
+        """Сумма снимков всех процессов и их число."""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            self.flush()
+            snapshots = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".json") or entry.name.startswith("."):
+                    continue
+                if not _process_alive(entry.name[: -len(".json")]):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as f:
+                        snapshots.append(json.load(f))
+                except (FileNotFoundError, ValueError):
+                    continue
+
+        merged: dict = {"requests": {}, "latency": {}, "bytes": {}, "tasks": {}}
+        for snapshot in snapshots:
+            for section in ("requests", "bytes"):
+                for key, value in snapshot.get(section, {}).items():
+                    merged[section][key] = merged[section].get(key, 0) + value
+            for section, buckets in (("latency", LATENCY_BUCKETS), ("tasks", TASK_BUCKETS)):
+                for key, data in snapshot.get(section, {}).items():
+                    merged[section].setdefault(key, Histogram(buckets)).merge(data)
+        return merged, len(snapshots)
+
+    def render(self) -> str:
+        merged, processes = self.collect()
+        lines: List[str] = [
+            "# HELP gallery_metrics_processes Server processes included in these metrics.",
+            "# TYPE gallery_metrics_processes gauge",
+            f"gallery_metrics_processes {processes}",
+            "# HELP gallery_http_requests_total HTTP requests by route, method and status.",
+            "# TYPE gallery_http_requests_total counter",
+        ]
+        for key, value in sorted(merged["requests"].items()):
+            lines.append(
+                f"gallery_http_requests_total{_labels(('route', 'method', 'status'), key)} {value}"
+            )
+        lines += [
+            "# HELP gallery_http_response_bytes_total Response body bytes by route.",
+            "# TYPE gallery_http_response_bytes_total counter",
+        ]
+        for key, value in sorted(merged["bytes"].items()):
+            lines.append(f"gallery_http_response_bytes_total{_labels(('route',), key)} {value}")
+        lines += _render_histograms(
+            "gallery_http_request_duration_seconds",
+            "Time to produce the response by route.",
+            ("route",),
+            merged["latency"],
+        )
+        lines += _render_histograms(
+            "gallery_task_duration_seconds",
+            "Asset pipeline task durations by task and status.",
+            ("task", "status"),
+            merged["tasks"],
+        )
+        return "\n".join(lines) + "\n"
+
+    # Flask
+
+    def init_app(self, app: Flask) -> None:
+        """Замер каждого запроса приложения."""
+
+        @app.before_request
+        def _start_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def _record(response):
+            started = g.pop("metrics_started", None)
+            if started is not None:
+                route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+                self.observe_request(
+                    route,
+                    request.method,
+                    response.status_code,
+                    time.perf_counter() - started,
+                    response.content_length or 0,
+                )
+            return response
+
+    def response(self) -> Response:
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+
+def _process_alive(pid: str) -> bool:
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _render_histograms(
+    name: str, help_text: str, label_names: Sequence[str], histograms: Dict[str, Histogram]
+) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            bucket = _labels(label_names, key, f'le="{bound}"')
+            lines.append(f"{name}_bucket{bucket} {cumulative}")
+        bucket = _labels(label_names, key, 'le="+Inf"')
+        lines.append(f"{name}_bucket{bucket} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {histogram.count}")
+    return lines
@@ -0,0 +1,169 @@
+import os
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.http import http_date
+
+from asset_http import IMMUTABLE_MAX_AGE, _resolve_ranges, cache_policy, parse_ranges, send_media
+
+DATA = bytes(range(256)) * 4  # 1024 байта
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [(0, 100)]),
+        ("bytes=-100", [(None, 100)]),
+        ("bytes=500-", [(500, None)]),
+        ("bytes=500-599, 0-99", [(500, 600), (0, 100)]),
+        ("bytes=0-99,50-149", [(0, 100), (50, 150)]),
+        (" bytes = 0-0 ", [(0, 1)]),
+    ],
+)
+def test_parse_ranges(header, expected):
+    assert parse_ranges(header) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    ["items=0-99", "bytes=", "bytes=abc", "bytes=5", "bytes=10-5", "bytes=-", "bytes=0-x", "bytes=--5"],
+)
+def test_parse_ranges_malformed(header):
+    assert parse_ranges(header) is None
+
+
+def test_resolve_ranges_sorts_merges_and_clamps():
+    ranges = parse_ranges("bytes=900-, 0-99, 50-149, 150-199, -10, 2000-3000")
+    assert _resolve_ranges(ranges, 1024) == [(0, 200), (900, 1024)]
+    assert _resolve_ranges(parse_ranges("bytes=-5000"), 1024) == [(0, 1024)]
+    assert _resolve_ranges(parse_ranges("bytes=1024-"), 1024) == []
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "clip.mp4").write_bytes(DATA)
+    app = Flask(__name__)
+
+    @app.route("/<path:filename>")
+    def media(filename):
+        return send_media(str(tmp_path), filename)
+
+    return app.test_client()
+
+
+def test_single_range(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 100-199/1024"
+    assert response.headers["Content-Length"] == "100"
+    assert response.data == DATA[100:200]
+
+
+def test_suffix_range(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=-24"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 1000-1023/1024"
+    assert response.data == DATA[-24:]
+
+
+def test_multipart_ranges(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=500-509, 0-9, 5-14"})
+    assert response.status_code == 206
+    content_type = response.headers["Content-Type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1].encode()
+    body = response.data
+    assert int(response.headers["Content-Length"]) == len(body)
+    assert body.endswith(b"--" + boundary + b"--\r\n")
+    parts = body.split(b"--" + boundary)[1:-1]
+    assert len(parts) == 2
+    heads_and_bodies = [part.split(b"\r\n\r\n", 1) for part in parts]
+    assert b"Content-Range: bytes 0-14/1024" in heads_and_bodies[0][0]
+    assert heads_and_bodies[0][1] == DATA[0:15] + b"\r\n"
+    assert b"Content-Range: bytes 500-509/1024" in heads_and_bodies[1][0]
+    assert heads_and_bodies[1][1] == DATA[500:510] + b"\r\n"
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=2000-3000"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */1024"
+
+
+def test_malformed_range_returns_full_file(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=oops"})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_range_mismatch_returns_full_file(client):
+    response = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_range_match_returns_partial(client):
+    etag = client.get("/clip.mp4").headers["ETag"]
+    response = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.data == DATA[:10]
+
+
+def test_if_range_weak_etag_returns_full_file(client):
+    etag = client.get("/clip.mp4").headers["ETag"]
+    response = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": "W/" + etag})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def _set_mtime(tmp_path, mtime):
+    os.utime(tmp_path / "clip.mp4", (mtime, mtime))
+
+
+def test_if_range_date_must_match_exactly(client, tmp_path):
+    mtime = int(time.time()) - 3600
+    _set_mtime(tmp_path, mtime)
+
+    exact = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": http_date(mtime)})
+    assert exact.status_code == 206
+    assert exact.data == DATA[:10]
+
+    # Более поздняя дата — не совпадение, хотя файл и не новее её
+    later = client.get(
+        "/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": http_date(mtime + 60)}
+    )
+    assert later.status_code == 200
+    assert later.data == DATA
+
+
+def test_if_range_date_of_fresh_file_is_weak(client, tmp_path):
+    mtime = int(time.time()) + 5  # Last-Modified не старше Date
+    _set_mtime(tmp_path, mtime)
+    response = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-Range": http_date(mtime)})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_if_none_match_returns_not_modified(client):
+    etag = client.get("/clip.mp4").headers["ETag"]
+    response = client.get("/clip.mp4", headers={"Range": "bytes=0-9", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+@pytest.mark.parametrize(
+    "filename, immutable",
+    [
+        ("w/rs/photo-480.0123456789.webp", True),
+        ("w/rs/clip/poster.abcdef0123.avif", True),
+        ("w/photo.0123456789.webp", False),
+        ("holiday.2024010112.mp4", False),
+        ("w/rs/../photo.0123456789.webp", False),
+        ("w/rs/photo-480.webp", False),
+    ],
+)
+def test_immutable_only_for_fingerprinted_variants(filename, immutable):
+    max_age, is_immutable = cache_policy(filename)
+    assert is_immutable is immutable
+    assert (max_age == IMMUTABLE_MAX_AGE) is immutable
@@ -0,0 +1,72 @@
+import threading
+
+from asset_jobs import DONE, FAILED, JobQueue
+
+
+def blocked_queue(state_dir=None):
+    """Очередь с одним воркером, занятым первой задачей до release.set()."""
+    release = threading.Event()
+    started = threading.Event()
+    runs = []
+
+    def runner(job):
+        runs.append(None if job.srcs is None else sorted(job.srcs))
+        if len(runs) == 1:
+            started.set()
+            release.wait(5)
+        return {"srcs": runs[-1]}
+
+    jobs = JobQueue(runner, workers=1, state_dir=state_dir)
+    first = jobs.submit(["w/a.webp"])
+    assert started.wait(5)
+    return jobs, first, release, runs
+
+
+def test_queued_submissions_are_merged(tmp_path):
+    jobs, first, release, runs = blocked_queue(str(tmp_path))
+
+    second = jobs.submit(["w/b.webp"])
+    third = jobs.submit(["w/c.webp"])
+    assert third is second
+    assert second is not first
+    # Слитые исходники видны и другим процессам через файл состояния
+    other = JobQueue(lambda job: None, state_dir=str(tmp_path))
+    assert other.status(second.id)["srcs"] == ["w/b.webp", "w/c.webp"]
+
+    release.set()
+    jobs.join()
+    assert runs == [["w/a.webp"], ["w/b.webp", "w/c.webp"]]
+    assert other.status(second.id)["status"] == DONE
+    assert other.status(second.id)["result"] == {"srcs": ["w/b.webp", "w/c.webp"]}
+
+
+def test_full_sync_absorbs_partial_requests():
+    jobs, first, release, runs = blocked_queue()
+
+    second = jobs.submit(["w/b.webp"])
+    assert jobs.submit(None) is second
+    assert jobs.submit(["w/c.webp"]) is second
+    assert second.srcs is None
+
+    release.set()
+    jobs.join()
+    assert runs == [["w/a.webp"], None]
+
+
+def test_failed_job_reports_error(tmp_path):
+    def runner(job):
+        raise RuntimeError("boom")
+
+    jobs = JobQueue(runner, state_dir=str(tmp_path))
+    job = jobs.submit(["w/a.webp"])
+    jobs.join()
+
+    status = jobs.status(job.id)
+    assert status["status"] == FAILED
+    assert status["error"] == "boom"
+
+
+def test_status_rejects_foreign_ids(tmp_path):
+    jobs = JobQueue(lambda job: None, state_dir=str(tmp_path))
+    assert jobs.status("../gallery") is None
+    assert jobs.status("1-999") is None
@@ -0,0 +1,66 @@
+import json
+import os
+
+from asset_manifest import AssetManifest, collect_garbage, default_manifest_path
+
+
+def touch(path):
+    with open(path, "wb") as f:
+        f.write(b"x")
+    return path
+
+
+def saved_manifest(output_dir, entries):
+    manifest = AssetManifest(default_manifest_path(output_dir), entries)
+    manifest.save()
+    return AssetManifest.load(manifest.path)
+
+
+def entry(*paths):
+    return {"variants": [{"path": path} for path in paths]}
+
+
+def test_collect_garbage_removes_only_unreferenced(tmp_path):
+    output_dir = str(tmp_path)
+    live = touch(os.path.join(output_dir, "a-800.webp"))
+    orphan = touch(os.path.join(output_dir, "b-800.webp"))
+    manifest = saved_manifest(output_dir, {"w/a.webp": entry(live)})
+
+    assert manifest.loaded
+    assert collect_garbage(manifest, output_dir) == [os.path.normpath(orphan)]
+    assert os.path.exists(live)
+    assert not os.path.exists(orphan)
+    assert os.path.exists(manifest.path)
+
+
+def test_collect_garbage_keeps_extra_references(tmp_path):
+    output_dir = str(tmp_path)
+    kept = touch(os.path.join(output_dir, "b-800.webp"))
+    manifest = saved_manifest(output_dir, {})
+
+    assert collect_garbage(manifest, output_dir, keep=[kept]) == []
+    assert os.path.exists(kept)
+
+
+def test_missing_manifest_collects_nothing(tmp_path):
+    output_dir = str(tmp_path)
+    variant = touch(os.path.join(output_dir, "a-800.webp"))
+    manifest = AssetManifest.load(default_manifest_path(output_dir))
+
+    assert not manifest.loaded
+    assert collect_garbage(manifest, output_dir) == []
+    assert os.path.exists(variant)
+
+
+def test_manifest_of_other_version_is_reset(tmp_path):
+    output_dir = str(tmp_path)
+    variant = touch(os.path.join(output_dir, "a-800.webp"))
+    path = default_manifest_path(output_dir)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "items": {"w/a.webp": entry(variant)}}, f)
+
+    manifest = AssetManifest.load(path)
+    assert not manifest.loaded
+    assert manifest.entries == {}
+    assert collect_garbage(manifest, output_dir) == []
+    assert os.path.exists(variant)
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from gallery_db import SqliteGalleryStore, export_json
+
+
+def srcs(store):
+    return [item["src"] for item in store.items()]
+
+
+def positions(store):
+    conn = store._conn()
+    return [row[0] for row in conn.execute("SELECT position FROM items ORDER BY position, id")]
+
+
+@pytest.fixture
+def store(tmp_path):
+    seed = tmp_path / "gallery.json"
+    seed.write_text(json.dumps([{"src": s} for s in ("a", "b", "c")]))
+    return SqliteGalleryStore(str(tmp_path / "gallery.db"), seed=str(seed))
+
+
+def test_seeded_from_json(store):
+    assert srcs(store) == ["a", "b", "c"]
+
+
+def test_append_and_insert_keep_order(store):
+    store.append([{"src": "d"}])
+    with store.mutate() as items:
+        items.insert(0, {"src": "front"})
+        items.insert(3, {"src": "middle"})
+    assert srcs(store) == ["front", "a", "b", "middle", "c", "d"]
+    assert positions(store) == sorted(set(positions(store)))
+
+
+def test_appending_in_mutate_keeps_old_positions(store):
+    before = positions(store)
+    with store.mutate() as items:
+        items.append({"src": "d"})
+    assert positions(store)[:3] == before
+    assert srcs(store) == ["a", "b", "c", "d"]
+
+
+def test_remove_update_and_reorder(store):
+    assert store.remove("b")
+    assert not store.remove("b")
+    assert store.update("c", caption="x")
+    assert not store.update("missing", caption="x")
+    assert store.get("c")["caption"] == "x"
+
+    store.append([{"src": "d"}])
+    # Неизвестные и повторённые src игнорируются, неупомянутые идут в конце
+    store.reorder(["d", "missing", "d", "c"])
+    assert srcs(store) == ["d", "c", "a"]
+
+
+def test_moving_items_in_mutate(store):
+    with store.mutate() as items:
+        items.reverse()
+    assert srcs(store) == ["c", "b", "a"]
+    with store.mutate() as items:
+        del items[1]
+    assert srcs(store) == ["c", "a"]
+
+
+def test_export_json(store, tmp_path):
+    out = tmp_path / "export.json"
+    assert export_json(store, str(out)) == 3
+    assert [item["src"] for item in json.loads(out.read_text())] == ["a", "b", "c"]
@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from gallery_store import GalleryStore
+from generate_static import write_gallery_shards
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "gallery.json"
+    path.write_text(json.dumps([{"src": "w/a.webp"}, {"src": "w/b.webp"}]))
+    return str(path)
+
+
+def test_changes_from_other_process_are_seen(path):
+    store = GalleryStore(path)
+    assert len(store) == 2
+    # Другой процесс — свой экземпляр с собственным кешем
+    GalleryStore(path).append([{"src": "w/c.webp"}])
+
+    assert store.update("w/c.webp", caption="new")
+    assert store.remove("w/a.webp")
+    assert [item["src"] for item in GalleryStore(path).items()] == ["w/b.webp", "w/c.webp"]
+    assert GalleryStore(path).get("w/c.webp")["caption"] == "new"
+
+
+def test_missing_src_does_not_rewrite(path):
+    store = GalleryStore(path)
+    before = os.stat(path)
+
+    assert not store.remove("w/missing.webp")
+    assert not store.update("w/missing.webp", caption="x")
+
+    after = os.stat(path)
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+
+
+def test_unchanged_mutate_skips_write(path):
+    store = GalleryStore(path)
+    before = os.stat(path)
+
+    with store.mutate() as items:
+        items[0]["caption"] = "tmp"
+        items[0].pop("caption")
+
+    after = os.stat(path)
+    assert after.st_ino == before.st_ino
+    assert not os.path.exists(path + ".gz")
+
+    store.update("w/a.webp", caption="x")
+    assert os.stat(path).st_ino != before.st_ino
+
+
+def test_write_keeps_mode(path, tmp_path):
+    os.chmod(path, 0o640)
+    GalleryStore(path).append([{"src": "w/c.webp"}])
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+    new = str(tmp_path / "new.json")
+    GalleryStore(new).append([{"src": "w/a.webp"}])
+    assert os.stat(new).st_mode & 0o777 == 0o644
+
+
+def test_write_refreshes_existing_shards(path, tmp_path):
+    store = GalleryStore(path)
+    store.append([{"src": "w/c.webp"}])  # без gallery-index.json шардов нет
+    assert not (tmp_path / "gallery-index.json").exists()
+
+    write_gallery_shards(store.items(), directory=str(tmp_path))
+    store.remove("w/a.webp")
+
+    index = json.loads((tmp_path / "gallery-index.json").read_text())
+    assert index["total"] == 2
+    shard = json.loads((tmp_path / index["shards"][0]).read_text())
+    assert shard == [{"src": "w/b.webp"}, {"src": "w/c.webp"}]
@@ -0,0 +1,31 @@
+import json
+import os
+
+from generate_static import ABOVE_FOLD_ROWS, write_gallery_shards, write_if_changed
+
+
+def test_write_if_changed_replaces_atomically(tmp_path):
+    path = tmp_path / "gallery-0.json"
+
+    assert write_if_changed(str(path), "[1]")
+    os.chmod(path, 0o640)
+    inode = os.stat(path).st_ino
+    assert not write_if_changed(str(path), "[1]")
+    assert os.stat(path).st_ino == inode
+
+    assert write_if_changed(str(path), "[1,2]")
+    assert path.read_text() == "[1,2]"
+    # Новый файл подменил старый, права сохранились, временных не осталось
+    assert os.stat(path).st_ino != inode
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert sorted(os.listdir(tmp_path)) == ["gallery-0.json"]
+
+
+def test_gallery_index_lists_above_fold_items(tmp_path):
+    items = [{"src": f"w/{i}.webp", "width": 100, "height": 100} for i in range(200)]
+    write_gallery_shards(items, shard_size=50, directory=str(tmp_path))
+
+    index = json.loads((tmp_path / "gallery-index.json").read_text())
+    widest = max(layout["count"] for layout in index["layouts"])
+    # Одинаковые квадраты раскладываются по строкам слева направо
+    assert index["above_fold"] == list(range(widest * ABOVE_FOLD_ROWS))
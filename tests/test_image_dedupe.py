@@ -0,0 +1,37 @@
+import random
+
+from image_dedupe import BKTree, find_duplicates, hamming
+
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(7)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    # Почти-дубли: несколько бит отличаются
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+    values += values[:10]
+    tree: BKTree[int] = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    assert len(tree) == len(values)
+
+    for probe in values[:60] + [rng.getrandbits(64) for _ in range(20)]:
+        for max_distance in (0, 3, 10):
+            expected = sorted(
+                (hamming(probe, value), index)
+                for index, value in enumerate(values)
+                if hamming(probe, value) <= max_distance
+            )
+            found = tree.query(probe, max_distance)
+            assert sorted(found) == expected
+            assert [d for d, _ in found] == sorted(d for d, _ in found)
+
+
+def test_find_duplicates_groups_transitively():
+    hashes = {
+        "a": f"{0b0000:016x}",
+        "b": f"{0b0011:016x}",   # 2 бита от a
+        "c": f"{0b1111:016x}",   # 2 бита от b, 4 от a
+        "d": f"{0xFFFF0000:016x}",
+    }
+    assert find_duplicates(hashes, max_distance=2) == [["a", "b", "c"]]
+    assert find_duplicates(hashes, max_distance=1) == []
@@ -0,0 +1,17 @@
+import gzip
+import os
+
+from precompress import precompress
+
+
+def test_siblings_copy_source_mode(tmp_path):
+    path = tmp_path / "index.html"
+    path.write_text("<html>" + "x" * 1000 + "</html>")
+    os.chmod(path, 0o644)
+
+    written = precompress(str(path))
+
+    assert str(path) + ".gz" in written
+    assert gzip.decompress((tmp_path / "index.html.gz").read_bytes()) == path.read_bytes()
+    for sibling in written:
+        assert os.stat(sibling).st_mode & 0o777 == 0o644
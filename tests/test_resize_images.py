@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import resize_images
+from asset_manifest import AssetManifest, default_manifest_path
+from update_gallery_assets import item_references, update_gallery
+
+OUTPUT_DIR = os.path.join("w", "rs")
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("w")
+    items = []
+    for index, size in enumerate([(2400, 1600), (800, 600), (1500, 3000)]):
+        src = f"w/img{index}.webp"
+        Image.new("RGB", size, (index * 80, 90, 160)).save(src)
+        items.append({"src": src, "caption": ""})
+    with open("gallery.json", "w", encoding="utf-8") as f:
+        json.dump(items, f)
+    return "gallery.json"
+
+
+def load_items(path):
+    with open(path, encoding="utf-8") as f:
+        return {item["src"]: item for item in json.load(f)}
+
+
+def test_dry_run_changes_nothing(gallery):
+    before = {name: os.path.getsize(os.path.join("w", name)) for name in os.listdir("w")}
+
+    summary = resize_images.process_all_images(dry_run=True)
+
+    assert summary["resize"] == 2
+    assert summary["projected_bytes"] > 0
+    assert {name: os.path.getsize(os.path.join("w", name)) for name in os.listdir("w")} == before
+
+
+def test_resize_updates_gallery_and_rebuilds_variants(gallery):
+    update_gallery(gallery, [800], OUTPUT_DIR, formats=["webp"])
+
+    summary = resize_images.process_all_images(jobs=2)
+
+    assert summary["resized"] == 2
+    assert summary["rebuilt"] == 2 and summary["stale"] == 0
+    assert not os.path.exists(os.path.join("w", resize_images.JOURNAL_NAME))
+    assert Image.open("w/img0.webp").size == (1200, 800)
+    items = load_items(gallery)
+    assert (items["w/img0.webp"]["width"], items["w/img0.webp"]["height"]) == (1200, 800)
+    assert (items["w/img2.webp"]["width"], items["w/img2.webp"]["height"]) == (600, 1200)
+    manifest = AssetManifest.load(default_manifest_path(OUTPUT_DIR))
+    for src, item in items.items():
+        assert manifest.is_fresh(src, manifest.get(src)["options"])
+        for path in item_references(item):
+            assert os.path.exists(path)
+
+
+def test_resume_skips_journaled_files(gallery):
+    # Прерванный проход успел уменьшить img0 и оставил временный файл
+    assert resize_images.resize_image("w/img0.webp")
+    journal = resize_images.ResizeJournal(
+        os.path.join("w", resize_images.JOURNAL_NAME), resize_images.MAX_SIZE
+    )
+    journal.record({
+        "path": "w/img0.webp",
+        "status": "resized",
+        "from": [2400, 1600],
+        "to": [1200, 800],
+        "signature": list(resize_images.file_signature("w/img0.webp")),
+    })
+    journal.close()
+    with open(os.path.join("w", resize_images.TEMP_PREFIX + "1-img2.webp"), "wb") as f:
+        f.write(b"partial")
+
+    summary = resize_images.process_all_images(jobs=1)
+
+    assert summary["resumed"] == 1
+    assert summary["resized"] == 1
+    assert sorted(os.listdir("w")) == ["img0.webp", "img1.webp", "img2.webp"]
+    items = load_items(gallery)
+    # Размеры из журнала прерванного прохода тоже попадают в галерею
+    assert (items["w/img0.webp"]["width"], items["w/img0.webp"]["height"]) == (1200, 800)
+
+
+def test_changed_journal_entry_is_processed_again(gallery):
+    journal = resize_images.ResizeJournal(
+        os.path.join("w", resize_images.JOURNAL_NAME), resize_images.MAX_SIZE
+    )
+    journal.record({
+        "path": "w/img0.webp",
+        "status": "resized",
+        "from": [2400, 1600],
+        "to": [1200, 800],
+        "signature": [0, 0],
+    })
+    journal.close()
+
+    summary = resize_images.process_all_images(jobs=1)
+
+    assert summary["resumed"] == 0
+    assert summary["resized"] == 2
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from server import create_app
+
+ADMIN_ROUTES = [
+    ("POST", "/upload"),
+    ("GET", "/gallery-list"),
+    ("POST", "/delete-item"),
+    ("POST", "/update-caption"),
+    ("POST", "/reorder-gallery"),
+    ("POST", "/shuffle-gallery"),
+    ("POST", "/generate-static"),
+    ("GET", "/jobs/1-1"),
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    gallery = tmp_path / "gallery.json"
+    gallery.write_text(json.dumps([{"src": "w/a.webp"}, {"src": "w/b.webp"}]))
+    app = create_app({
+        "TESTING": True,
+        "GALLERY_STORE": str(gallery),
+        "JOB_STATE_DIR": str(tmp_path / "jobs"),
+        "METRICS_DIR": str(tmp_path / "metrics"),
+    })
+    return app
+
+
+def login(client):
+    with client.session_transaction() as session:
+        session["logged_in"] = True
+
+
+@pytest.mark.parametrize("method, url", ADMIN_ROUTES)
+def test_admin_routes_require_login(app, method, url):
+    before = app.extensions["gallery"].store.items()
+    body = {"src": "w/a.webp", "caption": "x", "order": ["w/b.webp", "w/a.webp"]}
+    response = app.test_client().open(url, method=method, json=body)
+    assert response.status_code == 401
+    assert app.extensions["gallery"].store.items() == before
+
+
+def test_job_status_requires_login(app):
+    client = app.test_client()
+    assert client.get("/jobs/1-1").status_code == 401
+    login(client)
+    assert client.get("/jobs/1-1").status_code == 404
+
+
+def test_metrics_local_only_without_token(app):
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 200
+    remote = {"REMOTE_ADDR": "203.0.113.5"}
+    assert client.get("/metrics", environ_base=remote).status_code == 403
+    proxied = {"X-Forwarded-For": "203.0.113.5"}
+    assert client.get("/metrics", headers=proxied).status_code == 403
+    login(client)
+    assert client.get("/metrics", environ_base=remote).status_code == 200
+
+
+def test_metrics_token(app):
+    app.config["METRICS_TOKEN"] = "secret"
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert b"gallery_metrics_processes 1" in response.data
+
+
+def test_gallery_index_has_above_fold(app):
+    index = app.test_client().get("/gallery-index.json").get_json()
+    assert index["total"] == 2
+    assert index["above_fold"] == [0, 1]
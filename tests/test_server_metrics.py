@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from server_metrics import Metrics
+
+
+IDLE_WORKER = """
+import sys, time
+from server_metrics import Metrics
+metrics = Metrics(sys.argv[1], flush_interval=0.05)
+metrics.observe_request("/", "GET", 200, 0.01, 10)
+metrics.observe_request("/", "GET", 200, 0.01, 10)
+print("ready", flush=True)
+time.sleep(30)
+"""
+
+
+def test_idle_process_publishes_snapshot(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    worker = subprocess.Popen(
+        [sys.executable, "-c", IDLE_WORKER, str(tmp_path)], cwd=root, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert worker.stdout.readline().strip() == "ready"
+        # Воркер простаивает, но фоновый поток публикует оба наблюдения
+        deadline = time.monotonic() + 5
+        total = 0
+        while time.monotonic() < deadline and total < 2:
+            time.sleep(0.05)
+            merged, processes = Metrics(str(tmp_path)).collect()
+            total = sum(merged["requests"].values())
+        assert total == 2
+        assert processes == 2
+    finally:
+        worker.kill()
+        worker.wait()
+
+
+def test_snapshots_of_dead_processes_are_dropped(tmp_path):
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    dead = tmp_path / f"{child.pid}.json"
+    dead.write_text(json.dumps({"requests": {"/\tGET\t200": 5}}))
+
+    merged, processes = Metrics(str(tmp_path)).collect()
+
+    assert processes == 1
+    assert merged["requests"] == {}
+    assert not dead.exists()
@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from update_gallery_assets import PRIMARY_FORMAT, item_references, resolve_formats, update_gallery
+
+OUTPUT_DIR = os.path.join("w", "rs")
+
+
+@pytest.fixture
+def gallery(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(OUTPUT_DIR)
+    items = []
+    for index in range(2):
+        src = f"w/img{index}.webp"
+        Image.new("RGB", (1600, 1000), (index * 80, 90, 160)).save(src)
+        items.append({"src": src, "caption": ""})
+    with open("gallery.json", "w", encoding="utf-8") as f:
+        json.dump(items, f)
+    return "gallery.json"
+
+
+def build(gallery_path, **kwargs):
+    return update_gallery(gallery_path, [800], OUTPUT_DIR, formats=["webp"], **kwargs)
+
+
+def variant_files():
+    return {name for name in os.listdir(OUTPUT_DIR) if not name.startswith(".")}
+
+
+def test_item_references():
+    item = {
+        "srcset": "w/rs/a-800.webp 800w, w/a.webp 1600w",
+        "preview": "w/rs/a-800.webp",
+        "sources": [{"type": "image/avif", "srcset": "w/rs/a-800.avif 800w"}],
+        "poster": "w/rs/v-poster.webp",
+        "streams": [{"src": "w/rs/v-720.mp4"}],
+    }
+    assert item_references(item) == {
+        "w/rs/a-800.webp", "w/a.webp", "w/rs/a-800.avif", "w/rs/v-poster.webp", "w/rs/v-720.mp4",
+    }
+
+
+def test_partial_run_keeps_other_variants(gallery):
+    build(gallery)
+    built = variant_files()
+    # Манифест пропал (например, сброшен сменой версии)
+    os.remove(os.path.join(OUTPUT_DIR, ".manifest.json"))
+
+    # Первая частичная сборка сохраняет манифест только с img0
+    for _ in range(2):
+        result = build(gallery, srcs=["w/img0.webp"])
+        assert result["removed"] == []
+    assert variant_files() == built
+
+
+def test_fresh_manifest_keeps_existing_variants(gallery):
+    build(gallery)
+    stray = os.path.join(OUTPUT_DIR, "old-800.webp")
+    Image.new("RGB", (8, 8)).save(stray)
+    os.remove(os.path.join(OUTPUT_DIR, ".manifest.json"))
+
+    assert build(gallery)["removed"] == []
+    assert os.path.exists(stray)
+
+
+def test_full_run_removes_unreferenced_only(gallery):
+    build(gallery)
+    stray = os.path.join(OUTPUT_DIR, "old-800.webp")
+    Image.new("RGB", (8, 8)).save(stray)
+    # Вариант, известный только галерее (нет в манифесте)
+    referenced = os.path.join(OUTPUT_DIR, "kept-800.webp")
+    Image.new("RGB", (8, 8)).save(referenced)
+    with open(gallery, encoding="utf-8") as f:
+        items = json.load(f)
+    items.append({"src": "w/gone.webp", "preview": referenced})
+    with open(gallery, "w", encoding="utf-8") as f:
+        json.dump(items, f)
+
+    result = build(gallery)
+
+    assert result["removed"] == [os.path.normpath(stray)]
+    assert os.path.exists(referenced)
+
+
+def test_unchanged_sources_are_skipped(gallery):
+    first = build(gallery, jobs=2)
+    assert first["created"] > 0
+
+    second = build(gallery, jobs=2)
+    assert second["created"] == 0
+    assert second["skipped"] == 2
+
+    Image.new("RGB", (1600, 1000), (1, 2, 3)).save("w/img1.webp")
+    third = build(gallery)
+    assert third["skipped"] == 1
+    assert third["created"] > 0
+
+
+def test_variants_without_recorded_params_are_reencoded(gallery):
+    # Вариант из сборки до манифеста: lossless и новее исходника
+    legacy = os.path.join(OUTPUT_DIR, "img0-800.webp")
+    Image.new("RGB", (800, 500), (0, 90, 160)).save(legacy, "WEBP", lossless=True)
+    with open(legacy, "rb") as f:
+        assert f.read(16)[12:16] == b"VP8L"
+
+    build(gallery)
+
+    with open(legacy, "rb") as f:
+        assert f.read(16)[12:16] == b"VP8 "
+    assert build(gallery)["created"] == 0
+
+
+def test_default_formats_are_primary_only():
+    assert resolve_formats(None) == [PRIMARY_FORMAT]
+    assert resolve_formats([]) == [PRIMARY_FORMAT]
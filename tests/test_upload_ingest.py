@@ -0,0 +1,25 @@
+import io
+import os
+import stat
+
+from PIL import Image
+
+from upload_ingest import ingest_file
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_ingested_files_are_world_readable(tmp_path):
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buf, format="PNG")
+    buf.seek(0)
+
+    image = ingest_file(buf, "photo.png", str(tmp_path))
+    video = ingest_file(io.BytesIO(b"\x00" * 32), "clip.mp4", str(tmp_path))
+
+    assert image["success"] and video["success"]
+    assert _mode(tmp_path / "photo.webp") == 0o644
+    assert _mode(tmp_path / "clip.mp4") == 0o644
+    assert sorted(os.listdir(tmp_path)) == ["clip.mp4", "photo.webp"]
@@ -3,19 +3,108 @@
 Обновляет gallery.json:
 - добавляет width/height для изображений
 - генерирует уменьшенные версии (srcset) в w/rs
-- добавляет preview/srcset поля
+- добавляет preview/srcset поля и sources — srcset по форматам для <picture>
+
+Варианты кодируются по профилям (--profiles): lossy WebP, а с --formats
+avif,webp (или auto) и AVIF, если Pillow умеет (или установлен
+pillow-avif-plugin); качество и усилие задаются для каждого размера
+отдельно. srcset/preview всегда в WebP.
+Исходники уменьшаются через image_resize: JPEG декодируется сразу в
+уменьшенном масштабе, размеры считаются каскадом, слишком большие файлы
+(--max-pixels, --memory-limit) отклоняются до декодирования.
+
+С --jobs N генерация вариантов распределяется по пулу процессов.
+Манифест в w/rs/.manifest.json позволяет пропускать неизменённые исходники
+и удалять варианты, которые больше ни на что не ссылаются.
+С --fingerprint в имена вариантов добавляется отпечаток содержимого
+(name-800.<hash>.webp), так что их можно кешировать как immutable.
+Для непрозрачных изображений сохраняется крошечный WebP-плейсхолдер
+(data URI) и средний цвет — их страница показывает до загрузки картинки.
+В манифест пишется dHash изображения для поиска дублей (image_dedupe.py).
+Для видео, если есть ffmpeg, сохраняются постер (WebP со своим srcset) и
+потоки меньшего разрешения — поля poster, poster_srcset и streams
+(см. video_assets.py). Без ffmpeg видео остаются как есть.
+
+С --watch скрипт не завершается: после первого прохода он следит за w/ и
+gallery.json (inotify, иначе опрос — см. asset_watch.py) и после каждой
+пачки изменений обрабатывает только затронутые исходники, а затем
+перегенерирует index_static.html (--no-static отключает).
 """
 from __future__ import annotations
 
 import argparse
+import base64
+import hashlib
 import json
 import os
-from typing import Iterable, List, Tuple
+import io
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
 from PIL import Image
 
+try:
+    import pillow_avif  # noqa: F401  регистрирует AVIF в Pillow без встроенной поддержки
+except ImportError:  # AVIF необязателен, хватает WebP
+    pillow_avif = None
+
+from asset_manifest import (
+    AssetManifest,
+    BuildLock,
+    collect_garbage,
+    default_manifest_path,
+    file_hash,
+    stat_signature,
+    variants_exist,
+)
+from asset_watch import DEBOUNCE, InotifyWatcher, batches, open_watcher
+from gallery_store import get_store, is_sqlite_path
+from image_dedupe import DHASH_SIZE, dhash
+from image_probe import probe_dimensions
+from image_resize import configure, limits, open_image, resize_cascade
+from video_assets import (
+    VIDEO_MIME,
+    VideoError,
+    encode_stream,
+    extract_frame,
+    find_ffmpeg,
+    stream_dimensions,
+    video_settings,
+)
+
 DEFAULT_SIZES = [800, 1200]
 DEFAULT_OUTPUT_DIR = os.path.join("w", "rs")
+# --watch: каталог исходников и шаблон статической страницы
+WATCH_DIR = "w"
+STATIC_TEMPLATE = "index.html"
+# Форматы вариантов в порядке предпочтения: ключ → (формат Pillow, MIME, расширение)
+FORMATS = {
+    "avif": ("AVIF", "image/avif", "avif"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+# Основной формат: из него srcset/preview и fallback-<img> для <picture>
+PRIMARY_FORMAT = "webp"
+# Профиль формата: "*" — общие параметры save(), "<размер>" — поправки для
+# этого уровня. Ключи строковые, чтобы профиль не менялся после JSON манифеста.
+DEFAULT_PROFILES = {
+    "webp": {"*": {"quality": 80, "method": 6}, "800": {"quality": 76}},
+    "avif": {"*": {"quality": 55, "speed": 6}, "800": {"quality": 50}},
+}
+# Прежнее поведение (--lossless): WebP без потерь
+LOSSLESS_WEBP_PROFILE = {"*": {"lossless": True}}
+FINGERPRINT_LENGTH = 10
+# Наибольшая сторона плейсхолдера, px
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+# Имя уровня профиля для полноразмерного постера видео
+POSTER_TIER = "poster"
+# Поля элемента-видео, которые берутся из записи манифеста
+VIDEO_FIELDS = (
+    "width", "height", "placeholder", "color",
+    "poster", "poster_srcset", "poster_sources", "streams",
+)
 
 
 def is_video(src: str, item: dict) -> bool:
@@ -27,14 +116,11 @@ def is_image(src: str) -> bool:
 
 
 def load_gallery(path: str) -> List[dict]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return get_store(path).items()
 
 
 def save_gallery(path: str, items: List[dict]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(items, f, ensure_ascii=False, indent=2)
-        f.write("\n")
+    get_store(path).replace(items)
 
 
 def resized_dimensions(width: int, height: int, target: int) -> Tuple[int, int]:
@@ -47,6 +133,301 @@ def resized_dimensions(width: int, height: int, target: int) -> Tuple[int, int]:
     return new_w, new_h
 
 
+def supported_formats() -> List[str]:
+    """Форматы из FORMATS, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    return [name for name, (pil_format, _, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def resolve_formats(requested: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Список форматов в порядке FORMATS. None — только основной формат
+    (AVIF кодируется в разы дольше, поэтому включается явно).
+    Неподдерживаемые пропускаются с предупреждением, основной формат
+    добавляется всегда.
+    """
+    supported = supported_formats()
+    if requested is None:
+        wanted = set()
+    else:
+        wanted = set()
+        for name in requested:
+            if name not in FORMATS:
+                raise ValueError(f"Unknown format: {name}")
+            if name not in supported:
+                print(f"Warning: {name} is not supported by this Pillow build, skipping")
+                continue
+            wanted.add(name)
+    wanted.add(PRIMARY_FORMAT)
+    return [name for name in FORMATS if name in wanted]
+
+
+def load_profiles(path: Optional[str] = None) -> dict:
+    """
+    Профили кодирования: DEFAULT_PROFILES, поверх которых накладываются
+    уровни из JSON-файла ({"webp": {"*": {...}, "800": {...}}, ...}).
+    """
+    profiles = {fmt: dict(profile) for fmt, profile in DEFAULT_PROFILES.items()}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            custom = json.load(f)
+        for fmt, tiers in custom.items():
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown format in profiles: {fmt}")
+            profiles[fmt] = {**profiles.get(fmt, {}), **tiers}
+    return profiles
+
+
+def encode_params(profiles: dict, fmt: str, target: object) -> dict:
+    """Параметры save() для варианта формата fmt размера target."""
+    profile = profiles.get(fmt, {})
+    return {
+        "format": FORMATS[fmt][0],
+        **profile.get("*", {}),
+        **profile.get(str(target), {}),
+    }
+
+
+def asset_options(
+    sizes: Iterable[int],
+    fingerprint: bool = False,
+    fingerprint_originals: bool = False,
+    formats: Optional[Sequence[str]] = None,
+    profiles: Optional[dict] = None,
+) -> dict:
+    """Параметры сборки; сохраняются в манифесте для проверки актуальности."""
+    formats = list(formats or [PRIMARY_FORMAT])
+    profiles = profiles if profiles is not None else DEFAULT_PROFILES
+    return {
+        "sizes": sorted(sizes),
+        "formats": formats,
+        "profiles": {fmt: profiles.get(fmt, {}) for fmt in formats},
+        "fingerprint": fingerprint,
+        "fingerprint_originals": fingerprint_originals,
+        "placeholder": PLACEHOLDER_SIZE,
+        "dhash": DHASH_SIZE,
+    }
+
+
+def video_options(options: dict) -> dict:
+    """Параметры сборки для видео: как у изображений плюс настройки ffmpeg."""
+    return dict(options, video=video_settings())
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+
+def build_placeholder(img: Image.Image) -> dict:
+    """
+    Средний цвет (#rrggbb) и, для непрозрачных изображений, крошечный WebP
+    в виде data URI. У прозрачных плейсхолдер просвечивал бы сквозь картинку,
+    поэтому для них возвращается пустой словарь.
+    """
+    if has_alpha(img):
+        return {}
+    small = img.convert("RGB")
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+    r, g, b = small.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+    buffer = io.BytesIO()
+    small.save(buffer, "WEBP", quality=PLACEHOLDER_QUALITY, method=6)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {
+        "placeholder": f"data:image/webp;base64,{encoded}",
+        "color": f"#{r:02x}{g:02x}{b:02x}",
+    }
+
+
+def fingerprint_for(content_hash: str, *parts: object) -> str:
+    """Короткий отпечаток из хеша исходника и параметров варианта."""
+    payload = json.dumps([content_hash, *parts], sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def _fingerprint_original(src: str, output_dir: str, content_hash: str) -> Tuple[str, bool]:
+    """
+    Копия оригинала с отпечатком в output_dir (жёсткая ссылка, если можно).
+    Возвращает (path, created).
+    """
+    stem, ext = os.path.splitext(os.path.basename(src))
+    out_path = os.path.join(output_dir, f"{stem}.{content_hash[:FINGERPRINT_LENGTH]}{ext.lower()}")
+    if os.path.exists(out_path):
+        return out_path, False
+    try:
+        os.link(src, out_path)
+    except OSError:
+        shutil.copy2(src, out_path)
+    return out_path, True
+
+
+def _encodable(img: Image.Image) -> Image.Image:
+    """RGB/RGBA-копия для кодирования и качественного ресайза (P, CMYK и т.п.)."""
+    if img.mode in ("RGB", "RGBA"):
+        return img
+    return img.convert("RGBA" if has_alpha(img) else "RGB")
+
+
+def _srcset_string(entries: Iterable[Tuple[int, str]]) -> str:
+    return ", ".join(f"{path} {width}w" for width, path in sorted(set(entries)))
+
+
+def render_variants(
+    src: str,
+    sizes: Iterable[int],
+    output_dir: str,
+    overwrite: bool = False,
+    stale_before: Optional[int] = None,
+    dimensions: Optional[Tuple[int, int]] = None,
+    content_hash: Optional[str] = None,
+    fingerprint: bool = False,
+    fingerprint_originals: bool = False,
+    on_image: Optional[Callable[[Image.Image], None]] = None,
+    formats: Sequence[str] = (PRIMARY_FORMAT,),
+    profiles: Optional[dict] = None,
+    known_params: Optional[Dict[str, dict]] = None,
+) -> Tuple[str, str, int, List[dict], List[dict]]:
+    """
+    Генерирует недостающие варианты. Размеры исходника берутся из заголовка,
+    а сам файл декодируется, только если есть что пересоздать.
+    Существующий вариант пересоздается при overwrite, если он старше
+    stale_before (mtime_ns исходника) или если known_params (path → params
+    из прошлой сборки) не подтверждает его параметры кодирования (см.
+    _needs_encode).
+    Для каждого размера пишется по файлу на формат из formats с параметрами
+    из profiles (см. encode_params).
+    С fingerprint имя варианта содержит отпечаток содержимого, с
+    fingerprint_originals в srcset попадает копия оригинала с отпечатком.
+    on_image(img) вызывается с открытым исходником (тогда он открывается,
+    даже если варианты пересоздавать не нужно).
+    Возвращает (srcset, preview_path, created_count, variants, sources), где
+    srcset/preview — основной формат, sources — [{type, srcset}] по форматам.
+    """
+    profiles = profiles if profiles is not None else DEFAULT_PROFILES
+    variants: List[dict] = []
+    pending: List[dict] = []
+    orig_w, orig_h = dimensions or probe_dimensions(src)
+    if (fingerprint or fingerprint_originals) and content_hash is None:
+        content_hash = file_hash(src)
+    if fingerprint:
+        # Имя уже зависит от содержимого, так что существующий файл актуален
+        stale_before = None
+
+    stem, _ = os.path.splitext(os.path.basename(src))
+    for target in sizes:
+        if max(orig_w, orig_h) <= target:
+            continue
+
+        new_w, new_h = resized_dimensions(orig_w, orig_h, target)
+        for fmt in formats:
+            ext = FORMATS[fmt][2]
+            params = encode_params(profiles, fmt, target)
+            if fingerprint:
+                tag = fingerprint_for(content_hash, target, params)
+                out_name = f"{stem}-{target}.{tag}.{ext}"
+            else:
+                out_name = f"{stem}-{target}.{ext}"
+            out_path = os.path.join(output_dir, out_name)
+
+            variant = {
+                "path": out_path,
+                "target": target,
+                "width": new_w,
+                "height": new_h,
+                "format": fmt,
+                "params": params,
+            }
+            if _needs_encode(out_path, params, known_params, stale_before, overwrite, fingerprint):
+                pending.append(variant)
+            variants.append(variant)
+
+    if pending or on_image:
+        by_size: Dict[Tuple[int, int], List[dict]] = {}
+        for variant in pending:
+            by_size.setdefault((variant["width"], variant["height"]), []).append(variant)
+        # Без вариантов нужен только плейсхолдер: JPEG декодируется в 1/8
+        largest = max(by_size, default=None)
+        with open_image(
+            src,
+            min_size=largest or (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE),
+            largest_output=largest,
+        ) as img:
+            if on_image:
+                on_image(img)
+            if by_size:
+                for size, resized in resize_cascade(_encodable(img), by_size):
+                    for variant in by_size[size]:
+                        params = dict(variant["params"])
+                        resized.save(variant["path"], params.pop("format"), **params)
+    created = len(pending)
+    for variant in variants:
+        variant["bytes"] = os.path.getsize(variant["path"])
+
+    if fingerprint_originals:
+        original_path, copied = _fingerprint_original(src, output_dir, content_hash)
+        created += int(copied)
+        variants.append({
+            "path": original_path,
+            "target": None,
+            "width": orig_w,
+            "height": orig_h,
+            "params": {"copy": True},
+            "bytes": os.path.getsize(original_path),
+        })
+    else:
+        original_path = src
+    original = (orig_w, original_path)
+
+    # Оригинал замыкает srcset каждого формата, как и раньше: крупнее
+    # вариантов ничего нет, а браузер определяет формат по содержимому.
+    sources = []
+    for fmt in formats:
+        entries = [(v["width"], v["path"]) for v in variants if v.get("format") == fmt]
+        if entries:
+            sources.append({"type": FORMATS[fmt][1], "srcset": _srcset_string(entries + [original])})
+
+    primary = sorted(
+        {(v["width"], v["path"]) for v in variants if v.get("format") == PRIMARY_FORMAT}
+        | {original}
+    )
+    srcset_str = _srcset_string(primary)
+    preview_path = primary[0][1]
+
+    return srcset_str, preview_path, created, variants, sources
+
+
+def _needs_encode(
+    path: str,
+    params: dict,
+    known_params: Optional[Dict[str, dict]],
+    stale_before: Optional[int],
+    overwrite: bool,
+    fingerprint: bool,
+) -> bool:
+    """
+    Нужно ли (пере)кодировать вариант. С отпечатком имя зависит от
+    содержимого и параметров, так что достаточно, чтобы файл был. Иначе
+    файл берётся, только если он не старше исходника и прошлая сборка
+    записала для него те же параметры: о файле без записи неизвестно, чем
+    он закодирован. known_params=None (сборка без манифеста, build_srcset)
+    — параметры не проверяются.
+    """
+    if fingerprint:
+        return not os.path.exists(path)
+    if overwrite or not _is_reusable(path, stale_before):
+        return True
+    return known_params is not None and known_params.get(path) != params
+
+
+def _is_reusable(path: str, stale_before: Optional[int]) -> bool:
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return stale_before is None or mtime_ns >= stale_before
+
+
 def build_srcset(
     src: str,
     sizes: Iterable[int],
@@ -55,85 +436,607 @@ def build_srcset(
     """
     Возвращает (srcset, preview_path, created_count).
     """
-    created = 0
-    srcset_entries: List[Tuple[int, str]] = []
+    return render_variants(src, sizes, output_dir)[:3]
 
-    with Image.open(src) as img:
-        orig_w, orig_h = img.size
 
-        for target in sizes:
-            if max(orig_w, orig_h) <= target:
-                continue
+def _entry_matches(entry: Optional[dict], content_hash: str, options: dict) -> bool:
+    if not entry or entry.get("hash") != content_hash or entry.get("options") != options:
+        return False
+    return variants_exist(entry)
+
+
+def process_item(
+    src: str,
+    options: dict,
+    output_dir: str,
+    previous: Optional[dict] = None,
+) -> dict:
+    """
+    Обрабатывает один элемент галереи: размеры по заголовку + варианты
+    за одно открытие файла. Видео передаются в process_video_item.
+    Если хеш содержимого совпадает с записью манифеста (файл только «тронули»),
+    изображение не декодируется. Выполняется в воркере пула, поэтому ошибки
+    возвращаются в результате.
+    """
+    if is_video(src, {}):
+        return process_video_item(src, video_options(options), output_dir, previous)
+    started = time.perf_counter()
+    result = {"src": src, "created": 0}
+    try:
+        signature = stat_signature(src)
+        content_hash = file_hash(src)
+        if _entry_matches(previous, content_hash, options):
+            entry = dict(previous, **signature)
+        else:
+            # Новый хеш — старые варианты устарели; без записи (или при смене
+            # только параметров) доверяем вариантам новее исходника.
+            overwrite = previous is not None and previous.get("hash") != content_hash
+            width, height = probe_dimensions(src)
+            extra: dict = {}
+
+            def inspect(img: Image.Image) -> None:
+                extra.update(build_placeholder(img))
+                extra["dhash"] = dhash(img)
+
+            known_params = {
+                variant["path"]: variant.get("params")
+                for variant in (previous or {}).get("variants", [])
+            }
+            srcset, preview, created, variants, sources = render_variants(
+                src,
+                options["sizes"],
+                output_dir,
+                overwrite=overwrite,
+                stale_before=signature["mtime_ns"],
+                dimensions=(width, height),
+                content_hash=content_hash,
+                fingerprint=options["fingerprint"],
+                fingerprint_originals=options["fingerprint_originals"],
+                on_image=inspect,
+                formats=options["formats"],
+                profiles=options["profiles"],
+                known_params=known_params,
+            )
+            result["created"] = created
+            entry = {
+                "hash": content_hash,
+                "width": width,
+                "height": height,
+                "options": options,
+                "srcset": srcset,
+                "preview": preview,
+                "sources": sources,
+                "variants": variants,
+                **extra,
+                **signature,
+            }
+        result["entry"] = entry
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
 
-            new_w, new_h = resized_dimensions(orig_w, orig_h, target)
+def process_video_item(
+    src: str,
+    options: dict,
+    output_dir: str,
+    previous: Optional[dict] = None,
+) -> dict:
+    """
+    Постер и потоки для видео. Кадр постера сохраняется в WebP (уровень
+    профиля "poster") и уменьшается render_variants, как изображение.
+    Потоки с теми же параметрами, что в прошлой сборке, и не старше
+    исходника не перекодируются. Ошибки возвращаются в результате.
+    """
+    started = time.perf_counter()
+    result = {"src": src, "created": 0}
+    try:
+        ffmpeg = find_ffmpeg()
+        if not ffmpeg:
+            raise VideoError("ffmpeg not found")
+        signature = stat_signature(src)
+        content_hash = file_hash(src)
+        if _entry_matches(previous, content_hash, options):
+            entry = dict(previous, **signature)
+        else:
+            overwrite = previous is not None and previous.get("hash") != content_hash
+            fingerprint = options["fingerprint"]
+            stale_before = None if fingerprint else signature["mtime_ns"]
+            settings = options["video"]
+            known_params = {
+                variant["path"]: variant.get("params")
+                for variant in (previous or {}).get("variants", [])
+            }
             stem, _ = os.path.splitext(os.path.basename(src))
-            out_name = f"{stem}-{target}.webp"
-            out_path = os.path.join(output_dir, out_name)
+            created = 0
 
-            if not os.path.exists(out_path):
-                resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                resized.save(out_path, "WEBP", lossless=True)
+            poster_params = {
+                **encode_params(options["profiles"], PRIMARY_FORMAT, POSTER_TIER),
+                "time": settings["poster_time"],
+            }
+            tag = f".{fingerprint_for(content_hash, POSTER_TIER, poster_params)}" if fingerprint else ""
+            poster_path = os.path.join(output_dir, f"{stem}-poster{tag}.webp")
+            if _needs_encode(poster_path, poster_params, known_params, stale_before, overwrite, fingerprint):
+                with extract_frame(src, ffmpeg, settings["poster_time"]) as frame:
+                    params = dict(poster_params)
+                    params.pop("time")
+                    _encodable(frame).save(poster_path, params.pop("format"), **params)
                 created += 1
+            width, height = probe_dimensions(poster_path)
+            variants = [{
+                "path": poster_path,
+                "target": None,
+                "width": width,
+                "height": height,
+                "format": PRIMARY_FORMAT,
+                "params": poster_params,
+                "bytes": os.path.getsize(poster_path),
+            }]
+
+            extra: dict = {}
+            # Варианты старше кадра постера сделаны из прежнего кадра
+            poster_srcset, poster, poster_created, poster_variants, poster_sources = render_variants(
+                poster_path,
+                options["sizes"],
+                output_dir,
+                overwrite=overwrite,
+                stale_before=os.stat(poster_path).st_mtime_ns,
+                dimensions=(width, height),
+                content_hash=content_hash,
+                fingerprint=fingerprint,
+                on_image=lambda img: extra.update(build_placeholder(img)),
+                formats=options["formats"],
+                profiles=options["profiles"],
+                known_params=known_params,
+            )
+            created += poster_created
+            variants.extend(poster_variants)
+
+            streams = []
+            for tier, tier_params in sorted(settings["tiers"].items(), key=lambda pair: int(pair[0])):
+                target = int(tier)
+                if max(width, height) <= target:
+                    continue
+                size = stream_dimensions(width, height, target)
+                params = {**settings["params"], **tier_params}
+                if fingerprint:
+                    out_name = f"{stem}-{target}.{fingerprint_for(content_hash, target, params)}.mp4"
+                else:
+                    out_name = f"{stem}-{target}.mp4"
+                out_path = os.path.join(output_dir, out_name)
+                if _needs_encode(out_path, params, known_params, stale_before, overwrite, fingerprint):
+                    encode_stream(src, out_path, ffmpeg, size, tier_params, settings["params"])
+                    created += 1
+                size_bytes = os.path.getsize(out_path)
+                variants.append({
+                    "path": out_path,
+                    "target": target,
+                    "width": size[0],
+                    "height": size[1],
+                    "format": "mp4",
+                    "params": params,
+                    "bytes": size_bytes,
+                })
+                streams.append({
+                    "src": out_path,
+                    "type": VIDEO_MIME,
+                    "width": size[0],
+                    "height": size[1],
+                    "bytes": size_bytes,
+                })
+
+            result["created"] = created
+            entry = {
+                "hash": content_hash,
+                "width": width,
+                "height": height,
+                "options": options,
+                "poster": poster,
+                "poster_srcset": poster_srcset,
+                "poster_sources": poster_sources,
+                "streams": streams,
+                "variants": variants,
+                **extra,
+                **signature,
+            }
+        result["entry"] = entry
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
+
+def iter_processed(
+    tasks: Sequence[Tuple[str, Optional[dict]]],
+    options: dict,
+    output_dir: str,
+    jobs: int = 1,
+) -> Iterator[dict]:
+    """
+    Отдает результаты process_item по мере готовности.
+    При jobs > 1 работа распределяется по пулу процессов; лимиты памяти
+    и размера (image_resize.configure) передаются каждому воркеру.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        for src, previous in tasks:
+            yield process_item(src, options, output_dir, previous)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(tasks)), initializer=configure, initargs=limits()
+    ) as pool:
+        futures = [
+            pool.submit(process_item, src, options, output_dir, previous)
+            for src, previous in tasks
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _apply_entry(item: dict, entry: dict) -> bool:
+    """
+    Переносит размеры, плейсхолдер, srcset и sources из записи манифеста.
+    sources пишется, только если кроме основного формата есть другие —
+    иначе он повторял бы srcset. True, если srcset или sources изменились.
+    """
+    if item.get("width") != entry["width"] or item.get("height") != entry["height"]:
+        item["width"] = entry["width"]
+        item["height"] = entry["height"]
+
+    for key in ("placeholder", "color"):
+        if key in entry:
+            item[key] = entry[key]
+        else:
+            item.pop(key, None)
+
+    sources = entry.get("sources", [])
+    if len(sources) < 2:
+        sources = None
+    changed = item.get("sources") != sources
+    if sources:
+        item["sources"] = sources
+    else:
+        item.pop("sources", None)
+
+    if item.get("srcset") != entry["srcset"] or item.get("preview") != entry["preview"]:
+        item["srcset"] = entry["srcset"]
+        item["preview"] = entry["preview"]
+        return True
+    return changed
+
+
+def _apply_video_entry(item: dict, entry: dict) -> bool:
+    """
+    Переносит в элемент-видео размеры, плейсхолдер, постер и потоки из
+    записи манифеста (poster_sources — как sources у изображений).
+    True, если элемент изменился.
+    """
+    before = dict(item)
+    for key in VIDEO_FIELDS:
+        value = entry.get(key)
+        if key == "poster_sources" and len(value or []) < 2:
+            value = None
+        if value:
+            item[key] = value
+        else:
+            item.pop(key, None)
+    return item != before
+
+
+def _srcset_paths(srcset: Optional[str]) -> List[str]:
+    return [part.split()[0] for part in (srcset or "").split(",") if part.strip()]
+
 
-            srcset_entries.append((new_w, out_path))
+def item_references(item: dict) -> Set[str]:
+    """Файлы, на которые ссылается элемент галереи (srcset, превью, постер, потоки)."""
+    paths = set(_srcset_paths(item.get("srcset")) + _srcset_paths(item.get("poster_srcset")))
+    for key in ("preview", "poster"):
+        if item.get(key):
+            paths.add(item[key])
+    for key in ("sources", "poster_sources"):
+        for source in item.get(key) or []:
+            paths.update(_srcset_paths(source.get("srcset")))
+    for stream in item.get("streams") or []:
+        if stream.get("src"):
+            paths.add(stream["src"])
+    return paths
 
-    srcset_entries.append((orig_w, src))
-    srcset_entries = sorted(set(srcset_entries), key=lambda x: x[0])
-    srcset_str = ", ".join([f"{path} {width}w" for width, path in srcset_entries])
-    preview_path = srcset_entries[0][1] if srcset_entries else src
 
-    return srcset_str, preview_path, created
+def _format_bytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def variant_bytes(entries: Iterable[dict]) -> Dict[str, int]:
+    """Суммарный размер вариантов по форматам (копии оригиналов — "original")."""
+    totals: Dict[str, int] = {}
+    for entry in entries:
+        for variant in entry.get("variants", []):
+            fmt = variant.get("format", "original")
+            totals[fmt] = totals.get(fmt, 0) + variant.get("bytes", 0)
+    return totals
 
 
 def update_gallery(
     gallery_path: str,
     sizes: Iterable[int],
     output_dir: str,
-) -> None:
+    jobs: int = 1,
+    verbose: bool = False,
+    manifest_path: Optional[str] = None,
+    srcs: Optional[Iterable[str]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    fingerprint: bool = False,
+    fingerprint_originals: bool = False,
+    formats: Optional[Iterable[str]] = None,
+    profiles: Optional[dict] = None,
+) -> dict:
+    """
+    Обновляет размеры и srcset изображений галереи, постеры и потоки видео.
+    Неизменённые по манифесту элементы не открываются. После полной сборки
+    удаляются варианты, на которые не ссылаются ни манифест, ни элементы
+    галереи (если одновременно не идёт другая сборка в тот же output_dir —
+    см. BuildLock).
+    srcs ограничивает обработку указанными исходниками (без сборки мусора:
+    манифест знает только о том, что уже собиралось), progress(done, total)
+    вызывается по мере готовности элементов. fingerprint/fingerprint_originals
+    добавляют отпечаток содержимого в имена вариантов и копий оригиналов.
+    formats — форматы вариантов (None — только WebP), profiles —
+    профили кодирования (None — DEFAULT_PROFILES).
+    jobs=0 означает «по числу ядер». Возвращает сводку с временем по элементам.
+    """
+    started = time.perf_counter()
+    options = asset_options(
+        sizes, fingerprint, fingerprint_originals, resolve_formats(formats), profiles
+    )
+    ffmpeg = find_ffmpeg()
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    only = set(srcs) if srcs is not None else None
+    manifest_path = manifest_path or default_manifest_path(output_dir)
     items = load_gallery(gallery_path)
     os.makedirs(output_dir, exist_ok=True)
+    build_lock = BuildLock(output_dir)
+    with build_lock:
+        manifest = AssetManifest.load(manifest_path)
 
-    updated = 0
-    created = 0
-    missing = 0
+        updated = 0
+        created = 0
+        missing = 0
+        skipped = 0
+        videos_skipped = 0
+        tasks: Dict[str, Optional[dict]] = {}
+        entries: Dict[str, dict] = {}
+        new_entries: Dict[str, dict] = {}
+        timings: List[Tuple[str, float]] = []
 
-    for item in items:
-        src = item.get("src", "")
-        if not src or is_video(src, item):
-            item.pop("preview", None)
-            item.pop("srcset", None)
-            continue
+        for item in items:
+            src = item.get("src", "")
+            video = bool(src) and is_video(src, item)
+            if not src or not (video or is_image(src)):
+                continue
 
-        if not is_image(src):
-            continue
+            if only is not None and src not in only:
+                continue
 
-        if not os.path.exists(src):
-            missing += 1
-            continue
+            if not os.path.exists(src):
+                missing += 1
+                continue
 
-        try:
-            with Image.open(src) as img:
-                width, height = img.size
-            if item.get("width") != width or item.get("height") != height:
-                item["width"] = width
-                item["height"] = height
+            if video and not ffmpeg:
+                # Без ffmpeg прежние постеры и потоки остаются в силе
+                if manifest.get(src):
+                    entries[src] = manifest.get(src)
+                videos_skipped += 1
+                continue
+
+            if manifest.is_fresh(src, video_options(options) if video else options):
+                entries[src] = manifest.get(src)
+                skipped += 1
+                continue
+
+            tasks[src] = manifest.get(src)
+
+        if progress:
+            progress(0, len(tasks))
+        for done, result in enumerate(
+            iter_processed(list(tasks.items()), options, output_dir, jobs), start=1
+        ):
+            timings.append((result["src"], result["elapsed"]))
+            if verbose:
+                print(f"[{done}/{len(tasks)}] {result['src']} {result['elapsed']:.2f}s")
+            if progress:
+                progress(done, len(tasks))
+
+            if "error" in result:
+                print(f"✗ {result['src']}: {result['error']}")
+                missing += 1
+                continue
+
+            created += result["created"]
+            entries[result["src"]] = new_entries[result["src"]] = result["entry"]
+
+        # Пока шла обработка, галерею могли изменить (админка или другая задача),
+        # поэтому результаты накладываются по src на актуальную копию под
+        # блокировкой хранилища.
+        with get_store(gallery_path).mutate() as items:
+            manifest = AssetManifest.load(manifest_path)
+            live_srcs: List[str] = []
+
+            for item in items:
+                src = item.get("src", "")
+                if not src:
+                    continue
+
+                if is_video(src, item):
+                    item.pop("preview", None)
+                    item.pop("srcset", None)
+                    item.pop("sources", None)
+                    if not os.path.exists(src):
+                        continue
+                    live_srcs.append(src)
+                    entry = entries.get(src)
+                    if entry and _apply_video_entry(item, entry):
+                        updated += 1
+                    continue
 
-            srcset, preview, created_count = build_srcset(src, sizes, output_dir)
-            created += created_count
+                if not is_image(src) or not os.path.exists(src):
+                    continue
 
-            if item.get("srcset") != srcset or item.get("preview") != preview:
-                item["srcset"] = srcset
-                item["preview"] = preview
-                updated += 1
-        except Exception:
-            missing += 1
+                live_srcs.append(src)
+                entry = entries.get(src)
+                if entry and _apply_entry(item, entry):
+                    updated += 1
 
-    save_gallery(gallery_path, items)
+            for src, entry in new_entries.items():
+                manifest.set(src, entry)
+            manifest.prune(live_srcs)
+            removed: List[str] = []
+            # Пока идёт другая сборка, её новые варианты ещё не в манифесте
+            if only is None and build_lock.exclusive():
+                keep: Set[str] = set()
+                for item in items:
+                    keep |= item_references(item)
+                removed = collect_garbage(manifest, output_dir, keep)
+            manifest.save()
+    elapsed = time.perf_counter() - started
+    bytes_by_format = variant_bytes(manifest.entries.values())
+    original_bytes = sum(entry.get("bytes", 0) for entry in manifest.entries.values())
 
     print(f"Updated items: {updated}")
     print(f"Created resized files: {created}")
+    print(f"Unchanged (skipped): {skipped}")
+    print(f"Removed orphaned files: {len(removed)}")
     print(f"Missing/failed: {missing}")
+    if videos_skipped:
+        print(f"Videos skipped (ffmpeg not found): {videos_skipped}")
+    print(f"Originals: {_format_bytes(original_bytes)}")
+    for fmt, size in sorted(bytes_by_format.items()):
+        print(f"Variants ({fmt}): {_format_bytes(size)}")
     print(f"Total items: {len(items)}")
+    print(f"Elapsed: {elapsed:.2f}s (jobs: {jobs})")
+
+    return {
+        "updated": updated,
+        "created": created,
+        "skipped": skipped,
+        "removed": removed,
+        "missing": missing,
+        "videos_skipped": videos_skipped,
+        "total": len(items),
+        "elapsed": elapsed,
+        "timings": timings,
+        "bytes": bytes_by_format,
+    }
+
+
+def _gallery_files(gallery_path: str) -> List[str]:
+    """Файлы хранилища галереи, изменения которых видит --watch."""
+    if is_sqlite_path(gallery_path):
+        return [gallery_path, gallery_path + "-wal"]
+    return [gallery_path]
+
+
+def _files_signature(paths: Iterable[str]) -> tuple:
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            signature.append(None)
+            continue
+        signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def affected_srcs(changed: Iterable[str], srcs: Iterable[str]) -> Set[str]:
+    """Исходники из srcs, совпадающие с изменёнными путями или лежащие в них."""
+    changed = {os.path.normpath(path) for path in changed}
+    affected = set()
+    for src in srcs:
+        path = os.path.normpath(src)
+        if path in changed or any(path.startswith(c + os.sep) for c in changed):
+            affected.add(src)
+    return affected
+
+
+def _gallery_srcs(gallery_path: str) -> Set[str]:
+    return {item["src"] for item in load_gallery(gallery_path) if item.get("src")}
+
+
+def publish_static(gallery_path: str, template_path: str = STATIC_TEMPLATE) -> None:
+    """Перегенерирует index_static.html (и gallery.json при SQLite-хранилище)."""
+    from gallery_db import export_json
+    from generate_static import generate_static_html
+
+    store = get_store(gallery_path)
+    if is_sqlite_path(gallery_path):
+        export_json(store, "gallery.json")
+    output_file, item_count, changed = generate_static_html(store.items(), template_path)
+    status = "regenerated" if changed else "unchanged"
+    print(f"✓ Static page {status}: {output_file} ({item_count} items)")
+
+
+def watch_gallery(
+    gallery_path: str,
+    sizes: Iterable[int],
+    output_dir: str,
+    watch_dirs: Sequence[str] = (WATCH_DIR,),
+    static: bool = True,
+    debounce: float = DEBOUNCE,
+    polling: bool = False,
+    **options,
+) -> None:
+    """
+    Держит ассеты в актуальном состоянии: после каждой пачки изменений в
+    watch_dirs (кроме output_dir) и в хранилище галереи обрабатывает только
+    затронутые исходники — изменённые файлы и новые записи; удалённые
+    записи и файлы чистятся через манифест. Затем, если static, страница
+    перегенерируется. Собственные записи в gallery.json пропускаются по
+    подписи файла. options передаются в update_gallery.
+    """
+    sizes = list(sizes)
+    gallery_files = _gallery_files(gallery_path)
+    files = gallery_files + ([STATIC_TEMPLATE] if static else [])
+    watcher = open_watcher(watch_dirs, files, exclude=[output_dir], polling=polling)
+    mode = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+    # Сначала догоняем всё, что изменилось, пока наблюдения не было
+    update_gallery(gallery_path, sizes, output_dir, **options)
+    if static:
+        publish_static(gallery_path)
+    known_signature = _files_signature(gallery_files)
+    known_srcs = _gallery_srcs(gallery_path)
+    print(f"✓ Watching {', '.join(list(watch_dirs) + files)} ({mode}), Ctrl+C to stop")
+
+    with watcher:
+        for changes in batches(watcher, debounce):
+            try:
+                srcs = _gallery_srcs(gallery_path)
+                gallery_changed = _files_signature(gallery_files) != known_signature
+                if changes is None:
+                    # Очередь событий переполнилась: проверяем всё по манифесту
+                    targets: Optional[Set[str]] = None
+                    print("Too many changes, rescanning everything")
+                else:
+                    targets = affected_srcs(changes, srcs)
+                    if gallery_changed:
+                        targets |= srcs - known_srcs
+                template_changed = static and (
+                    changes is None or os.path.normpath(STATIC_TEMPLATE) in changes
+                )
+                removed = gallery_changed and bool(known_srcs - srcs)
+                if targets is None or targets or removed:
+                    count = "all" if targets is None else len(targets)
+                    print(f"[{time.strftime('%H:%M:%S')}] Sources to update: {count}")
+                    update_gallery(gallery_path, sizes, output_dir, srcs=targets, **options)
+                elif not (gallery_changed or template_changed):
+                    continue
+                if static:
+                    publish_static(gallery_path)
+                known_signature = _files_signature(gallery_files)
+                known_srcs = _gallery_srcs(gallery_path)
+            except Exception as e:
+                print(f"✗ Update failed: {e}")
 
 
 def parse_args() -> argparse.Namespace:
@@ -153,13 +1056,141 @@ def parse_args() -> argparse.Namespace:
         default=DEFAULT_OUTPUT_DIR,
         help="Directory for resized images (default: w/rs)",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="Path to asset manifest (default: <output-dir>/.manifest.json)",
+    )
+    parser.add_argument(
+        "--fingerprint",
+        action="store_true",
+        help="Add a content hash to variant filenames (name-800.<hash>.webp)",
+    )
+    parser.add_argument(
+        "--fingerprint-originals",
+        action="store_true",
+        help="Also reference originals via fingerprinted copies in the output dir",
+    )
+    parser.add_argument(
+        "--formats",
+        default=PRIMARY_FORMAT,
+        help=f"Comma-separated variant formats: avif,webp or auto = all supported (default: {PRIMARY_FORMAT})",
+    )
+    parser.add_argument(
+        "--profiles",
+        default=None,
+        help="JSON file with encode profiles per format and size tier",
+    )
+    parser.add_argument(
+        "--lossless",
+        action="store_true",
+        help="Encode WebP variants losslessly (previous behaviour)",
+    )
+    parser.add_argument(
+        "--max-pixels",
+        type=int,
+        default=None,
+        help="Reject sources with more pixels than this (default: GALLERY_MAX_PIXELS or 80M)",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        default=None,
+        help="Per-worker memory budget for decoding, MB (default: GALLERY_WORKER_MEMORY_MB or 512)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Worker processes for resizing, 0 = CPU count (default: 1)",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print per-item processing time",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=f"Keep running and update assets when {WATCH_DIR}/ or the gallery changes",
+    )
+    parser.add_argument(
+        "--watch-dir",
+        action="append",
+        default=None,
+        help=f"Directory with sources to watch, repeatable (default: {WATCH_DIR})",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEBOUNCE,
+        help=f"--watch: seconds of quiet before processing a burst of changes (default: {DEBOUNCE})",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="--watch: poll for changes instead of using inotify",
+    )
+    parser.add_argument(
+        "--no-static",
+        action="store_true",
+        help="--watch: do not regenerate index_static.html",
+    )
+    args = parser.parse_args()
+    if args.formats != "auto":
+        unknown = [f for f in args.formats.split(",") if f.strip().lower() not in FORMATS]
+        if unknown:
+            parser.error(f"unknown formats: {', '.join(unknown)} (known: {', '.join(FORMATS)})")
+    return args
 
 
 def main() -> None:
     args = parse_args()
     sizes = [int(s.strip()) for s in args.sizes.split(",") if s.strip()]
-    update_gallery(args.gallery, sizes, args.output_dir)
+    if args.formats == "auto":
+        formats = supported_formats()
+    else:
+        formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    configure(
+        max_pixels=args.max_pixels,
+        memory_limit=args.memory_limit * 1024 * 1024 if args.memory_limit else None,
+    )
+    profiles = load_profiles(args.profiles)
+    if args.lossless:
+        profiles["webp"] = LOSSLESS_WEBP_PROFILE
+    if args.watch:
+        try:
+            watch_gallery(
+                args.gallery,
+                sizes,
+                args.output_dir,
+                watch_dirs=args.watch_dir or [WATCH_DIR],
+                static=not args.no_static,
+                debounce=args.debounce,
+                polling=args.poll,
+                jobs=args.jobs,
+                verbose=args.verbose,
+                manifest_path=args.manifest,
+                fingerprint=args.fingerprint,
+                fingerprint_originals=args.fingerprint_originals,
+                formats=formats,
+                profiles=profiles,
+            )
+        except KeyboardInterrupt:
+            print("Stopped watching")
+        return
+    update_gallery(
+        args.gallery,
+        sizes,
+        args.output_dir,
+        jobs=args.jobs,
+        verbose=args.verbose,
+        manifest_path=args.manifest,
+        fingerprint=args.fingerprint,
+        fingerprint_originals=args.fingerprint_originals,
+        formats=formats,
+        profiles=profiles,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Приём загруженных файлов без полных копий в памяти.
+
+Каждый файл запроса кусками копируется во временный файл в каталоге
+загрузок. Изображение конвертируется в WebP прямо из него в итоговый файл
+(через временное имя + rename), видео просто переименовывается. Файлы
+пачки обрабатываются общим пулом потоков ограниченного размера: Pillow
+отпускает GIL при декодировании и кодировании, а число одновременно
+декодируемых изображений не растёт с размером пачки и числом запросов.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+from image_dedupe import dhash
+from image_resize import check_dimensions
+
+SPOOL_CHUNK = 1024 * 1024
+# mkstemp создаёт файлы 0600, а загрузки раздаются как статика
+# (как в video_assets.encode_stream)
+FILE_MODE = 0o644
+VIDEO_EXTENSIONS = {"mp4", "webm"}
+
+
+def is_video_name(filename: str) -> bool:
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in VIDEO_EXTENSIONS
+
+
+def target_name(filename: str) -> str:
+    """Имя файла в каталоге загрузок: видео как есть, изображения — .webp."""
+    base = secure_filename(filename.rsplit(".", 1)[0])
+    if is_video_name(filename):
+        return f"{base}.{filename.rsplit('.', 1)[1].lower()}"
+    return f"{base}.webp"
+
+
+def spool(stream: BinaryIO, directory: str) -> str:
+    """Копирует поток кусками во временный файл в directory, возвращает путь."""
+    fd, path = tempfile.mkstemp(prefix=".upload-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(stream, f, SPOOL_CHUNK)
+        # Видео становится итоговым файлом через rename
+        os.chmod(path, FILE_MODE)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def convert_to_webp(source: str, dest: str) -> str:
+    """
+    Конвертирует файл в WebP сразу на диск. Слишком большие изображения
+    отклоняются по заголовку (ImageTooLarge), до декодирования.
+    Возвращает dHash изображения (по уже декодированному кадру).
+    """
+    with Image.open(source) as img:
+        check_dimensions(*img.size)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".ingest-", suffix=".webp", dir=os.path.dirname(dest) or "."
+        )
+        os.close(fd)
+        try:
+            if getattr(img, "is_animated", False):
+                img.save(tmp_path, format="WEBP", save_all=True)
+            else:
+                img.save(tmp_path, format="WEBP")
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        img.seek(0)
+        return dhash(img)
+
+
+def ingest_file(stream: BinaryIO, filename: str, directory: str) -> dict:
+    """
+    Сохраняет один загруженный файл в directory.
+    Возвращает {file, success, type, bytes, elapsed[, dhash]}
+    или {file, success, error}.
+    """
+    started = time.perf_counter()
+    name = target_name(filename)
+    dest = os.path.join(directory, name)
+    spooled = None
+    extra = {}
+    try:
+        spooled = spool(stream, directory)
+        if is_video_name(filename):
+            os.replace(spooled, dest)
+            spooled = None
+        else:
+            extra["dhash"] = convert_to_webp(spooled, dest)
+    except UnidentifiedImageError:
+        return {"file": filename, "success": False, "error": "Unsupported image format"}
+    except Exception as e:
+        return {"file": filename, "success": False, "error": str(e)}
+    finally:
+        if spooled is not None and os.path.exists(spooled):
+            os.remove(spooled)
+    return {
+        "file": name,
+        "success": True,
+        "type": "video" if is_video_name(filename) else "image",
+        "bytes": os.path.getsize(dest),
+        "elapsed": round(time.perf_counter() - started, 3),
+        **extra,
+    }
+
+
+class Ingestor:
+    """
+    Общий для всех запросов пул приёма файлов. progress(done, total, result)
+    вызывается по мере готовности каждого файла пачки.
+    """
+
+    def __init__(self, workers: int = 2):
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # Пул создаётся лениво, как потоки JobQueue
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="upload-ingest"
+                )
+            return self._pool
+
+    def ingest(
+        self,
+        files: Sequence[Tuple[BinaryIO, str]],
+        directory: str,
+        progress: Optional[Callable[[int, int, dict], None]] = None,
+    ) -> List[dict]:
+        """Принимает пачку (stream, filename); результаты в порядке files."""
+        pool = self._executor()
+        futures = {
+            pool.submit(ingest_file, stream, filename, directory): index
+            for index, (stream, filename) in enumerate(files)
+        }
+        results: List[dict] = [{} for _ in files]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+            if progress:
+                progress(done, len(files), result)
+        return results
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Постеры и облегчённые потоки для видео галереи через ffmpeg.
+
+- Постер — кадр на POSTER_TIME секунде (у коротких роликов — первый),
+  он забирается из ffmpeg через pipe в PNG и дальше идёт обычным путём
+  изображений: WebP/AVIF-варианты, srcset и плейсхолдер.
+- Потоки — H.264 (mp4, без звука, faststart) с наибольшей стороной из
+  VIDEO_TIERS; уровни не крупнее исходника пропускаются.
+
+ffmpeg необязателен: ищется в PATH или берётся из переменной FFMPEG.
+Без него update_gallery_assets оставляет видео как есть.
+"""
+from __future__ import annotations
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Optional, Tuple
+
+from PIL import Image
+
+# Секунда, с которой берётся кадр постера
+POSTER_TIME = 1.0
+# Уровни потоков: наибольшая сторона → параметры x264
+VIDEO_TIERS = {
+    "480": {"crf": 30},
+    "720": {"crf": 27},
+}
+VIDEO_PARAMS = {"codec": "libx264", "preset": "slow", "pix_fmt": "yuv420p"}
+VIDEO_MIME = "video/mp4"
+# Экраны, на которых страница берёт наименьший поток
+MOBILE_MEDIA = "(max-width: 768px)"
+FFMPEG_TIMEOUT = 900
+
+
+class VideoError(RuntimeError):
+    """ffmpeg завершился с ошибкой или не вернул кадр."""
+
+
+def find_ffmpeg() -> Optional[str]:
+    """Путь к ffmpeg: переменная FFMPEG или PATH; None, если его нет."""
+    configured = os.environ.get("FFMPEG")
+    if configured:
+        return configured if os.path.exists(configured) else shutil.which(configured)
+    return shutil.which("ffmpeg")
+
+
+def video_settings() -> dict:
+    """Параметры видео для options манифеста: их смена пересобирает записи."""
+    return {"poster_time": POSTER_TIME, "tiers": VIDEO_TIERS, "params": VIDEO_PARAMS}
+
+
+def _run(command: list) -> bytes:
+    try:
+        completed = subprocess.run(command, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise VideoError(f"ffmpeg timed out after {FFMPEG_TIMEOUT}s")
+    if completed.returncode != 0:
+        message = completed.stderr.decode("utf-8", "replace").strip().splitlines()
+        raise VideoError(message[-1] if message else f"ffmpeg exited with {completed.returncode}")
+    return completed.stdout
+
+
+def extract_frame(src: str, ffmpeg: str, at: float = POSTER_TIME) -> Image.Image:
+    """
+    Кадр видео на секунде at как изображение Pillow (декодированное).
+    Если ролик короче, берётся первый кадр.
+    """
+    for offset in (at, 0) if at else (0,):
+        data = _run([
+            ffmpeg, "-v", "error", "-nostdin",
+            "-ss", str(offset), "-i", src,
+            "-frames:v", "1", "-f", "image2pipe", "-c:v", "png", "-",
+        ])
+        if data:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            return img
+    raise VideoError(f"No video frame in {src}")
+
+
+def stream_dimensions(width: int, height: int, target: int) -> Tuple[int, int]:
+    """Размер потока с наибольшей стороной target; H.264 нужны чётные стороны."""
+    if width >= height:
+        new_w, new_h = target, height * target / width
+    else:
+        new_w, new_h = width * target / height, target
+    return max(2, round(new_w / 2) * 2), max(2, round(new_h / 2) * 2)
+
+
+def encode_stream(
+    src: str,
+    dest: str,
+    ffmpeg: str,
+    size: Tuple[int, int],
+    tier: dict,
+    params: dict = VIDEO_PARAMS,
+) -> None:
+    """Перекодирует src в mp4 размера size; файл появляется атомарно."""
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".video-", suffix=".mp4", dir=os.path.dirname(dest) or "."
+    )
+    os.close(fd)
+    try:
+        _run([
+            ffmpeg, "-v", "error", "-nostdin", "-y", "-i", src,
+            "-vf", f"scale={size[0]}:{size[1]}",
+            "-c:v", params["codec"], "-preset", params["preset"],
+            "-crf", str(tier["crf"]), "-pix_fmt", params["pix_fmt"],
+            "-an", "-movflags", "+faststart",
+            tmp_path,
+        ])
+        # mkstemp создаёт файл 0600, а поток раздаётся как статика
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Продакшен-запуск сервера галереи: без debug и reloader'а, настройки из
+окружения (см. server.load_config; GALLERY_SECRET_KEY обязателен для
+нескольких воркеров — сессии должны читаться любым из них).
+
+Любой WSGI-сервер:
+    METRICS_DIR=/tmp/gallery-metrics gunicorn -w 4 --threads 8 -b 0.0.0.0:8000 'server:create_app()'
+или встроенный prefork-сервер без зависимостей:
+    python3 wsgi.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+Он открывает сокет один раз и запускает воркеры через fork: у каждого своё
+приложение (create_app вызывается уже в воркере) и пул из --threads
+потоков. Упавшие воркеры перезапускаются, по SIGTERM/SIGINT воркеры
+дообрабатывают начатые запросы и завершаются. Если METRICS_DIR не задан,
+для снимков метрик создаётся временный каталог.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from server import DEFAULT_SECRET_KEY, create_app
+
+DEFAULT_BIND = "127.0.0.1:8000"
+DEFAULT_THREADS = 8
+# Сколько ждать следующего запроса в keep-alive соединении: простаивающее
+# соединение занимает поток пула
+KEEPALIVE_TIMEOUT = 5
+LISTEN_BACKLOG = 1024
+# Пауза перед перезапуском упавшего воркера (чтобы не крутиться в цикле)
+RESPAWN_DELAY = 1.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI-сервер werkzeug с пулом потоков фиксированного размера."""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+
+    def process_request(self, request, client_address) -> None:
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self) -> None:
+        """Дожидается запросов, уже переданных в пул, и закрывает сокет."""
+        self.pool.shutdown(wait=True)
+        self.server_close()
+
+
+def parse_bind(bind: str) -> Tuple[str, int]:
+    host, _, port = bind.rpartition(":")
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def run_worker(sock: socket.socket, host: str, port: int, threads: int) -> None:
+    """Цикл воркера: своё приложение, общий слушающий сокет."""
+    server = PooledWSGIServer(host, port, create_app(), threads, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() ждёт выхода из serve_forever, поэтому не из обработчика
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    # Ctrl+C получает вся группа процессов; останавливает воркеры мастер
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        server.serve_forever()
+    finally:
+        server.drain()
+
+
+def serve(bind: str, workers: int, threads: int) -> None:
+    host, port = parse_bind(bind)
+    sock = socket.create_server(
+        (host, port),
+        family=socket.AF_INET6 if ":" in host else socket.AF_INET,
+        backlog=LISTEN_BACKLOG,
+    )
+    print(f"✓ Listening on http://{bind} ({workers} workers × {threads} threads)", file=sys.stderr)
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        run_worker(sock, host, port, threads)
+        return
+
+    metrics_dir = None
+    if not os.environ.get("METRICS_DIR"):
+        metrics_dir = tempfile.mkdtemp(prefix="gallery-metrics-")
+        os.environ["METRICS_DIR"] = metrics_dir
+
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, host, port, threads)
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = children.pop(pid, None)
+            if stopping or started is None:
+                continue
+            print(f"✗ Worker {pid} exited ({status}), restarting", file=sys.stderr)
+            if time.monotonic() - started < RESPAWN_DELAY:
+                time.sleep(RESPAWN_DELAY)
+            if not stopping:
+                spawn()
+    finally:
+        sock.close()
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the gallery server with worker processes.")
+    parser.add_argument(
+        "--bind",
+        default=os.environ.get("GALLERY_BIND", DEFAULT_BIND),
+        help=f"host:port to listen on (default: GALLERY_BIND or {DEFAULT_BIND})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("GALLERY_WORKERS", os.cpu_count() or 1)),
+        help="Worker processes (default: GALLERY_WORKERS or CPU count)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("GALLERY_THREADS", DEFAULT_THREADS)),
+        help=f"Request threads per worker (default: GALLERY_THREADS or {DEFAULT_THREADS})",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.workers > 1 and os.environ.get("GALLERY_SECRET_KEY", DEFAULT_SECRET_KEY) == DEFAULT_SECRET_KEY:
+        print("Warning: GALLERY_SECRET_KEY is not set, sessions use the default key", file=sys.stderr)
+    serve(args.bind, max(1, args.workers), max(1, args.threads))
+
+
+if __name__ == "__main__":
+    main()